@@ -16,8 +16,32 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 from dateutil.relativedelta import relativedelta # Importe no início do seu arquivo
+import os
+import json
+import tempfile
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from storage import (
+    PARTICAO_SEM_DATA, SEM_TERMINO, SEQUENCIA_REGRAS, SheetsStorage, SQLiteStorage, empty_expenses_frame, empty_rules_frame, particao_por_ano,
+)
+from write_queue import WriteBehindQueue
+from ids import IdAllocator
+from watcher import RevisionWatcher
+from store import ExpenseStore
+from cube import SEM_DATA, ano_mes_para_timestamp
+from codec import format_brl, format_datas, parse_brl, parse_datas, texto_sem_nulos
+from metrics import MetricsRegistry, instrumentar_cliente
+from figures import FigureCache
+from sheets import SheetsConnection, SheetsUnavailableError
+from importer import ler_extrato, preparar_importacao
+from export import FORMATOS, exportar
+from schema import unificar_categorias, uso_de_memoria, validar
 
 # ======================== CONFIGURAÇÕES GERAIS ========================
+# Copy-on-write: frames derivados do store compartilhado só são copiados se forem alterados
+pd.set_option("mode.copy_on_write", True)
+
 st.set_page_config(
     layout="wide",
     page_title="💸 FinApp - Controle de Despesas",
@@ -59,105 +83,398 @@ SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/au
 CREDENTIALS_FILE = "organiza-grana-290b193581de.json"
 SHEET_NAME = "controle_despesa"
 WORKSHEET_NAME = "Despesas"
+RULES_WORKSHEET_NAME = "Recorrencias"  # regras de despesas recorrentes (criada na primeira regra)
+IDS_WORKSHEET_NAME = "Ids"  # blocos de id_original já reservados (criada na primeira reserva)
+RULE_IDS_WORKSHEET_NAME = "IdsRecorrencias"  # o mesmo para os id_regra das regras de recorrência
+# Chave da planilha (o id na URL). Também pode vir de `sheet_key` nos Segredos; sem ela,
+# a planilha é aberta pelo título uma única vez por processo.
+SHEET_KEY = os.environ.get("FINAPP_SHEET_KEY", "")
+SHEETS_TIMEOUT = 30  # segundos por requisição HTTP ao Google
+TAMANHO_PAGINA_TABELA = 20
+# Intervalo (em meses) entre as ocorrências de uma despesa recorrente
+PERIODOS_RECORRENCIA = {"Mês": 1, "Bimestre": 2, "Trimestre": 3, "Semestre": 6, "Ano": 12}
+# Anos futuros oferecidos no filtro quando há despesas recorrentes sem término
+ANOS_FUTUROS_RECORRENCIAS = 5
+COLUNAS_EDITAVEIS_TABELA = ["Data", "Categoria", "Tag", "Valor", "Descricao", "Pagamento"]
+COLUNAS_ORDENACAO_TABELA = ["Data", "Valor", "Categoria", "Tag", "Pagamento", "Descricao", "Usuario"]
+SNAPSHOT_DIR = ".cache"
+SNAPSHOT_PARTITIONS_DIR = os.path.join(SNAPSHOT_DIR, "despesas")  # um Parquet por partição (ano)
+SNAPSHOT_CATALOG_FILE = os.path.join(SNAPSHOT_DIR, "catalogo.json")
+SNAPSHOT_RULES_FILE = os.path.join(SNAPSHOT_DIR, "recorrencias.parquet")
+EXPORT_DIR = os.path.join(SNAPSHOT_DIR, "exportacoes")  # arquivos gerados para download
+# Backend de armazenamento: "sheets" (padrão) ou "sqlite" para rodar com um banco local
+STORAGE_BACKEND = os.environ.get("FINAPP_STORAGE", "sheets")
+SQLITE_FILE = os.path.join("data", "despesas.db")
+# Journal da fila de escrita em segundo plano (mutações ainda não enviadas ao backend)
+JOURNAL_FILE = os.path.join("data", "fila_escrita.jsonl")
+# Segundos entre as conferências (só em memória) de cada sessão aberta: quando o store muda
+# de versão, os dashboards são redesenhados e os lançamentos mostram um aviso (ver
+# render_live_refresh). A revisão do backend é consultada à parte (watcher.py).
+INTERVALO_ATUALIZACAO = 5
+# Métricas (painel de diagnóstico): arquivos JSON/Prometheus são gravados neste diretório.
+# Com FINAPP_METRICS_DIR definido, também são regravados automaticamente a cada METRICS_EXPORT_INTERVAL segundos.
+METRICS_DIR = os.environ.get("FINAPP_METRICS_DIR", os.path.join("data", "metricas"))
+METRICS_AUTO_EXPORT = "FINAPP_METRICS_DIR" in os.environ
+METRICS_EXPORT_INTERVAL = 30
+# Navegação: só a visão escolhida é executada a cada rerun (ver main)
+VISTA_DASHBOARDS = "📊 Dashboards"
+VISTA_LANCAMENTOS = "✍️ Lançamentos"
+VISTA_ADICIONAR = "Adicionar Nova Despesa"
+VISTA_TABELA = "Ver Tabela Detalhada"
+VISTA_RECORRENCIAS = "Despesas Recorrentes"
+VISTA_IMPORTAR = "Importar Extrato"
+VISTA_EXPORTAR = "Exportar Dados"
+ESCOPO_FILTRADO = "Despesas filtradas"
+ESCOPO_HISTORICO = "Histórico completo"
+SINAIS_EXTRATO = {"Detectar": None, "Negativos": True, "Positivos": False}  # sinal das despesas no extrato
+# Reexecução parcial: um widget dentro de um fragmento reexecuta só o fragmento, não a página.
+# A 1.35 só tem a versão experimental; nas versões novas ela passou a se chamar st.fragment.
+fragmento = st.fragment if hasattr(st, "fragment") else st.experimental_fragment
 
 # ======================== GOOGLE SHEETS ========================
 @st.cache_resource
-def get_sheets_client():
+def get_sheets_connection():
+    """
+    Conexão com a planilha compartilhada por todas as sessões (ver sheets.py): uma sessão
+    HTTP, planilha/aba em cache e novas tentativas quando a API limita as requisições.
+    """
+    conexao = None
     try:
         # Pega as credenciais diretamente do st.secrets
         creds_dict = st.secrets["google_credentials"]
         creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
         client = gspread.authorize(creds)
-        
-        # Testa a conexão para garantir que as permissões estão corretas
-        client.open(SHEET_NAME)
-        
-        return client
+        client.set_timeout(SHEETS_TIMEOUT)
+        # Cada chamada ao gspread passa a ser contada e cronometrada (ver metrics.py)
+        client = instrumentar_cliente(client, get_metrics())
+        conexao = SheetsConnection(client, SHEET_NAME, st.secrets.get("sheet_key", SHEET_KEY) or None)
+
+        # Testa a conexão para garantir que as permissões estão corretas (e já deixa a planilha em cache)
+        conexao.executar(conexao.spreadsheet)
+
+        return conexao
+    except SheetsUnavailableError:
+        # A API está limitando as requisições agora, o que não é um problema de credenciais:
+        # a conexão é devolvida mesmo assim e as próximas chamadas tentam de novo.
+        st.warning("O Google Sheets está sobrecarregado no momento; os dados podem demorar a atualizar.")
+        return conexao
     except Exception as e:
         # Se qualquer passo acima falhar, mostra um erro claro em vez de entrar em loop
         st.error(f"Falha ao conectar com o Google Sheets: {e}")
         st.warning("Verifique se as credenciais 'google_credentials' nos Segredos estão corretas e se a conta de serviço tem permissão para acessar a planilha.")
         return None # Retorna None para indicar a falha na conexão
 
-@st.cache_data(ttl=300, show_spinner=False)
-def read_sheet_data(_client, sheet_name, worksheet_name):
-    worksheet = _client.open(sheet_name).worksheet(worksheet_name)
-    values = worksheet.get_values(value_render_option="FORMATTED_VALUE")
-    if len(values) < 2:
-        return pd.DataFrame()
-    df = pd.DataFrame(values[1:], columns=values[0])
-    if "id_original" not in df.columns:
-        df["id_original"] = list(range(len(df)))
-    df["id_original"] = pd.to_numeric(df["id_original"], errors="coerce").fillna(-1).astype(int)
-    return df
-
-def write_sheet_data(client, sheet_name, worksheet_name, df):
-    if df.empty:
-        # Se o dataframe estiver vazio após a exclusão, limpamos a planilha e deixamos só o cabeçalho.
-        # Isso pode ser ajustado se o comportamento desejado for outro.
-        try:
-            worksheet = client.open(sheet_name).worksheet(worksheet_name)
-            worksheet.clear()
-            # Se quiser manter o cabeçalho mesmo com a planilha vazia:
-            # worksheet.update([df.columns.tolist()], value_input_option="USER_ENTERED")
-            return True
-        except Exception as e:
-            st.error(f"Erro ao limpar a planilha: {e}")
-            return False
+# ======================== MÉTRICAS ========================
+@st.cache_resource
+def get_metrics():
+    """Registro de métricas compartilhado pelo processo: spans dos reruns e chamadas ao Google Sheets."""
+    return MetricsRegistry()
+
+def _tabela_metricas(series, com_bytes=False):
+    colunas = ["contagem", "erros", "media_ms", "p95_ms", "max_ms"] + (["bytes"] if com_bytes else [])
+    tabela = pd.DataFrame.from_dict(series, orient="index")
+    if tabela.empty:
+        return pd.DataFrame(columns=colunas)
+    return tabela[colunas].sort_values("media_ms", ascending=False)
+
+def render_debug_panel():
+    """Painel de diagnóstico na sidebar, visível apenas para usuários com `admin = true` nos Segredos."""
+    if not st.session_state.get("is_admin", False):
+        return
+    metricas = get_metrics()
+    with st.sidebar.expander("🛠️ Diagnóstico"):
+        st.caption("Último rerun desta sessão (ms)")
+        spans = st.session_state.get("spans_ultimo_rerun", [])
+        if spans:
+            st.dataframe(pd.DataFrame(spans, columns=["Bloco", "ms"]), hide_index=True, use_container_width=True)
+
+        dados = metricas.snapshot()
+        st.caption(f"Blocos, desde {dados['iniciado_em']}")
+        st.dataframe(_tabela_metricas(dados["spans"]), use_container_width=True)
+        st.caption("Chamadas ao Google Sheets")
+        st.dataframe(_tabela_metricas(dados["api"], com_bytes=True), use_container_width=True)
+        figuras = get_figure_cache()
+        st.caption(f"Figuras em cache: {len(figuras)} ({figuras.acertos} acertos, {figuras.faltas} faltas)")
+        particoes = get_expense_store().partitions
+        st.caption("Anos carregados: " + ("todos" if particoes is None else ", ".join(
+            "sem data" if p == PARTICAO_SEM_DATA else str(p) for p in sorted(particoes)
+        )))
+
+        # Esquema compacto do store (ver schema.py): memória por coluna e linhas fora do esperado
+        df = get_expense_store().df
+        memoria = uso_de_memoria(df)
+        st.caption(f"Memória das despesas: {memoria['Bytes'].sum() / 2**10:,.0f} KiB em {len(df)} linhas")
+        st.dataframe(memoria, hide_index=True, use_container_width=True)
+        problemas = validar(df, {"Categoria": CATEGORIAS_PREDEFINIDAS, "Pagamento": PAGAMENTO_PREDEFINIDO})
+        if problemas["sem_data"]:
+            st.caption(f"⚠️ {problemas['sem_data']} despesa(s) sem data válida")
+        for col, valores in problemas["desconhecidos"].items():
+            st.caption(f"⚠️ {col} fora da lista: " + ", ".join(f"{v or '(vazio)'} ({n})" for v, n in valores.items()))
+
+        col1, col2 = st.columns(2)
+        col1.download_button("JSON", metricas.to_json(), file_name="metricas.json", mime="application/json", use_container_width=True)
+        col2.download_button("Prometheus", metricas.to_prometheus(), file_name="metricas.prom", mime="text/plain", use_container_width=True)
+        if col1.button("Gravar em disco", use_container_width=True):
+            try:
+                caminhos = metricas.exportar(METRICS_DIR)
+                st.success("Gravado em " + ", ".join(caminhos))
+            except OSError as e:
+                st.error(f"Erro ao gravar as métricas: {e}")
+        if col2.button("Zerar", use_container_width=True):
+            metricas.reset()
+            st.rerun()
 
-    try:
-        worksheet = client.open(sheet_name).worksheet(worksheet_name)
-        # Manter o backup é uma boa prática caso a escrita falhe.
-        backup = worksheet.get_all_values()
-        try:
-            # --- ESTA É A CORREÇÃO PRINCIPAL ---
-            # 1. Limpa completamente a planilha antes de escrever os novos dados.
-            worksheet.clear()
-            
-            # 2. Prepara os dados (cabeçalho + linhas) e os escreve na planilha agora vazia.
-            data = [df.columns.tolist()] + df.astype(str).values.tolist()
-            worksheet.update(data, value_input_option="USER_ENTERED")
-            return True
-        except Exception as e:
-            # Se a escrita falhar, tenta restaurar o backup.
-            st.error(f"Erro ao salvar dados. Restaurando backup... Erro: {e}")
-            worksheet.clear() # Limpa qualquer escrita parcial.
-            worksheet.update(backup) # Escreve os dados do backup de volta.
+# ======================== ARMAZENAMENTO ========================
+@st.cache_resource
+def get_storage():
+    """
+    Devolve o backend de armazenamento configurado em STORAGE_BACKEND
+    ("sheets" ou "sqlite"), ou None se a conexão com o Google Sheets falhar.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_FILE)
+    conexao = get_sheets_connection()
+    if conexao is None:
+        return None
+    return SheetsStorage(conexao, WORKSHEET_NAME, RULES_WORKSHEET_NAME, IDS_WORKSHEET_NAME, RULE_IDS_WORKSHEET_NAME)
+
+@st.cache_resource
+def get_expense_store():
+    """Store de despesas compartilhado por todas as sessões do processo (ver store.py)."""
+    return ExpenseStore()
+
+@st.cache_resource
+def get_id_allocator():
+    """Alocador de id_original compartilhado pelas sessões (blocos reservados no backend, ver ids.py)."""
+    storage = get_storage()
+    if storage is None:
+        return None
+    return IdAllocator(storage)
+
+@st.cache_resource
+def get_rule_id_allocator():
+    """Como get_id_allocator, para os id_regra das regras de recorrência (contador próprio no backend)."""
+    storage = get_storage()
+    if storage is None:
+        return None
+    return IdAllocator(storage, sequencia=SEQUENCIA_REGRAS)
+
+@st.cache_resource
+def get_write_queue():
+    """Fila de escrita compartilhada por todas as sessões (uma thread de fundo por processo)."""
+    storage = get_storage()
+    if storage is None:
+        return None
+    store = get_expense_store()
+
+    def ao_sincronizar():
+        # Com a fila vazia o backend contém exatamente o estado do store na revisão que a
+        # própria escrita produziu: ela é registrada e o snapshot local atualizado, para que
+        # não seja preciso baixar tudo de novo. Sem essa garantia (outra pessoa gravou no
+        # meio, ou o backend não informa a revisão da escrita, como o Sheets) o store fica
+        # com a revisão antiga e o vigia de revisão recarrega o estado do backend (on_stale).
+        if fila.pending_count():
+            return
+        revision = fila.revisao_sincronizada
+        df, regras, particoes, catalogo = store.contents()
+        if revision is not None:
+            store.mark_synced(revision)
+            save_snapshot(df, regras, particoes, catalogo, revision)
+        else:
+            # Nenhum snapshot é gravado; o cache dos anos fechados, que vale para qualquer
+            # revisão, pode estar sem as nossas escritas e também é descartado. Uma entrada
+            # recusada pelo backend não muda a revisão dele: sem a revisão o store recarrega
+            store.mark_stale()
+            discard_closed_partitions_snapshot(df, particoes)
+
+    fila = WriteBehindQueue(storage, JOURNAL_FILE, on_flush=ao_sincronizar)
+    return fila
+
+@st.cache_resource
+def get_revision_watcher():
+    """
+    Vigia da revisão do backend (uma thread por processo, ver watcher.py). Quando outra
+    pessoa grava, recarrega o store compartilhado em segundo plano; as sessões abertas
+    percebem a nova versão em render_live_refresh.
+    """
+    storage = get_storage()
+    if storage is None:
+        return None
+    store = get_expense_store()
+    fila = get_write_queue()
+
+    def ao_mudar(revision):
+        # Com alterações na fila o store está à frente do backend: tenta de novo na próxima consulta
+        if not store.loaded or fila.pending_count():
             return False
-    except Exception as e:
-        st.error(f"Erro geral ao interagir com o Google Sheets: {e}")
-        return False
+        with store.load_lock:
+            if revision != store.revision:
+                recarregar_store(storage, store, revision)
+        return True
+
+    vigia = RevisionWatcher(storage, ao_mudar)
+    # A fila esvaziou sem uma revisão exata para o store (ver get_write_queue): recarrega já
+    fila.on_stale = vigia.verificar_agora
+    return vigia
+
+# ======================== SNAPSHOT LOCAL ========================
+# Cópia tipada (Parquet) das despesas, uma partição (ano) por arquivo, e das regras de
+# recorrência, marcadas com a revisão do backend (modifiedTime do Drive, no caso do Sheets),
+# mais um catálogo com as partições existentes. Evita baixar e reinterpretar a planilha
+# quando nada mudou.
+#
+# Os anos já encerrados são tratados como imutáveis: o arquivo deles vale para qualquer
+# revisão e só é regravado (ou apagado) quando este processo altera despesas desses anos.
+
+def particao_fechada(particao):
+    """Anos anteriores ao corrente, cujo cache local vale para qualquer revisão."""
+    return PARTICAO_SEM_DATA < particao < date.today().year
+
+def particoes_iniciais():
+    """Partições carregadas na abertura do app: o ano corrente e as despesas sem data."""
+    return [PARTICAO_SEM_DATA, date.today().year]
+
+def _arquivo_particao(particao):
+    return os.path.join(SNAPSHOT_PARTITIONS_DIR, f"{particao}.parquet")
+
+def _ler_parquet(caminho, revision):
+    """DataFrame do arquivo, ou None se ele não existir ou for de outra revisão."""
+    if not os.path.exists(caminho):
+        return None
+    try:
+        table = pq.read_table(caminho, memory_map=True)
+    except Exception:
+        return None
+    metadata = table.schema.metadata or {}
+    revisao_salva = metadata.get(b"revision", b"").decode()
+    if revision is not None and revisao_salva != revision:
+        return None
+    return table.to_pandas()
+
+def _ler_catalogo(revision):
+    try:
+        with open(SNAPSHOT_CATALOG_FILE, encoding="utf-8") as f:
+            catalogo = json.load(f)
+    except (OSError, ValueError):
+        return None
+    revisao_salva = catalogo.pop("revision", None)
+    if revision is not None and revisao_salva != revision:
+        return None
+    return catalogo
+
+def load_partitions_snapshot(particoes, revision=None):
+    """
+    Lê do cache local as partições pedidas e devolve (despesas, partições encontradas).
+    Anos fechados são aceitos em qualquer revisão; os demais só na `revision` informada
+    (ou em qualquer uma, se ela for None).
+    """
+    frames, encontradas = [], []
+    for particao in particoes:
+        df = _ler_parquet(_arquivo_particao(particao), None if particao_fechada(particao) else revision)
+        if df is not None:
+            encontradas.append(particao)
+            if not df.empty:
+                frames.append(df)
+    df = pd.concat(frames, ignore_index=True) if frames else empty_expenses_frame()
+    return df, encontradas
+
+def load_snapshot(revision=None):
+    """
+    Lê o snapshot local das partições iniciais como (despesas, regras, catálogo). Se `revision`
+    for informada, só devolve o snapshot se ele corresponder a essa revisão; caso contrário devolve None.
+    """
+    catalogo = _ler_catalogo(revision)
+    if catalogo is None:
+        return None
+    regras = _ler_parquet(SNAPSHOT_RULES_FILE, revision)
+    if regras is None:
+        if revision is not None:
+            return None  # snapshot sem as regras desta revisão: incompleto
+        regras = empty_rules_frame()
+    particoes = [p for p in particoes_iniciais() if p in catalogo["particoes"]]
+    df, encontradas = load_partitions_snapshot(particoes, revision)
+    if len(encontradas) < len(particoes):
+        return None
+    return df, regras, catalogo
+
+def _gravar_parquet(df, caminho, revision):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"revision"] = revision.encode()
+    table = table.replace_schema_metadata(metadata)
+    tmp = caminho + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, caminho)
+
+def save_partitions_snapshot(df, particoes, revision):
+    """Grava um arquivo por partição pedida com as linhas de `df` que pertencem a ela."""
+    os.makedirs(SNAPSHOT_PARTITIONS_DIR, exist_ok=True)
+    por_particao = particao_por_ano(df["Data"]).to_numpy()
+    for particao in particoes:
+        _gravar_parquet(df[por_particao == particao].reset_index(drop=True), _arquivo_particao(particao), revision)
+
+def discard_closed_partitions_snapshot(df, particoes):
+    """
+    Apaga o cache dos anos fechados presentes em `df` ou carregados (`particoes`, None
+    para todos os do cache): como vale para qualquer revisão, só pode ficar se refletir
+    exatamente o backend.
+    """
+    try:
+        if particoes is None:
+            arquivos = os.listdir(SNAPSHOT_PARTITIONS_DIR) if os.path.isdir(SNAPSHOT_PARTITIONS_DIR) else []
+            particoes = [int(nome.split(".")[0]) for nome in arquivos if nome.endswith(".parquet")]
+        for particao in set(particao_por_ano(df["Data"]).unique().tolist()) | set(particoes):
+            if particao_fechada(particao) and os.path.exists(_arquivo_particao(particao)):
+                os.remove(_arquivo_particao(particao))
+    except Exception:
+        # Como em save_snapshot: se falhar, no pior caso um ano fechado é relido do cache antigo
+        pass
+
+def save_snapshot(df, regras, particoes, catalogo, revision):
+    """
+    Grava o snapshot de forma atômica (arquivo temporário + rename): regras, uma partição
+    por arquivo para cada partição carregada (`particoes`, None para todas) e o catálogo.
+    """
+    if revision is None:
+        return
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        presentes = set(particao_por_ano(df["Data"]).unique().tolist())
+        carregadas = presentes | set(catalogo["particoes"]) if particoes is None else set(particoes)
+        # As regras primeiro: um snapshot de despesas novo com regras antigas seria recusado pela revisão
+        _gravar_parquet(regras, SNAPSHOT_RULES_FILE, revision)
+        # Linhas novas em partições não carregadas: o cache dessas partições ficou sem elas
+        for particao in presentes - carregadas:
+            if os.path.exists(_arquivo_particao(particao)):
+                os.remove(_arquivo_particao(particao))
+        save_partitions_snapshot(df, carregadas, revision)
+        catalogo = {
+            "particoes": sorted(set(catalogo["particoes"]) | presentes),
+            "maior_id": max(catalogo["maior_id"], int(df["id_original"].max()) if not df.empty else -1),
+            "revision": revision,
+        }
+        tmp = SNAPSHOT_CATALOG_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(catalogo, f)
+        os.replace(tmp, SNAPSHOT_CATALOG_FILE)
+    except Exception:
+        # O snapshot é apenas uma otimização: se falhar, a próxima leitura vai à planilha.
+        pass
 
 # ======================== UTILS ========================
 
+# Conversões de moeda e datas no padrão brasileiro ficam em codec.py (vetorizadas);
+# as duas funções abaixo são atalhos para um valor só.
+
 def format_currency_brl(value):
     """Formata um número para o padrão de moeda brasileiro (R$ 1.234,56)"""
-    if not isinstance(value, (int, float)):
+    if not isinstance(value, (int, float, np.number)):
         return "R$ 0,00"
-    # Formata o número com separador de milhar (,) e 2 casas decimais (.)
-    # Ex: 1234.56 -> "1,234.56"
-    valor_formatado = f"{value:,.2f}"
-    # Troca os separadores para o padrão brasileiro
-    # "1,234.56" -> "1.234,56"
-    valor_formatado_br = valor_formatado.replace(",", "X").replace(".", ",").replace("X", ".")
-    return f"R$ {valor_formatado_br}"
+    return format_brl([value]).iloc[0]
 
 def safe_parse_value(value):
     """Converte de forma segura um valor que pode ser um texto em pt-BR para float."""
-    if value is None or (isinstance(value, float) and np.isnan(value)):
-        return 0.0
-    if isinstance(value, (int, float)):
-        return round(value, 2)
-    if isinstance(value, str):
-        if not value.strip():
-            return 0.0
-        try:
-            # Substitui o ponto de milhar por nada e a vírgula de decimal por ponto
-            clean_str = value.replace('.', '').replace(',', '.')
-            return round(float(clean_str), 2)
-        except (ValueError, TypeError):
-            return 0.0
-    return 0.0
+    return float(parse_brl(pd.Series([value], dtype=object)).iloc[0])
 
 def are_dataframes_equal(df1, df2):
     # Se os dataframes não tiverem o mesmo formato, são diferentes
@@ -224,6 +541,7 @@ def authenticate_user():
                             if user in users and users[user]["senha"] == pw:
                                 st.session_state.authenticated = True
                                 st.session_state.user_display = users[user]["nome"]
+                                st.session_state.is_admin = bool(users[user].get("admin", False))
                                 # Limpa os campos de input do estado da sessão
                                 del st.session_state.user_input
                                 del st.session_state.password_input
@@ -238,48 +556,316 @@ def authenticate_user():
     return st.session_state.user_display, True
 
 # ======================== FUNÇÕES PRINCIPAIS ========================
-def load_expenses():
-    client = get_sheets_client()
-    
-    # Se a conexão falhou, o client será None.
-    if client is None:
-        # Para o app não quebrar, criamos um DataFrame vazio e paramos a execução aqui.
-        st.session_state["expenses_df"] = pd.DataFrame(columns=["Data", "Categoria", "Valor", "Descricao", "Pagamento", "Usuario", "id_original"])
+def _carregar_ultimo_snapshot(store):
+    """Sem o backend, publica o último snapshot local (qualquer revisão) ou, sem ele, um store vazio."""
+    snapshot = load_snapshot()
+    if snapshot is None:
+        store.replace(empty_expenses_frame(), regras=empty_rules_frame())
         return
+    df, regras, catalogo = snapshot
+    store.replace(df, regras=regras, particoes=particoes_iniciais(), catalogo=catalogo)
 
-    df = read_sheet_data(client, SHEET_NAME, WORKSHEET_NAME)
-    if df.empty:
-        df = pd.DataFrame(columns=["Data", "Categoria", "Valor", "Descricao", "Pagamento", "Usuario", "id_original"])
-    else:
-        if "Valor" in df.columns:
-            df["Valor"] = df["Valor"].astype(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
-            df["Valor"] = pd.to_numeric(df["Valor"], errors='coerce').fillna(0).round(2)
-        
-        if "Data" in df.columns:
-            df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
+def load_expenses():
+    """
+    Garante que o store compartilhado esteja carregado e atualizado.
+
+    Só vai ao backend se o store ainda estiver vazio ou se a revisão do backend
+    mudou; nesses casos tenta primeiro o snapshot local da mesma revisão. Só as
+    partições iniciais (ano corrente e despesas sem data) são carregadas; os outros
+    anos entram sob demanda (ver garantir_particoes). Depois da primeira carga da
+    sessão, quem mantém o store atualizado é o vigia de revisão (get_revision_watcher).
+    """
+    store = get_expense_store()
+    storage = get_storage()
+
+    with store.load_lock:
+        # Se a conexão falhou, o storage será None.
+        if storage is None:
+            if not store.loaded:
+                # Sem conexão, usamos o último snapshot local (qualquer revisão) se existir.
+                # Caso contrário, criamos um DataFrame vazio para o app não quebrar.
+                _carregar_ultimo_snapshot(store)
+            return
+
+        # Com alterações ainda na fila, o backend está atrás do store: não recarrega.
+        fila = get_write_queue()
+        if store.loaded and fila is not None and fila.pending_count():
+            return
+
+        revision = storage.revision()
+        if store.loaded and (revision is None or revision == store.revision):
+            # Sem revisão (API indisponível) mantém os dados atuais em vez de baixar tudo de novo
+            return
+
+        try:
+            recarregar_store(storage, store, revision)
+        except SheetsUnavailableError:
+            # Muitas sessões ao mesmo tempo ou limite da API: segue com o último snapshot
+            if not store.loaded:
+                _carregar_ultimo_snapshot(store)
+            st.warning("O Google Sheets está sobrecarregado no momento; exibindo os últimos dados carregados.")
+        except Exception as e:
+            st.error(f"Erro ao carregar as despesas: {e}")
+            if not store.loaded:
+                store.replace(empty_expenses_frame())
+
+
+def recarregar_store(storage, store, revision):
+    """
+    Publica no store as despesas da revisão informada (só as partições iniciais): do
+    snapshot local dessa revisão, se houver, ou do backend. Chamado com `store.load_lock`
+    adquirido, também da thread do vigia de revisão: não usa st.*, e os erros do backend
+    sobem para quem chamou.
+    """
+    # Se os dados não mudaram desde o último snapshot, ele é usado sem baixar nada.
+    if revision is not None:
+        snapshot = load_snapshot(revision)
+        if snapshot is not None:
+            df, regras, catalogo = snapshot
+            store.replace(df, revision, regras, particoes_iniciais(), catalogo)
+            return
+
+    catalogo, df = storage.load_with_catalog(particoes_iniciais())
+    regras = storage.load_rules()
+    save_snapshot(df, regras, particoes_iniciais(), catalogo, revision)
+    store.replace(df, revision, regras, particoes_iniciais(), catalogo)
+
+
+def _carregar_particoes(storage, store, particoes, ao_receber=None):
+    """
+    Carrega no store as partições (anos) pedidas que ainda faltam: do cache local quando
+    possível (anos fechados valem para qualquer revisão) e, para o resto, do backend
+    (`ao_receber` recebe os blocos à medida que chegam). Chamado com `store.load_lock`
+    adquirido; não usa st.*. Devolve o erro do backend, ou None.
+    """
+    faltando = store.missing_partitions(particoes)
+    # Partições que não existem no backend não têm o que carregar
+    existentes = [p for p in faltando if p in store.catalog["particoes"]]
+    df, do_cache = load_partitions_snapshot(existentes, store.revision)
+    frames = [df]
+    carregadas = [p for p in faltando if p not in existentes or p in do_cache]
+    erro = None
+
+    do_backend = [p for p in existentes if p not in do_cache]
+    if do_backend and storage is not None:
+        try:
+            df = storage.load(do_backend, ao_receber=ao_receber)
+        except Exception as e:
+            erro = e
+        else:
+            frames.append(df)
+            carregadas += do_backend
+            # Só os anos fechados vão para o cache aqui; os demais seguem a revisão do snapshot
+            fechadas = [p for p in do_backend if particao_fechada(p)]
+            if fechadas:
+                try:
+                    save_partitions_snapshot(df, fechadas, store.revision or "")
+                except Exception:
+                    pass
+
+    store.add_partitions(pd.concat([f for f in frames if not f.empty] or [empty_expenses_frame()], ignore_index=True), carregadas)
+    return erro
+
+
+def garantir_particoes(particoes):
+    """
+    Carrega no store as partições (anos) pedidas que ainda faltam, esperando terminar.
+    Devolve False se alguma não pôde ser carregada agora.
+    """
+    store = get_expense_store()
+    if not store.missing_partitions(particoes):
+        return True
+
+    with store.load_lock:
+        with st.spinner("Carregando despesas de outros anos..."):
+            erro = _carregar_particoes(get_storage(), store, particoes)
+    if isinstance(erro, SheetsUnavailableError):
+        st.warning("O Google Sheets está sobrecarregado no momento; parte do histórico não foi carregada.")
+    elif erro is not None:
+        st.error(f"Erro ao carregar as despesas: {erro}")
+    return not store.missing_partitions(particoes)
 
-    st.session_state["expenses_df"] = df
 
+@st.cache_resource
+def get_history_loads():
+    """Partições sendo carregadas em segundo plano e o último erro, compartilhados pelas sessões."""
+    return {"lock": threading.Lock(), "particoes": set(), "erro": None}
+
+
+def carregar_particoes_em_segundo_plano(particoes):
+    """
+    Como garantir_particoes, mas sem bloquear a página: uma thread carrega as partições
+    que faltam e cada bloco lido entra no store assim que chega (os mais recentes
+    primeiro). Os dashboards abertos são redesenhados a cada bloco (ver render_live_refresh).
+    Devolve True se já estão todas carregadas.
+    """
+    store = get_expense_store()
+    if not store.missing_partitions(particoes):
+        return True
+
+    cargas = get_history_loads()
+    with cargas["lock"]:
+        novas = [p for p in store.missing_partitions(particoes) if p not in cargas["particoes"]]
+        cargas["particoes"].update(novas)
+    if novas:
+        storage = get_storage()
+
+        def carregar():
+            try:
+                with store.load_lock:
+                    # Os blocos entram sem marcar a partição como carregada; isso só acontece no fim
+                    erro = _carregar_particoes(storage, store, novas, ao_receber=lambda bloco: store.add_partitions(bloco, []))
+                cargas["erro"] = None if erro is None else f"{type(erro).__name__}: {erro}"
+            finally:
+                with cargas["lock"]:
+                    cargas["particoes"].difference_update(novas)
+
+        threading.Thread(target=carregar, name="historico", daemon=True).start()
+
+    if cargas["erro"]:
+        st.warning(f"Parte do histórico não foi carregada: {cargas['erro']}")
+    return False
+
+
+def save_expenses(novas=None, alteradas=None, excluidas=None, novas_regras=None, regras_excluidas=None, originais=None):
+    """
+    Envia as mudanças para a fila de escrita, que as aplica no backend em segundo plano.
+
+    Quando as mudanças são informadas (linhas novas, linhas alteradas, ids excluídos e/ou
+    regras de recorrência novas ou excluídas), apenas elas são enfileiradas. Sem argumentos,
+    todas as despesas são regravadas a partir do store compartilhado.
 
-def save_expenses():
-    client = get_sheets_client()
-    df = st.session_state.get("expenses_df", pd.DataFrame()).copy()
-    if df.empty or len(df) < 1:
-        st.warning("Nenhuma despesa para salvar ou DataFrame inconsistente.")
+    Cada mudança leva a revisão do backend que o store tinha carregado e as edições levam as
+    linhas `originais`: assim quem salva ao mesmo tempo não apaga as alterações dos outros
+    (ver WriteBehindQueue).
+    """
+    fila = get_write_queue()
+    if fila is None:
         return False
-    # ✅ Garante que a coluna "Data" está no formato datetime
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
-    df["Data"] = df["Data"].dt.strftime("%Y-%m-%d")
-    df["Valor"] = df["Valor"].apply(lambda x: f"{x:.2f}".replace(".", ","))
-    return write_sheet_data(client, SHEET_NAME, WORKSHEET_NAME, df)
+    revisao = get_expense_store().revision
 
+    try:
+        if all(arg is None for arg in (novas, alteradas, excluidas, novas_regras, regras_excluidas)):
+            # Regravar tudo exige o histórico inteiro, não só os anos já carregados
+            if not garantir_particoes(get_expense_store().catalog["particoes"]):
+                st.warning("Não foi possível carregar todo o histórico para regravar os dados.")
+                return False
+            df = get_expense_store().df
+            if df.empty or len(df) < 1:
+                st.warning("Nenhuma despesa para salvar ou DataFrame inconsistente.")
+                return False
+            fila.replace_all(df, revisao=revisao)
+            return True
 
-def get_next_id():
-    df = st.session_state.get("expenses_df", pd.DataFrame())
-    return int(df["id_original"].max()) + 1 if not df.empty else 0
+        if excluidas:
+            fila.delete(excluidas, revisao=revisao)
+        if alteradas is not None and not alteradas.empty:
+            fila.update(alteradas, originais=originais, revisao=revisao)
+        if novas is not None and not novas.empty:
+            fila.append(novas, revisao=revisao)
+        if regras_excluidas:
+            fila.delete_rules(regras_excluidas, revisao=revisao)
+        if novas_regras is not None and not novas_regras.empty:
+            fila.append_rules(novas_regras, revisao=revisao)
+        return True
+    except OSError as e:
+        st.error(f"Erro ao registrar as alterações no journal local: {e}")
+        return False
+
+
+def render_sync_status():
+    """Mostra na sidebar se há alterações aguardando envio para o backend."""
+    fila = get_write_queue()
+    if fila is None:
+        return
+    status = fila.status()
+    if status["conflitos"]:
+        ids = ", ".join(str(id_) for id_ in status["conflitos"][:10])
+        mais = f" e mais {len(status['conflitos']) - 10}" if len(status["conflitos"]) > 10 else ""
+        st.sidebar.warning(
+            f"Outra pessoa alterou as mesmas células de {len(status['conflitos'])} despesa(s) "
+            f"(id {ids}{mais}); ficaram os valores dela. Confira e edite de novo se necessário."
+        )
+        if st.sidebar.button("Entendi", key="confirmar_conflitos"):
+            fila.clear_conflicts()
+            st.rerun()
+    if status["falhas"]:
+        ultima = status["falhas"][-1]
+        st.sidebar.warning(
+            f"{len(status['falhas'])} alteração(ões) recusada(s) pelo backend foram descartadas "
+            f"(a última às {ultima['quando'][11:16]}: {ultima['erro']}). Os dados foram recarregados; "
+            f"as alterações ficaram guardadas em {fila.falhas_path}."
+        )
+        if st.sidebar.button("Descartar", key="descartar_falhas"):
+            fila.clear_failed()
+            st.rerun()
+    if status["pendentes"]:
+        st.sidebar.caption(f"🔄 {status['pendentes']} alteração(ões) aguardando sincronização")
+        if status["erro"]:
+            st.sidebar.warning(f"Falha ao sincronizar: {status['erro']}")
+            if st.sidebar.button("Regravar todos os dados"):
+                save_expenses()
+                st.rerun()
+        return
+
+    vigia = get_revision_watcher()
+    if vigia is not None and vigia.ultima_verificacao is not None:
+        st.sidebar.caption(f"✅ Dados sincronizados (verificado às {vigia.ultima_verificacao:%H:%M:%S})")
+        return
+    st.sidebar.caption("✅ Dados sincronizados")
+
+
+@fragmento(run_every=INTERVALO_ATUALIZACAO)
+def render_live_refresh():
+    """
+    Percebe quando o store compartilhado muda de versão: dados de outras pessoas recarregados
+    pelo vigia de revisão, gravados por outra sessão deste processo ou carregados em segundo
+    plano. Nos dashboards, que são só leitura, a página é reexecutada na hora. Nos
+    lançamentos um rerun recriaria a grade (reload_data) e os formulários, descartando
+    edições ainda não salvas: a sessão só é avisada e recarrega quando quiser.
+    """
+    if get_expense_store().version == st.session_state.get("versao_exibida"):
+        return
+    if st.session_state.get("vista", VISTA_DASHBOARDS) == VISTA_DASHBOARDS:
+        st.rerun()
+    col_aviso, col_botao = st.columns([4, 1])
+    col_aviso.info("🔄 Há dados atualizados. Salve o que estiver editando antes de recarregar.")
+    if col_botao.button("Recarregar", key="recarregar_dados"):
+        st.rerun()
+
+
+def get_next_id(quantidade=1):
+    """
+    Primeiro de `quantidade` id_original consecutivos para despesas novas, de um bloco
+    reservado no backend: sessões e processos diferentes nunca recebem o mesmo id.
+    """
+    alocador = get_id_allocator()
+    if alocador is not None:
+        try:
+            return alocador.allocate(quantidade)
+        except SheetsUnavailableError:
+            pass
+    # Sem backend, segue o maior id conhecido (a despesa vai para a fila até a conexão voltar).
+    # Os anos ainda não carregados podem ter ids maiores: o catálogo guarda o maior do backend
+    store = get_expense_store()
+    maior = max(store.catalog["maior_id"], int(store.df["id_original"].max()) if not store.df.empty else -1)
+    return maior + 1
+
+def get_next_rule_id():
+    """id_regra para uma regra nova, reservado no backend como os de get_next_id."""
+    alocador = get_rule_id_allocator()
+    if alocador is not None:
+        try:
+            return alocador.allocate()
+        except SheetsUnavailableError:
+            pass
+    # Sem backend, segue a maior regra conhecida (todas as regras ficam carregadas no store)
+    regras = get_expense_store().rules
+    return int(regras["id_regra"].max()) + 1 if not regras.empty else 0
 
 from dateutil.relativedelta import relativedelta
 
+@fragmento
 def render_new_expense_form(user_display):
     st.subheader("Adicionar Nova Despesa")
 
@@ -330,11 +916,15 @@ def render_new_expense_form(user_display):
 
             pagamento = st.radio("Pagamento", PAGAMENTO_PREDEFINIDO, horizontal=True)
 
-            quantidade_parcelas = 1
             if st.session_state.get("recorrente_checkbox"):
-                quantidade_parcelas = st.number_input(
-                    "Número de parcelas", min_value=2, max_value=60, value=2, step=1, key="quantidade_parcelas"
-                )
+                col_parcelas, col_periodo = st.columns(2)
+                with col_parcelas:
+                    st.number_input(
+                        "Número de parcelas", min_value=2, max_value=60, value=2, step=1, key="quantidade_parcelas"
+                    )
+                with col_periodo:
+                    st.selectbox("Repetir a cada", list(PERIODOS_RECORRENCIA), key="periodo_recorrencia")
+                st.checkbox("Sem data de término", key="recorrente_sem_termino")
 
             submitted = st.form_submit_button("Adicionar Despesa", use_container_width=True)
 
@@ -343,51 +933,305 @@ def render_new_expense_form(user_display):
                 categoria_final = st.session_state.get("form_categoria")
                 is_recorrente = st.session_state.get("recorrente_checkbox", False)
                 
+                campos = {
+                    "Categoria": categoria_final,
+                    "Tag": tag_selecionada if tag_selecionada != "Nenhuma" else "",
+                    "Valor": valor, "Descricao": descricao,
+                    "Pagamento": pagamento, "Usuario": user_display,
+                }
+
                 if is_recorrente:
-                    num_parcelas = st.session_state.get("quantidade_parcelas", 2)
+                    # A despesa recorrente é gravada como uma regra (uma linha só); as parcelas
+                    # são ocorrências expandidas em memória (ver recurrence.py)
+                    sem_termino = st.session_state.get("recorrente_sem_termino", False)
+                    nova_regra = pd.DataFrame([{
+                        "id_regra": get_next_rule_id(), "Inicio": pd.to_datetime(data),
+                        "Periodo": PERIODOS_RECORRENCIA[st.session_state.get("periodo_recorrencia", "Mês")],
+                        "Ocorrencias": SEM_TERMINO if sem_termino else st.session_state.get("quantidade_parcelas", 2),
+                        **campos,
+                    }])
+                    get_expense_store().apply(novas_regras=nova_regra)
+                    salvo = save_expenses(novas_regras=nova_regra)
+                    mensagem = "Despesa recorrente adicionada com sucesso!"
                 else:
-                    num_parcelas = 1
-
-                # Lógica de criação das despesas (continua a mesma)
-                despesas_para_adicionar = []
-                proximo_id = get_next_id()
-                for i in range(num_parcelas):
-                    # ... (resto da sua lógica para popular nova_despesa) ...
-                    nova_despesa = {
-                        "Data": pd.to_datetime(data + relativedelta(months=i)), "Categoria": categoria_final,
-                        "Tag": tag_selecionada if tag_selecionada != "Nenhuma" else "",
-                        "Valor": valor, "Descricao": f"{descricao} ({i+1}/{num_parcelas})" if is_recorrente and num_parcelas > 1 else descricao,
-                        "Pagamento": pagamento, "Usuario": user_display, "id_original": proximo_id + i
-                    }
-                    despesas_para_adicionar.append(nova_despesa)
-                    
-                novas_despesas_df = pd.DataFrame(despesas_para_adicionar)
-                st.session_state["expenses_df"] = pd.concat([st.session_state["expenses_df"], novas_despesas_df], ignore_index=True)
+                    nova_despesa = pd.DataFrame([{"Data": pd.to_datetime(data), **campos, "id_original": get_next_id()}])
+                    get_expense_store().apply(novas=nova_despesa)
+                    salvo = save_expenses(novas=nova_despesa)
+                    mensagem = "Despesa adicionada com sucesso!"
                 st.session_state.submission_success = True
 
-                if save_expenses():
-                    st.success(f"{num_parcelas} despesa(s) adicionada(s) com sucesso!")
-                    read_sheet_data.clear()
-                    time.sleep(1)
+                if salvo:
+                    # A gravação segue em segundo plano; o toast sobrevive ao rerun
+                    st.toast(mensagem, icon="✅")
                     st.rerun()
                 else:
                     st.error("Erro ao salvar despesa.")
 
-def render_expense_table(df_para_exibir):
+@fragmento
+def render_recurring_rules():
+    """Lista as regras de despesas recorrentes e permite excluí-las (com todas as suas parcelas)."""
+    st.subheader("Despesas Recorrentes")
+    regras = get_expense_store().rules
+    if regras.empty:
+        st.info("Nenhuma despesa recorrente cadastrada.")
+        return
+    st.caption("Cada regra gera suas parcelas nos dashboards, sem ocupar uma linha por parcela na planilha.")
+
+    nomes_periodos = {meses: nome for nome, meses in PERIODOS_RECORRENCIA.items()}
+    exibir = pd.DataFrame({
+        "Início": format_datas(regras["Inicio"]),
+        "Repetir a cada": regras["Periodo"].map(lambda meses: nomes_periodos.get(meses, f"{meses} meses")),
+        "Parcelas": regras["Ocorrencias"].astype(str).replace(str(SEM_TERMINO), "Sem término"),
+        "Categoria": regras["Categoria"], "Descricao": regras["Descricao"],
+        "Valor": format_brl(regras["Valor"]), "Usuario": regras["Usuario"],
+    })
+    st.dataframe(exibir, hide_index=True, use_container_width=True)
+
+    rotulos = dict(zip(regras["id_regra"].astype(int), regras["Descricao"] + " — " + exibir["Valor"]))
+    selecionadas = st.multiselect("Regras para excluir", list(rotulos), format_func=rotulos.get)
+    if st.button("Excluir regras selecionadas", disabled=not selecionadas):
+        get_expense_store().apply(regras_excluidas=selecionadas)
+        if save_expenses(regras_excluidas=selecionadas):
+            st.toast(f"{len(selecionadas)} regra(s) excluída(s).", icon="🗑️")
+            st.rerun()
+        else:
+            st.error("Erro ao excluir as regras.")
+
+@fragmento
+def render_import(user_display):
+    """
+    Importa um extrato (CSV ou OFX) do banco ou do cartão: lê o arquivo em blocos, sugere
+    Categoria/Tag, descarta o que já foi lançado e grava tudo de uma vez (um único append).
+    """
+    st.subheader("Importar Extrato")
+    st.caption("Arquivos CSV (com colunas de data, descrição e valor) ou OFX exportados pelo banco ou pelo cartão.")
+
+    # A chave muda a cada importação para limpar o arquivo enviado
+    rodada = st.session_state.get("importacoes", 0)
+    arquivo = st.file_uploader("Arquivo do extrato", type=["csv", "ofx"], key=f"importacao_arquivo_{rodada}")
+    col_pagamento, col_sinal = st.columns(2)
+    with col_pagamento:
+        pagamento = st.radio("Pagamento", PAGAMENTO_PREDEFINIDO, horizontal=True, key="importacao_pagamento")
+    with col_sinal:
+        sinal = st.radio("Despesas aparecem com valores", list(SINAIS_EXTRATO), horizontal=True, key="importacao_sinal")
+    if arquivo is None:
+        return
+
+    # O arquivo é lido uma vez só; os reruns do fragmento reaproveitam o extrato já convertido
+    identificador = (arquivo.name, arquivo.size, getattr(arquivo, "file_id", None))
+    lido = st.session_state.get("importacao_extrato")
+    if lido is None or lido[0] != identificador:
+        try:
+            lido = (identificador, ler_extrato(arquivo, arquivo.name))
+        except (ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+            st.error(f"Não foi possível ler o extrato: {e}")
+            return
+        st.session_state["importacao_extrato"] = lido
+    extrato = lido[1]
+
+    # A deduplicação compara com as despesas dos anos do extrato, que precisam estar carregados
+    anos = particao_por_ano(extrato["Data"]).unique().tolist()
+    garantir_particoes([ano for ano in anos if ano != PARTICAO_SEM_DATA])
+    # Os ids definitivos só são reservados na importação: a prévia é refeita a cada rerun
+    novas, resumo = preparar_importacao(
+        extrato, get_expense_store().df, pagamento, user_display, 0, SINAIS_EXTRATO[sinal]
+    )
+    st.info(
+        f"{resumo['lidas']} lançamento(s) lido(s): {resumo['novas']} novo(s), {resumo['duplicadas']} já lançado(s) "
+        f"e {resumo['ignoradas']} ignorado(s) (créditos, pagamentos ou linhas sem data)."
+    )
+    if novas.empty:
+        return
+
+    # Categoria e Tag sugeridas (pelo histórico ou por palavras-chave) podem ser corrigidas antes de gravar
+    revisadas = st.data_editor(
+        novas, hide_index=True, use_container_width=True, key=f"importacao_revisao_{rodada}",
+        column_order=["Data", "Descricao", "Valor", "Categoria", "Tag"],
+        disabled=["Data", "Descricao", "Valor"],
+        column_config={
+            "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+            "Valor": st.column_config.NumberColumn("Valor (R$)", format="%.2f"),
+            "Categoria": st.column_config.SelectboxColumn("Categoria", options=CATEGORIAS_PREDEFINIDAS, required=True),
+        },
+    )
+    if st.button(f"Importar {len(revisadas)} despesa(s)", type="primary"):
+        inicio = get_next_id(len(revisadas))
+        revisadas = revisadas.assign(id_original=np.arange(inicio, inicio + len(revisadas), dtype=int))
+        get_expense_store().apply(novas=revisadas)
+        if save_expenses(novas=revisadas):
+            st.session_state["importacoes"] = rodada + 1
+            st.session_state.pop("importacao_extrato", None)
+            st.toast(f"{len(revisadas)} despesa(s) importada(s).", icon="✅")
+            st.rerun()
+        else:
+            st.error("Erro ao importar as despesas.")
+
+@fragmento
+def render_export(df_filtrado, filtros):
+    """
+    Exporta as despesas filtradas (as mesmas dos dashboards) ou o histórico completo em CSV,
+    XLSX ou Parquet. O arquivo só é gerado quando pedido, em blocos e direto no disco (ver
+    export.py); o botão de download lê esse arquivo enquanto ele corresponder à escolha atual.
+    """
+    st.subheader("Exportar Despesas")
+    col_escopo, col_formato = st.columns(2)
+    with col_escopo:
+        escopo = st.radio("Conteúdo", [ESCOPO_FILTRADO, ESCOPO_HISTORICO], horizontal=True, key="exportacao_escopo")
+    with col_formato:
+        formato = st.radio("Formato", list(FORMATOS), horizontal=True, key="exportacao_formato")
+    extensao, mime = FORMATOS[formato]
+    store = get_expense_store()
+    gerada = st.session_state.get("exportacao")
+
+    if st.button("Gerar arquivo"):
+        if escopo == ESCOPO_HISTORICO:
+            if not garantir_particoes(store.catalog["particoes"]):
+                st.warning("Parte do histórico não pôde ser carregada; tente novamente em instantes.")
+                return
+            df = store.df
+        else:
+            df = df_filtrado
+        chave = (escopo, formato, store.version, filtros if escopo == ESCOPO_FILTRADO else None)
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        descritor, caminho = tempfile.mkstemp(suffix=f".{extensao}", dir=EXPORT_DIR)
+        try:
+            with st.spinner(f"Gerando {formato} com {len(df)} despesa(s)..."), os.fdopen(descritor, "wb") as destino:
+                exportar(df, formato, destino)
+        except Exception as e:
+            os.remove(caminho)
+            st.error(f"Erro ao exportar as despesas: {e}")
+            return
+        # Só o último arquivo gerado pela sessão fica no disco
+        if gerada and os.path.exists(gerada["caminho"]):
+            os.remove(gerada["caminho"])
+        gerada = {"chave": chave, "caminho": caminho, "linhas": len(df)}
+        st.session_state["exportacao"] = gerada
+
+    chave_atual = (escopo, formato, store.version, filtros if escopo == ESCOPO_FILTRADO else None)
+    if gerada and gerada["chave"] == chave_atual and os.path.exists(gerada["caminho"]):
+        with open(gerada["caminho"], "rb") as arquivo:
+            st.download_button(
+                f"Baixar {formato} ({gerada['linhas']} despesa(s))", arquivo,
+                file_name=f"despesas_{datetime.now():%Y%m%d}.{extensao}", mime=mime, type="primary",
+            )
+
+def _pagina_ordenada(df, coluna, decrescente, pagina):
+    """Ordena as despesas filtradas e devolve só as linhas da página pedida (começando em 1)."""
+    ordem = df[coluna].sort_values(ascending=not decrescente, kind="stable", na_position="last").index
+    inicio = (pagina - 1) * TAMANHO_PAGINA_TABELA
+    return df.loc[ordem[inicio:inicio + TAMANHO_PAGINA_TABELA]]
+
+def detectar_alteracoes(original, editado):
+    """
+    Compara as linhas enviadas à grade com as devolvidas por ela (casando por id_original)
+    e devolve apenas as linhas com alguma célula editável alterada: id_original e as
+    colunas editáveis, já convertidas para os tipos do app. Vazio se nada mudou.
+    """
+    colunas = [col for col in COLUNAS_EDITAVEIS_TABELA if col in original.columns and col in editado.columns]
+    antes = original.set_index('id_original')[colunas]
+    depois = editado.assign(id_original=editado['id_original'].astype(int)).set_index('id_original')[colunas]
+    depois = depois[depois.index.isin(antes.index)]
+    antes = antes.loc[depois.index]
+
+    # Atalho: se a grade devolveu exatamente o que recebeu, não há o que comparar célula a célula
+    if are_dataframes_equal(antes, depois):
+        return pd.DataFrame(columns=['id_original'] + colunas)
+
+    depois = depois.copy()
+    if 'Valor' in colunas:
+        depois['Valor'] = parse_brl(depois['Valor'])
+    if 'Data' in colunas:
+        depois['Data'] = parse_datas(depois['Data'])
+
+    alterada = pd.Series(False, index=depois.index)
+    for col in colunas:
+        a, b = antes[col], depois[col]
+        if col == 'Valor':
+            diferente = (a.round(2) != b.round(2))
+        elif col == 'Data':
+            diferente = (a.dt.normalize() != b.dt.normalize()) & ~(a.isna() & b.isna())
+        else:
+            diferente = texto_sem_nulos(a) != texto_sem_nulos(b)
+        alterada |= diferente.to_numpy()
+
+    return depois[alterada.to_numpy()].reset_index()
+
+def salvar_edicoes_da_grade(pagina, dados_grade):
+    """
+    Aplica no store as células editadas na grade e enfileira a gravação das linhas alteradas.
+    Devolve None se nada mudou; caso contrário, o resultado de save_expenses.
+    """
+    # Compara a página devolvida pela grade com a que foi enviada e fica só com as linhas editadas
+    alteracoes = detectar_alteracoes(pagina, dados_grade)
+    if alteracoes.empty:
+        return None
+
+    # Aplica só as células alteradas no store compartilhado...
+    get_expense_store().apply(alteradas=alteracoes)
+
+    # ...e monta as linhas completas a partir da página; as originais vão junto para o
+    # backend gravar só as células alteradas, sem desfazer edições de outras pessoas
+    originais = pagina.set_index('id_original').loc[alteracoes['id_original']]
+    # Uma Tag ou Categoria nova precisa existir nas categorias da página antes do update (ver schema.py)
+    linhas_alteradas, alteracoes = unificar_categorias([originais, alteracoes])
+    linhas_alteradas.update(alteracoes.set_index('id_original'))
+    return save_expenses(alteradas=linhas_alteradas.reset_index(), originais=originais.reset_index())
+
+def excluir_despesas(ids):
+    """Remove as despesas do store e enfileira a exclusão no backend."""
+    get_expense_store().apply(excluidas=ids)
+    return save_expenses(excluidas=ids)
+
+@fragmento
+def render_expense_table(df_filtrado):
     
-    if df_para_exibir.empty:
+    # --- BUSCA TEXTUAL ---
+    # O índice invertido do store devolve os id_original que casam com a busca em
+    # Descricao e Tag (sem acentos); eles são cruzados com as linhas já filtradas pela sidebar.
+    busca = st.text_input(
+        "Buscar", key="tabela_busca", placeholder="Descrição ou tag (ex.: mercado, uber)",
+    )
+    if busca.strip():
+        ids = get_expense_store().search(busca)
+        df_filtrado = df_filtrado[np.isin(df_filtrado["id_original"].to_numpy(), ids)]
+        if df_filtrado.empty:
+            st.info("Nenhuma despesa encontrada para a busca com os filtros atuais.")
+            return
+
+    if df_filtrado.empty:
         st.info("Nenhuma despesa para exibir com os filtros atuais.")
         return
 
+    # --- PAGINAÇÃO E ORDENAÇÃO NO SERVIDOR ---
+    # Só a página visível é enviada ao navegador (e devolvida pela grade),
+    # então o tamanho do payload não depende do tamanho do histórico.
+    total = len(df_filtrado)
+    num_paginas = max(1, -(-total // TAMANHO_PAGINA_TABELA))
+    # Ao mudar os filtros a página atual pode deixar de existir
+    if st.session_state.get("tabela_pagina", 1) > num_paginas:
+        st.session_state.tabela_pagina = num_paginas
+
+    col_ordem, col_direcao, col_pagina = st.columns([2, 1, 1])
+    with col_ordem:
+        ordenar_por = st.selectbox("Ordenar por", COLUNAS_ORDENACAO_TABELA, key="tabela_ordem")
+    with col_direcao:
+        decrescente = st.checkbox("Decrescente", value=True, key="tabela_decrescente")
+    with col_pagina:
+        pagina = st.number_input("Página", min_value=1, max_value=num_paginas, step=1, key="tabela_pagina")
+    st.caption(f"{total} despesa(s) — página {pagina} de {num_paginas}")
+
+    df_para_exibir = _pagina_ordenada(df_filtrado, ordenar_por, decrescente, pagina)
+
     # --- Usando o GridOptionsBuilder de forma explícita e completa ---
     gb = GridOptionsBuilder.from_dataframe(df_para_exibir)
 
-    # 1. HABILITA A PAGINAÇÃO
-    # Define o tamanho da página e ativa a funcionalidade.
-    gb.configure_pagination(paginationPageSize=20, paginationAutoPageSize=False)
+    # 1. ORDENAÇÃO FEITA NO SERVIDOR
+    # Ordenar no navegador reordenaria apenas a página atual, o que confundiria.
+    gb.configure_default_column(sortable=False)
 
     # 2. HABILITA A SELEÇÃO COM CHECKBOXES
-    # Essencial para a função de exclusão.
+    # Essencial para a função de exclusão (vale para as linhas da página atual).
     gb.configure_selection(
         selection_mode="multiple",
         use_checkbox=True,
@@ -478,27 +1322,13 @@ def render_expense_table(df_para_exibir):
     # --- Lógica de Ação (só roda quando um dos botões do formulário é clicado) ---
 
     if save_pressed:
-        updated_df = grid_return['data'].copy()
-        updated_df['Valor'] = updated_df['Valor'].apply(safe_parse_value)
-        updated_df["Data"] = pd.to_datetime(updated_df["Data"], errors="coerce")
-        
-        # Aqui, precisamos mesclar as mudanças de volta no dataframe principal
-        # que está no session_state antes de salvar, para não perder os dados não filtrados.
-        df_completo = st.session_state['expenses_df'].copy()
-        updated_df.set_index('id_original', inplace=True)
-        df_completo.set_index('id_original', inplace=True)
-        df_completo.update(updated_df)
-        df_completo.reset_index(inplace=True)
-
-        df_completo['Data'] = pd.to_datetime(df_completo['Data'], errors='coerce')
-
-
-        st.session_state['expenses_df'] = df_completo
-        
-        if save_expenses():
-            st.success("Alterações salvas com sucesso!")
-            read_sheet_data.clear()
-            time.sleep(1)
+        salvo = salvar_edicoes_da_grade(df_para_exibir, grid_return['data'])
+        if salvo is None:
+            st.info("Nenhuma alteração para salvar.")
+            return
+        if salvo:
+            # A gravação segue em segundo plano; o toast sobrevive ao rerun
+            st.toast("Alterações salvas com sucesso!", icon="✅")
             st.rerun()
         else:
             st.error("Erro ao salvar alterações.")
@@ -511,14 +1341,9 @@ def render_expense_table(df_para_exibir):
 
         ids_para_excluir = [row['id_original'] for row in selected_rows]
         
-        df_completo = st.session_state['expenses_df'].copy()
-        df_apos_exclusao = df_completo.query("id_original not in @ids_para_excluir")
-        
-        st.session_state["expenses_df"] = df_apos_exclusao
-        if save_expenses():
-            st.success("Despesas excluídas com sucesso!")
-            read_sheet_data.clear()
-            time.sleep(1)
+        if excluir_despesas(ids_para_excluir):
+            # A gravação segue em segundo plano; o toast sobrevive ao rerun
+            st.toast("Despesas excluídas com sucesso!", icon="✅")
             st.rerun()
         else:
             st.error("Erro ao excluir despesas.")
@@ -529,14 +1354,21 @@ from datetime import datetime
 
 from datetime import datetime
 
-def setup_filtros(df, usuario_logado):
+def setup_filtros(indice, usuario_logado, anos_no_backend=(), horizonte=None):
     st.sidebar.header("Filtros")
 
-    # --- Listas de Opções ---
-    anos_disponiveis = ["Todos"] + sorted(df['Data'].dt.year.unique(), reverse=True)
+    # --- Listas de Opções (lidas do índice de filtros, sem varrer o DataFrame) ---
+    # Os anos incluem as partições do backend ainda não carregadas (carregadas ao serem escolhidas)
+    anos = set(indice.anos()) | {ano for ano in anos_no_backend if ano != PARTICAO_SEM_DATA}
+    # Com regras sem término, os próximos anos também são oferecidos: escolher um deles expande
+    # as regras até o fim dele (ver ExpenseStore.extend_horizon). A lista não depende do
+    # horizonte atual, senão mudaria ao escolher o ano e o selectbox voltaria para "Todos"
+    if horizonte is not None:
+        anos.update(range(datetime.now().year, datetime.now().year + ANOS_FUTUROS_RECORRENCIAS + 1))
+    anos_disponiveis = ["Todos"] + sorted(anos, reverse=True)
     meses_nomes = ["Todos", "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
     
-    lista_usuarios = sorted(df['Usuario'].unique().tolist())
+    lista_usuarios = indice.valores('Usuario')
     if usuario_logado not in lista_usuarios:
         lista_usuarios.insert(0, usuario_logado)
     usuarios_disponiveis = ["Todos"] + lista_usuarios
@@ -549,10 +1381,13 @@ def setup_filtros(df, usuario_logado):
 
     # --- Widgets ---
     ano = st.sidebar.selectbox("Ano", anos_disponiveis, key="filtro_ano")
+    # Um ano escolhido tem as ocorrências até o fim dele; "Todos" só vai até o horizonte
+    if horizonte is not None and ano == "Todos":
+        st.sidebar.caption(f"As despesas recorrentes sem término aparecem até {horizonte:%m/%Y}.")
     mes_nome = st.sidebar.selectbox("Mês", meses_nomes, key="filtro_mes")
     usuario = st.sidebar.selectbox("Usuário", usuarios_disponiveis, key="filtro_usuario")
     
-    categorias_disponiveis = ["Todas"] + sorted(df['Categoria'].unique().tolist())
+    categorias_disponiveis = ["Todas"] + indice.valores('Categoria')
     categorias = st.sidebar.multiselect("Categorias", categorias_disponiveis, key="filtro_categorias")
 
     # --- Retorna as seleções ---
@@ -562,17 +1397,39 @@ def setup_filtros(df, usuario_logado):
     return ano, mes_num, usuario, categorias
 
 # ======================== GRÁFICOS ========================
-def render_dashboard(df):
+@st.cache_resource
+def get_figure_cache():
+    """Cache LRU das figuras Plotly, compartilhado por todas as sessões (ver figures.py)."""
+    return FigureCache()
+
+def _figura(chave, nome, construir):
+    """
+    Figura `nome` do cache compartilhado. `chave` é (versão dos dados, dashboard, filtros...);
+    sem chave a figura é sempre montada. Seleções locais entram no `nome`.
+    """
+    if chave is None:
+        return construir()
+    return get_figure_cache().obter(chave + (nome,), construir)
+
+def _rotular_sem_tag(fatia):
+    """Troca tags vazias por 'Sem Tag' para exibição nos gráficos."""
+    fatia = fatia.copy()
+    fatia['Tag'] = fatia['Tag'].replace('', 'Sem Tag')
+    return fatia
+
+def render_dashboard(df, fatia, chave=None):
     st.subheader("Dashboard de Despesas")
 
-    # 1. Métricas Principais (KPIs)
-    total_gasto = df['Valor'].sum()
-    media_por_transacao = df['Valor'].mean()
-    categoria_mais_cara = df.groupby('Categoria')['Valor'].sum().idxmax()
+    # 1. Métricas Principais (KPIs), lidas da fatia do cubo de agregados
+    gastos_por_categoria = fatia.groupby('Categoria')['Valor'].sum().sort_values(ascending=False)
+    total_gasto = fatia['Valor'].sum()
+    quantidade = fatia['Quantidade'].sum()
+    media_por_transacao = total_gasto / quantidade if quantidade else float('nan')
+    categoria_mais_cara = gastos_por_categoria.idxmax()
 
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Gasto", f"R$ {total_gasto:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-    col2.metric("Média por Transação", f"R$ {media_por_transacao:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+    col1.metric("Total Gasto", format_currency_brl(total_gasto))
+    col2.metric("Média por Transação", format_currency_brl(media_por_transacao))
     col3.metric("Categoria Principal", categoria_mais_cara)
     
     st.markdown("---")
@@ -582,31 +1439,31 @@ def render_dashboard(df):
 
     with col_graf1:
         st.subheader("Gastos por Categoria")
-        gastos_por_categoria = df.groupby('Categoria')['Valor'].sum().sort_values(ascending=False)
-        fig_cat = px.bar(
+        fig_cat = _figura(chave, "categorias", lambda: px.bar(
             gastos_por_categoria,
             x=gastos_por_categoria.index,
             y=gastos_por_categoria.values,
             title="Total Gasto por Categoria",
             labels={'x': 'Categoria', 'y': 'Valor Gasto (R$)'},
             template="plotly_white"
-        )
+        ))
         st.plotly_chart(fig_cat, use_container_width=True)
 
     with col_graf2:
         st.subheader("Evolução dos Gastos")
-        # Certifique-se que a coluna 'Data' é do tipo datetime
-        df['Data'] = pd.to_datetime(df['Data'])
-        gastos_por_dia = df.groupby(df['Data'].dt.date)['Valor'].sum()
-        fig_dia = px.line(
-            x=gastos_por_dia.index,
-            y=gastos_por_dia.values,
-            title="Gastos por Dia",
-            labels={'x': 'Data', 'y': 'Valor Gasto (R$)'},
-            markers=True
-        )
-        fig_dia.update_layout(template="plotly_white")
-        st.plotly_chart(fig_dia, use_container_width=True)
+        def construir_fig_dia():
+            # O cubo é mensal; a série diária continua vindo das despesas filtradas
+            gastos_por_dia = df.groupby(df['Data'].dt.date)['Valor'].sum()
+            fig_dia = px.line(
+                x=gastos_por_dia.index,
+                y=gastos_por_dia.values,
+                title="Gastos por Dia",
+                labels={'x': 'Data', 'y': 'Valor Gasto (R$)'},
+                markers=True
+            )
+            fig_dia.update_layout(template="plotly_white")
+            return fig_dia
+        st.plotly_chart(_figura(chave, "gastos_por_dia", construir_fig_dia), use_container_width=True)
 
 # ======================== DASHBOARD ANÁLISE MENSAL ========================
 meses_nomes = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", 
@@ -614,32 +1471,24 @@ meses_nomes = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
 import plotly.graph_objects as go
 from dateutil.relativedelta import relativedelta
 
-def render_dashboard_analise_mensal(df_usuario_filtrado, ano, mes):
+def render_dashboard_analise_mensal(cube, ano, mes, chave=None):
     # O título agora reflete o usuário selecionado na barra lateral, lendo do session_state
     usuario_selecionado = st.session_state.get("filtro_usuario", "Todos")
     st.header(f"Análise de {meses_nomes[mes-1]}/{ano} para: {usuario_selecionado}")
 
-    # A função agora opera diretamente no DataFrame que recebe (df_usuario_filtrado),
-    # que já foi filtrado por usuário na função main.
-    # O seletor de usuário que existia aqui foi REMOVIDO por ser redundante.
-
-    # Lógica de filtro de data para pegar o mês atual e o anterior
+    # A função lê do cubo de agregados a fatia do usuário selecionado na sidebar
+    # para o mês atual e o anterior (chaves AAAAMM).
     data_inicio_mes_atual = datetime(ano, mes, 1)
-    data_fim_mes_atual = data_inicio_mes_atual + relativedelta(months=1) - relativedelta(days=1)
     data_inicio_mes_anterior = data_inicio_mes_atual - relativedelta(months=1)
+    chave_atual = ano * 100 + mes
+    chave_anterior = data_inicio_mes_anterior.year * 100 + data_inicio_mes_anterior.month
 
-    df_mes_atual = df_usuario_filtrado[
-        (df_usuario_filtrado['Data'] >= pd.to_datetime(data_inicio_mes_atual)) & 
-        (df_usuario_filtrado['Data'] <= pd.to_datetime(data_fim_mes_atual))
-    ]
-    df_mes_anterior = df_usuario_filtrado[
-        (df_usuario_filtrado['Data'] >= pd.to_datetime(data_inicio_mes_anterior)) & 
-        (df_usuario_filtrado['Data'] < pd.to_datetime(data_inicio_mes_atual))
-    ]
+    fatia_mes_atual = cube.slice(usuario=usuario_selecionado, anos_meses=[chave_atual])
+    fatia_mes_anterior = cube.slice(usuario=usuario_selecionado, anos_meses=[chave_anterior])
 
     # KPIs são calculados. Se não houver dados, a soma será 0.
-    total_atual = df_mes_atual['Valor'].sum()
-    total_anterior = df_mes_anterior['Valor'].sum()
+    total_atual = fatia_mes_atual['Valor'].sum()
+    total_anterior = fatia_mes_anterior['Valor'].sum()
     delta = ((total_atual - total_anterior) / total_anterior * 100) if total_anterior > 0 else 0
 
     col1, col2 = st.columns(2)
@@ -650,7 +1499,7 @@ def render_dashboard_analise_mensal(df_usuario_filtrado, ano, mes):
     
     # Se não houver absolutamente nenhuma despesa para o usuário no mês selecionado,
     # mostramos um aviso e não tentamos desenhar os gráficos.
-    if df_mes_atual.empty:
+    if fatia_mes_atual.empty:
         st.info(f"Nenhuma despesa encontrada para '{usuario_selecionado}' no período selecionado.")
         return
 
@@ -658,55 +1507,62 @@ def render_dashboard_analise_mensal(df_usuario_filtrado, ano, mes):
     col_graf1, col_graf2 = st.columns(2)
     with col_graf1:
         st.subheader("Comparativo por Categoria")
-        gastos_cat_atual = df_mes_atual.groupby('Categoria')['Valor'].sum()
-        gastos_cat_anterior = df_mes_anterior.groupby('Categoria')['Valor'].sum()
-        df_comp = pd.DataFrame({'Mês Atual': gastos_cat_atual, 'Mês Anterior': gastos_cat_anterior}).fillna(0)
-        
-        fig = go.Figure(data=[
-            go.Bar(name='Mês Anterior', x=df_comp.index, y=df_comp['Mês Anterior']),
-            go.Bar(name='Mês Atual', x=df_comp.index, y=df_comp['Mês Atual'])
-        ])
-        fig.update_layout(barmode='group', template="plotly_white", title_text="Categoria vs. Categoria")
-        st.plotly_chart(fig, use_container_width=True)
+
+        def construir_comparativo():
+            gastos_cat_atual = fatia_mes_atual.groupby('Categoria')['Valor'].sum()
+            gastos_cat_anterior = fatia_mes_anterior.groupby('Categoria')['Valor'].sum()
+            df_comp = pd.DataFrame({'Mês Atual': gastos_cat_atual, 'Mês Anterior': gastos_cat_anterior}).fillna(0)
+
+            fig = go.Figure(data=[
+                go.Bar(name='Mês Anterior', x=df_comp.index, y=df_comp['Mês Anterior']),
+                go.Bar(name='Mês Atual', x=df_comp.index, y=df_comp['Mês Atual'])
+            ])
+            fig.update_layout(barmode='group', template="plotly_white", title_text="Categoria vs. Categoria")
+            return fig
+        st.plotly_chart(_figura(chave, "comparativo", construir_comparativo), use_container_width=True)
 
     with col_graf2:
         st.subheader("Composição dos Gastos")
-        # Usando o Sunburst que implementamos
-        df_para_sunburst = df_mes_atual.copy()
-        df_para_sunburst['Tag'] = df_para_sunburst['Tag'].fillna('Sem Tag').replace('', 'Sem Tag')
-        fig_sunburst = px.sunburst(
-            df_para_sunburst,
-            path=['Categoria', 'Tag'],
-            values='Valor',
-            title=f"Composição dos Gastos em {meses_nomes[mes-1]}"
-        )
-        fig_sunburst.update_traces(textinfo="label+percent entry")
-        st.plotly_chart(fig_sunburst, use_container_width=True)
+
+        def construir_sunburst():
+            # Usando o Sunburst que implementamos, sobre os totais por Categoria/Tag
+            df_para_sunburst = _rotular_sem_tag(fatia_mes_atual).groupby(['Categoria', 'Tag'], as_index=False)['Valor'].sum()
+            fig_sunburst = px.sunburst(
+                df_para_sunburst,
+                path=['Categoria', 'Tag'],
+                values='Valor',
+                title=f"Composição dos Gastos em {meses_nomes[mes-1]}"
+            )
+            fig_sunburst.update_traces(textinfo="label+percent entry")
+            return fig_sunburst
+        st.plotly_chart(_figura(chave, "sunburst", construir_sunburst), use_container_width=True)
 
 # ======================== DASHBOARD TENDÊNCIAS ========================
-def render_dashboard_tendencias(df): # A função agora recebe o DF já filtrado
+def render_dashboard_tendencias(fatia, chave=None): # A função agora recebe a fatia do cubo já filtrada
     st.header("Análise de Tendências")
     st.info("Este gráfico reflete o período selecionado nos filtros da barra lateral.")
 
-    # A função não filtra mais por 'últimos 12 meses'. Ela usa o que recebe.
-    df_para_analise = df.copy()
+    # A função não filtra mais por 'últimos 12 meses'. Ela usa o que recebe,
+    # deixando de fora apenas as despesas sem data válida.
+    df_para_analise = _rotular_sem_tag(fatia[fatia['AnoMes'] != SEM_DATA])
 
     if df_para_analise.empty:
         st.warning("Nenhum dado encontrado para o período e filtros selecionados.")
         return
 
     # O resto da lógica de agrupamento e plotagem continua a mesma
-    df_para_analise['AnoMes'] = df_para_analise['Data'].dt.to_period('M')
-    gastos_mensais = df_para_analise.groupby('AnoMes')['Valor'].sum().sort_index()
-    gastos_mensais.index = gastos_mensais.index.to_timestamp()
-
-    fig = px.line(
-        x=gastos_mensais.index, y=gastos_mensais.values,
-        title="Evolução Mensal do Gasto Total",
-        labels={'x': 'Mês', 'y': 'Valor Gasto (R$)'}, markers=True
-    )
-    fig.update_layout(template="plotly_white")
-    st.plotly_chart(fig, use_container_width=True)
+    def construir_evolucao():
+        gastos_mensais = df_para_analise.groupby('AnoMes')['Valor'].sum().sort_index()
+        gastos_mensais.index = ano_mes_para_timestamp(gastos_mensais.index)
+
+        fig = px.line(
+            x=gastos_mensais.index, y=gastos_mensais.values,
+            title="Evolução Mensal do Gasto Total",
+            labels={'x': 'Mês', 'y': 'Valor Gasto (R$)'}, markers=True
+        )
+        fig.update_layout(template="plotly_white")
+        return fig
+    st.plotly_chart(_figura(chave, "evolucao_mensal", construir_evolucao), use_container_width=True)
 
     st.markdown("---")
 
@@ -718,30 +1574,34 @@ def render_dashboard_tendencias(df): # A função agora recebe o DF já filtrado
 
     with col_filtro2:
         if categorias_selecionadas:
-            tags_disponiveis = sorted(df_para_analise[df_para_analise['Categoria'].isin(categorias_selecionadas)]['Tag'].fillna('Sem Tag').unique())
+            tags_disponiveis = sorted(df_para_analise[df_para_analise['Categoria'].isin(categorias_selecionadas)]['Tag'].unique())
             tags_selecionadas = st.multiselect("Selecione as tags:", tags_disponiveis, default=tags_disponiveis)
         else:
             tags_selecionadas = []
 
     if categorias_selecionadas and tags_selecionadas:
-        df_filtrado_cat = df_para_analise[
-            (df_para_analise['Categoria'].isin(categorias_selecionadas)) &
-            (df_para_analise['Tag'].isin(tags_selecionadas))
-        ]
-        df_filtrado_cat['Legenda'] = df_filtrado_cat['Categoria'] + ' - ' + df_filtrado_cat['Tag'].fillna('Sem Tag')
-        gastos_mensais_cat = df_filtrado_cat.groupby(['AnoMes', 'Legenda'])['Valor'].sum().unstack(fill_value=0).sort_index()
-        gastos_mensais_cat.index = gastos_mensais_cat.index.to_timestamp()
-
-        fig2 = px.line(
-            gastos_mensais_cat, x=gastos_mensais_cat.index, y=gastos_mensais_cat.columns,
-            title="Evolução Mensal por Seleção",
-            labels={'x': 'Mês', 'value': 'Valor Gasto (R$)', 'variable': 'Seleção'}, markers=True
-        )
-        fig2.update_layout(template="plotly_white")
-        st.plotly_chart(fig2, use_container_width=True)
+        def construir_selecao():
+            df_filtrado_cat = df_para_analise[
+                (df_para_analise['Categoria'].isin(categorias_selecionadas)) &
+                (df_para_analise['Tag'].isin(tags_selecionadas))
+            ]
+            df_filtrado_cat['Legenda'] = df_filtrado_cat['Categoria'] + ' - ' + df_filtrado_cat['Tag']
+            gastos_mensais_cat = df_filtrado_cat.groupby(['AnoMes', 'Legenda'])['Valor'].sum().unstack(fill_value=0).sort_index()
+            gastos_mensais_cat.index = ano_mes_para_timestamp(gastos_mensais_cat.index)
+
+            fig2 = px.line(
+                gastos_mensais_cat, x=gastos_mensais_cat.index, y=gastos_mensais_cat.columns,
+                title="Evolução Mensal por Seleção",
+                labels={'x': 'Mês', 'value': 'Valor Gasto (R$)', 'variable': 'Seleção'}, markers=True
+            )
+            fig2.update_layout(template="plotly_white")
+            return fig2
+        # As seleções locais fazem parte da chave da figura
+        nome = ("evolucao_por_selecao", tuple(categorias_selecionadas), tuple(tags_selecionadas))
+        st.plotly_chart(_figura(chave, nome, construir_selecao), use_container_width=True)
 
 # ======================== DASHBOARD VISÃO DETALHADA ========================
-def render_dashboard_deep_dive(df):
+def render_dashboard_deep_dive(df, fatia, chave=None):
     st.header("Visão Detalhada dos Gastos")
 
     col1, col2 = st.columns([1, 1])
@@ -749,29 +1609,27 @@ def render_dashboard_deep_dive(df):
     with col1:
         # 1. Treemap
         st.subheader("Composição por Categoria e Tag (Treemap)")
-        gastos_categoria = df.groupby('Categoria')['Valor'].sum().reset_index()
-
-        # Garante que a coluna Tag não tenha valores nulos que quebrem o gráfico
-        df_para_treemap = df.copy()
-        df_para_treemap['Tag'] = df_para_treemap['Tag'].fillna('Sem Tag')
-        df_para_treemap.loc[df_para_treemap['Tag'] == '', 'Tag'] = 'Sem Tag'
-
-        # O 'path' agora é hierárquico: Categoria -> Tag
-        fig = px.treemap(
-            df_para_treemap, 
-            path=['Categoria', 'Tag'], 
-            values='Valor',
-            title='Área proporcional ao gasto por Categoria e Tag',
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        fig.update_traces(root_color="lightgrey")
-        fig.update_layout(margin = dict(t=50, l=25, r=25, b=25))
-        st.plotly_chart(fig, use_container_width=True)
+        def construir_treemap():
+            # Totais por Categoria/Tag vindos do cubo; tags vazias viram 'Sem Tag' para não quebrar o gráfico
+            df_para_treemap = _rotular_sem_tag(fatia).groupby(['Categoria', 'Tag'], as_index=False)['Valor'].sum()
+
+            # O 'path' agora é hierárquico: Categoria -> Tag
+            fig = px.treemap(
+                df_para_treemap, 
+                path=['Categoria', 'Tag'], 
+                values='Valor',
+                title='Área proporcional ao gasto por Categoria e Tag',
+                color_discrete_sequence=px.colors.qualitative.Pastel
+            )
+            fig.update_traces(root_color="lightgrey")
+            fig.update_layout(margin = dict(t=50, l=25, r=25, b=25))
+            return fig
+        st.plotly_chart(_figura(chave, "treemap", construir_treemap), use_container_width=True)
 
     with col2:
             st.subheader("Top 10 Maiores Despesas")
-            # A lógica para obter o top 10 continua a mesma
-            top_10 = df.sort_values('Valor', ascending=False).head(10)
+            # O top 10 precisa das linhas individuais, então vem das despesas filtradas
+            top_10 = df.nlargest(10, 'Valor')
 
             # 1. Cria uma cópia do DataFrame para formatação de exibição.
             top_10_para_exibir = top_10.copy()
@@ -779,9 +1637,8 @@ def render_dashboard_deep_dive(df):
             # 2. Formata a coluna de Data para o padrão dd/mm/yyyy.
             top_10_para_exibir['Data'] = top_10_para_exibir['Data'].dt.strftime('%d/%m/%Y')
             
-            # 3. Formata a coluna de Valor para o padrão de moeda brasileira.
-            #    Isso funciona porque já definimos o locale para pt_BR no início do script.
-            top_10_para_exibir['Valor'] = top_10_para_exibir['Valor'].apply(format_currency_brl)
+            # 3. Formata a coluna de Valor para o padrão de moeda brasileira (vetorizado, ver codec.py).
+            top_10_para_exibir['Valor'] = format_brl(top_10_para_exibir['Valor'])
             
             # 4. Exibe o DataFrame já formatado, sem precisar do column_config.
             st.dataframe(
@@ -794,19 +1651,74 @@ def render_dashboard_deep_dive(df):
 
     # 3. Gráfico de Barras Empilhadas
     st.subheader("Forma de Pagamento por Categoria")
-    gastos_pagamento = df.groupby(['Categoria', 'Pagamento'])['Valor'].sum().unstack(fill_value=0)
-    fig2 = px.bar(
-        gastos_pagamento, x=gastos_pagamento.index, y=gastos_pagamento.columns,
-        title="Como você paga por cada categoria?",
-        labels={'x': 'Categoria', 'value': 'Valor Gasto (R$)', 'variable': 'Forma de Pagamento'},
-        template="plotly_white"
+    def construir_pagamentos():
+        gastos_pagamento = fatia.groupby(['Categoria', 'Pagamento'])['Valor'].sum().unstack(fill_value=0)
+        return px.bar(
+            gastos_pagamento, x=gastos_pagamento.index, y=gastos_pagamento.columns,
+            title="Como você paga por cada categoria?",
+            labels={'x': 'Categoria', 'value': 'Valor Gasto (R$)', 'variable': 'Forma de Pagamento'},
+            template="plotly_white"
+        )
+    st.plotly_chart(_figura(chave, "pagamentos", construir_pagamentos), use_container_width=True)
+
+# ======================== VISÃO DE DASHBOARDS ========================
+@fragmento
+def render_dashboards(df_filtrado, ano_selecionado, mes_selecionado_num, usuario_selecionado, categorias_selecionadas):
+    """
+    Seletor de dashboard e o dashboard escolhido. Por ser um fragmento, trocar de dashboard
+    ou mexer nos widgets de um deles (ex.: categorias/tags das Tendências) não reexecuta o resto.
+    """
+    metricas = get_metrics()
+    st.header("Análise Visual de Gastos")
+
+    # Lógica para mostrar/esconder o dashboard de Análise Mensal
+    opcoes_dashboard = ["Análise de Tendências", "Visão Detalhada"]
+    if ano_selecionado != "Todos" and mes_selecionado_num != 0:
+        opcoes_dashboard.insert(0, "Análise Mensal")
+
+    dashboard_selecionado = st.selectbox(
+        "Escolha uma visão de análise:",
+        opcoes_dashboard
     )
-    st.plotly_chart(fig2, use_container_width=True)
+
+    # As Tendências cobrem todo o histórico e a Análise Mensal de janeiro compara com
+    # dezembro do ano anterior: carrega esses anos antes de ler o cubo
+    store = get_expense_store()
+    if dashboard_selecionado == "Análise de Tendências":
+        # O histórico entra aos poucos, dos anos mais recentes para os mais antigos
+        if not carregar_particoes_em_segundo_plano(store.catalog["particoes"]):
+            st.caption("⏳ Carregando os anos anteriores; os gráficos são atualizados conforme eles chegam.")
+    elif dashboard_selecionado == "Análise Mensal" and mes_selecionado_num == 1:
+        garantir_particoes([int(ano_selecionado) - 1])
+
+    # Chamadas corretas para cada dashboard com o DataFrame apropriado
+    # Os dashboards leem fatias do cubo de agregados mantido pelo store
+    versao, cube = store.versioned_cube()
+    # As figuras ficam no cache compartilhado sob a versão dos dados, o dashboard e só os
+    # filtros da sidebar que ele usa (as Tendências, por exemplo, não dependem do período)
+    chave = (versao, dashboard_selecionado, usuario_selecionado)
+    if dashboard_selecionado == "Análise Mensal":
+        with metricas.span("dashboard_analise_mensal"):
+            render_dashboard_analise_mensal(cube, ano_selecionado, mes_selecionado_num, chave + (ano_selecionado, mes_selecionado_num))
+    elif dashboard_selecionado == "Análise de Tendências":
+        with metricas.span("dashboard_tendencias"):
+            render_dashboard_tendencias(cube.slice(usuario=usuario_selecionado), chave)
+    elif dashboard_selecionado == "Visão Detalhada":
+        categorias_chave = None if "Todas" in categorias_selecionadas else tuple(sorted(categorias_selecionadas))
+        with metricas.span("dashboard_deep_dive"):
+            render_dashboard_deep_dive(
+                df_filtrado,
+                cube.slice(usuario_selecionado, ano_selecionado, mes_selecionado_num, categorias_selecionadas),
+                chave + (ano_selecionado, mes_selecionado_num, categorias_chave),
+            )
 
 #from io import StringIO
 
 # ======================== MAIN ========================
 def main():
+    # Cada bloco abaixo é medido (ver o painel de diagnóstico na sidebar)
+    metricas = get_metrics()
+
     # --- BLOCO 1: RESET DO FORMULÁRIO (Executado primeiro após um envio) ---
     if st.session_state.get("submission_success", False):
         st.session_state.submission_success = False
@@ -815,81 +1727,115 @@ def main():
         st.rerun()
 
     # --- BLOCO 2: AUTENTICAÇÃO DO USUÁRIO ---
-    user_display, is_auth = authenticate_user()
+    with metricas.span("autenticacao"):
+        user_display, is_auth = authenticate_user()
     if not is_auth:
         return
 
     # --- BLOCO 3: CARREGAMENTO E PREPARAÇÃO DOS DADOS ---
-    if "expenses_df" not in st.session_state:
-        load_expenses()
-    
-    df_completo = st.session_state.get("expenses_df", pd.DataFrame())
+    # O store é compartilhado entre as sessões; cada sessão só confere uma vez se ele está atualizado.
+    with metricas.span("carga"):
+        if "dados_verificados" not in st.session_state:
+            load_expenses()
+            st.session_state["dados_verificados"] = True
 
-    # Garante que a coluna 'Data' seja sempre do tipo datetime antes de qualquer operação
-    if not df_completo.empty and 'Data' in df_completo.columns:
-        df_completo['Data'] = pd.to_datetime(df_completo['Data'], errors='coerce')
+        # Um ano futuro escolhido no filtro precisa das regras sem término expandidas até o fim dele
+        if isinstance(st.session_state.get("filtro_ano"), int):
+            get_expense_store().extend_horizon(pd.Timestamp(st.session_state["filtro_ano"], 12, 31))
+
+        # Frame compartilhado e somente leitura (copy-on-write) e o índice de filtros da mesma versão:
+        # as sessões não guardam cópias. A versão é lida antes: se mudar no meio, há um rerun a mais
+        versao = get_expense_store().version
+        df_completo, indice_filtros = get_expense_store().indexed()
 
     # --- BLOCO 4: FILTROS E PREPARAÇÃO DA SIDEBAR ---
     # A função setup_filtros agora apenas mostra os widgets e retorna as escolhas do usuário
-    ano_selecionado, mes_selecionado_num, usuario_selecionado, categorias_selecionadas = setup_filtros(df_completo, user_display)
+    with metricas.span("filtros"):
+        ano_selecionado, mes_selecionado_num, usuario_selecionado, categorias_selecionadas = setup_filtros(
+            indice_filtros, user_display, get_expense_store().catalog["particoes"], get_expense_store().horizon()
+        )
+
+    # Anos fora das partições já carregadas (ano anterior escolhido ou "Todos") entram em
+    # segundo plano: a página é desenhada com o que já chegou e redesenhada a cada bloco
+    with metricas.span("carga_particoes"):
+        store = get_expense_store()
+        particoes = store.catalog["particoes"] if ano_selecionado == "Todos" else [int(ano_selecionado)]
+        if not carregar_particoes_em_segundo_plano(particoes):
+            st.sidebar.caption("⏳ Carregando despesas de outros anos...")
+
+    # Daqui em diante a sessão mostra esta versão; o vigia avisa quando houver outra
+    get_revision_watcher()
+    st.session_state["versao_exibida"] = versao
+    render_live_refresh()
 
     st.sidebar.title("FinApp")
     st.sidebar.markdown(f"Bem-vindo, {user_display}")
+    render_sync_status()
+    render_debug_panel()
     if st.sidebar.button("Logout"):
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
 
     # --- BLOCO 5: LÓGICA DE FILTRAGEM CENTRALIZADA ---
-    # Primeiro, filtra pelo usuário. Este será o nosso dataframe base para os dashboards de longo prazo.
-    df_base_usuario_filtrado = df_completo.copy()
-    if usuario_selecionado != "Todos":
-        df_base_usuario_filtrado = df_base_usuario_filtrado[df_base_usuario_filtrado['Usuario'] == usuario_selecionado]
-
-    # Em seguida, cria um segundo DataFrame com TODOS os filtros aplicados, para as visões detalhadas.
-    df_filtrado_final = df_base_usuario_filtrado.copy()
-    if ano_selecionado != "Todos":
-        df_filtrado_final = df_filtrado_final[df_filtrado_final['Data'].dt.year == ano_selecionado]
-    if mes_selecionado_num != 0: # 0 = "Todos"
-        df_filtrado_final = df_filtrado_final[df_filtrado_final['Data'].dt.month == mes_selecionado_num]
-    if "Todas" not in categorias_selecionadas:
-        df_filtrado_final = df_filtrado_final[df_filtrado_final['Categoria'].isin(categorias_selecionadas)]
+    # O índice devolve as posições das linhas que passam pelos filtros (memorizadas por
+    # combinação de filtros); as linhas só são materializadas uma vez, aqui.
+    # Os dashboards de longo prazo leem direto do cubo de agregados; este DataFrame com
+    # TODOS os filtros aplicados alimenta as visões que precisam das linhas individuais.
+    with metricas.span("filtragem"):
+        posicoes_filtradas = indice_filtros.select(usuario_selecionado, ano_selecionado, mes_selecionado_num, categorias_selecionadas)
+        df_filtrado_final = df_completo.take(posicoes_filtradas)
+        # A grade edita linhas gravadas; as ocorrências das regras ficam na visão de recorrências
+        df_gravadas = df_completo.take(indice_filtros.select(
+            usuario_selecionado, ano_selecionado, mes_selecionado_num, categorias_selecionadas, ocorrencias=False
+        ))
             
     # --- BLOCO 6: RENDERIZAÇÃO DA PÁGINA PRINCIPAL ---
     st.title("💰 Controle de Despesas")
 
-    tab_dashboard, tab_lancamentos = st.tabs(["📊 Dashboards", "✍️ Lançamentos"])
+    # Com st.tabs o Streamlit executaria o corpo de todas as abas (dashboard, formulário e
+    # grade) em todo rerun; com a navegação por rádio só a visão escolhida é montada.
+    # Cada visão é um fragmento: seus widgets reexecutam só ela, sem autenticação, filtros e grade.
+    vista = st.radio("Visão", [VISTA_DASHBOARDS, VISTA_LANCAMENTOS], horizontal=True, key="vista", label_visibility="collapsed")
 
-    with tab_dashboard:
-        st.header("Análise Visual de Gastos")
-
-        # Lógica para mostrar/esconder o dashboard de Análise Mensal
-        opcoes_dashboard = ["Análise de Tendências", "Visão Detalhada"]
-        if ano_selecionado != "Todos" and mes_selecionado_num != 0:
-            opcoes_dashboard.insert(0, "Análise Mensal")
-        
-        dashboard_selecionado = st.selectbox(
-            "Escolha uma visão de análise:",
-            opcoes_dashboard
-        )
-        
-        # Chamadas corretas para cada dashboard com o DataFrame apropriado
-        if dashboard_selecionado == "Análise Mensal":
-            render_dashboard_analise_mensal(df_base_usuario_filtrado, ano_selecionado, mes_selecionado_num)
-        elif dashboard_selecionado == "Análise de Tendências":
-            render_dashboard_tendencias(df_base_usuario_filtrado)
-        elif dashboard_selecionado == "Visão Detalhada":
-            render_dashboard_deep_dive(df_filtrado_final)
-
-    with tab_lancamentos:
+    if vista == VISTA_DASHBOARDS:
+        render_dashboards(df_filtrado_final, ano_selecionado, mes_selecionado_num, usuario_selecionado, categorias_selecionadas)
+    else:
         st.header("Gerenciar Despesas")
-        
-        tab_adicionar, tab_tabela = st.tabs(["Adicionar Nova Despesa", "Ver Tabela Detalhada"])
 
-        with tab_adicionar:
-            render_new_expense_form(user_display)
-        with tab_tabela:
-            render_expense_table(df_filtrado_final)
+        vista_lancamentos = st.radio(
+            "Lançamentos", [VISTA_ADICIONAR, VISTA_IMPORTAR, VISTA_TABELA, VISTA_RECORRENCIAS, VISTA_EXPORTAR],
+            horizontal=True, key="vista_lancamentos", label_visibility="collapsed",
+        )
+        if vista_lancamentos == VISTA_ADICIONAR:
+            with metricas.span("formulario"):
+                render_new_expense_form(user_display)
+        elif vista_lancamentos == VISTA_IMPORTAR:
+            with metricas.span("importacao"):
+                render_import(user_display)
+        elif vista_lancamentos == VISTA_TABELA:
+            with metricas.span("tabela"):
+                render_expense_table(df_gravadas)
+        elif vista_lancamentos == VISTA_RECORRENCIAS:
+            with metricas.span("recorrencias"):
+                render_recurring_rules()
+        else:
+            with metricas.span("exportacao"):
+                filtros = (ano_selecionado, mes_selecionado_num, usuario_selecionado, tuple(categorias_selecionadas))
+                render_export(df_filtrado_final, filtros)
+
+def run():
+    """Executa um rerun do app medindo o tempo total e guardando os spans para o painel de diagnóstico."""
+    metricas = get_metrics()
+    metricas.iniciar_rerun()
+    try:
+        with metricas.span("rerun"):
+            main()
+    finally:
+        # Também roda quando o rerun termina com st.rerun()/st.stop()
+        st.session_state["spans_ultimo_rerun"] = metricas.spans_do_rerun()
+        if METRICS_AUTO_EXPORT:
+            metricas.exportar_se_devido(METRICS_DIR, METRICS_EXPORT_INTERVAL)
 
 if __name__ == "__main__":
-    main()
+    run()
@@ -0,0 +1,113 @@
+"""
+Compara o codec vetorizado (codec.py) com as conversões linha a linha que o app usava,
+em 100 mil linhas. A correção do codec é conferida em tests/test_codec.py.
+
+Uso: python benchmarks/bench_codec.py [nº de linhas]
+"""
+# ======================== IMPORTS ========================
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import FORMATO_DATA_ISO, format_brl, format_datas, format_planilha, parse_brl, parse_datas  # noqa: E402
+
+# ======================== CONSTANTES ========================
+LINHAS_PADRAO = 100_000
+REPETICOES = 3
+
+
+# ======================== IMPLEMENTAÇÕES ANTIGAS ========================
+# Cópias das funções que o codec substituiu, mantidas aqui só como referência.
+def legado_format_currency_brl(value):
+    if not isinstance(value, (int, float)):
+        return "R$ 0,00"
+    valor_formatado = f"{value:,.2f}"
+    valor_formatado_br = valor_formatado.replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {valor_formatado_br}"
+
+
+def legado_safe_parse_value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return round(value, 2)
+    if isinstance(value, str):
+        if not value.strip():
+            return 0.0
+        try:
+            clean_str = value.replace('.', '').replace(',', '.')
+            return round(float(clean_str), 2)
+        except (ValueError, TypeError):
+            return 0.0
+    return 0.0
+
+
+def legado_parse_planilha(serie):
+    serie = serie.astype(str).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    return pd.to_numeric(serie, errors='coerce').fillna(0).round(2)
+
+
+def legado_format_planilha(serie):
+    return serie.apply(lambda x: f"{x:.2f}".replace(".", ","))
+
+
+def legado_parse_datas(serie):
+    return pd.to_datetime(serie, errors="coerce")
+
+
+def legado_format_datas(serie):
+    return pd.to_datetime(serie, errors="coerce").dt.strftime("%Y-%m-%d")
+
+
+# ======================== DADOS ========================
+def gerar_valores(n, seed=0):
+    rng = np.random.default_rng(seed)
+    centavos = rng.integers(-50_000, 5_000_000, n)
+    return centavos, pd.Series(centavos / 100)
+
+
+def gerar_datas(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.Series(pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 4000, n), unit="D"))
+
+
+# ======================== MEDIÇÕES ========================
+def cronometrar(funcao, *args):
+    melhor = float("inf")
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        funcao(*args)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else LINHAS_PADRAO
+    _, valores = gerar_valores(n)
+    texto_planilha = format_planilha(valores)
+    texto_brl = format_brl(valores, simbolo=False)
+    datas = gerar_datas(n)
+    texto_datas = format_datas(datas, FORMATO_DATA_ISO)
+
+    comparacoes = [
+        ("formatar moeda (R$)", lambda: valores.map(legado_format_currency_brl), lambda: format_brl(valores)),
+        ("formatar para a planilha", lambda: legado_format_planilha(valores), lambda: format_planilha(valores)),
+        ("ler valores da planilha", lambda: legado_parse_planilha(texto_planilha), lambda: parse_brl(texto_planilha)),
+        ("ler valores da grade", lambda: texto_brl.apply(legado_safe_parse_value), lambda: parse_brl(texto_brl)),
+        ("formatar datas", lambda: legado_format_datas(datas), lambda: format_datas(datas, FORMATO_DATA_ISO)),
+        ("ler datas da planilha", lambda: legado_parse_datas(texto_datas), lambda: parse_datas(texto_datas)),
+    ]
+    print(f"{'operação':<28}{'antigo (ms)':>14}{'codec (ms)':>14}{'ganho':>9}")
+    for nome, antigo, novo in comparacoes:
+        t_antigo = cronometrar(antigo)
+        t_novo = cronometrar(novo)
+        print(f"{nome:<28}{t_antigo * 1000:>14.1f}{t_novo * 1000:>14.1f}{t_antigo / t_novo:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
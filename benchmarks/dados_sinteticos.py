@@ -0,0 +1,140 @@
+"""
+Gerador reprodutível de históricos de despesas para os benchmarks.
+
+As despesas usam as categorias, tags e formas de pagamento do app, alguns usuários
+com pesos diferentes e séries de parcelas ("Descrição (i/N)", mês a mês e com ids
+consecutivos), como as criadas pelo formulário de despesa recorrente.
+"""
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+
+from app import CATEGORIAS_PREDEFINIDAS, PAGAMENTO_PREDEFINIDO, TAGS_POR_CATEGORIA
+from codec import format_brl
+from storage import COLUNAS_DESPESA, COLUNAS_REGRA, SEM_TERMINO, _formatar_para_planilha
+
+# ======================== CONSTANTES ========================
+USUARIOS = ["Ana", "Bruno", "Carla"]
+PESOS_USUARIOS = [0.5, 0.35, 0.15]
+PESOS_PAGAMENTO = [0.6, 0.3, 0.1]
+INICIO = np.datetime64("2021-01-01")
+FIM = np.datetime64("2025-12-31")
+PROPORCAO_PARCELADAS = 0.06   # fração das compras que viram séries de parcelas
+MAX_PARCELAS = 12
+PROPORCAO_SEM_TAG = 0.2
+PROPORCAO_SEM_TERMINO = 0.3  # fração das regras de recorrência sem data de término
+PERIODOS = [1, 1, 1, 2, 3, 6, 12]  # meses entre ocorrências (mensal é o mais comum)
+PROPORCAO_CREDITOS = 0.08  # pagamentos da fatura e estornos no extrato (valores positivos)
+ESTABELECIMENTOS = [
+    "UBER *TRIP", "IFOOD *RESTAURANTE", "SUPERMERCADO DIA", "DROGARIA SAO PAULO", "POSTO SHELL",
+    "NETFLIX.COM", "PADARIA BELA VISTA", "SMARTFIT", "PETZ", "LOJA {n}", "RESTAURANTE {n}",
+]
+PALAVRAS_DESCRICAO = ["compra", "pagamento", "mensalidade", "extra", "presente", "reposição", "conta", "pedido"]
+
+# Peso de cada categoria e mediana do valor (R$) de uma despesa dela
+PERFIL_CATEGORIAS = {
+    "Alimentação": (0.22, 45.0),
+    "Mercado": (0.18, 180.0),
+    "Transporte": (0.14, 60.0),
+    "Lazer": (0.08, 90.0),
+    "Casa": (0.10, 250.0),
+    "Saúde": (0.08, 120.0),
+    "Pessoal": (0.09, 110.0),
+    "Zara": (0.05, 80.0),
+    "Outros": (0.06, 70.0),
+}
+
+
+# ======================== GERAÇÃO ========================
+def gerar_despesas(n, seed=0):
+    """DataFrame tipado (como o devolvido pelos backends) com exatamente `n` despesas."""
+    rng = np.random.default_rng(seed)
+    categorias = np.array(CATEGORIAS_PREDEFINIDAS, dtype=object)
+    pesos = np.array([PERFIL_CATEGORIAS[c][0] for c in CATEGORIAS_PREDEFINIDAS])
+    medianas = np.array([PERFIL_CATEGORIAS[c][1] for c in CATEGORIAS_PREDEFINIDAS])
+
+    # Compras (cada uma com 1 ou mais parcelas) até cobrir n linhas
+    parcelas = np.where(rng.random(n) < PROPORCAO_PARCELADAS, rng.integers(2, MAX_PARCELAS + 1, n), 1)
+    compras = int(np.searchsorted(np.cumsum(parcelas), n)) + 1
+    parcelas = parcelas[:compras]
+
+    dias = int((FIM - INICIO).astype(int))
+    datas_compra = np.sort(INICIO + rng.integers(0, dias + 1, compras))
+    cat_idx = rng.choice(len(categorias), compras, p=pesos / pesos.sum())
+    valores = np.round(medianas[cat_idx] * rng.lognormal(0.0, 0.7, compras), 2).clip(0.5)
+    tags = np.empty(compras, dtype=object)
+    for i, categoria in enumerate(categorias):
+        mascara = cat_idx == i
+        tags[mascara] = rng.choice(TAGS_POR_CATEGORIA[categoria], mascara.sum())
+    tags[rng.random(compras) < PROPORCAO_SEM_TAG] = ""
+    descricoes = rng.choice(PALAVRAS_DESCRICAO, compras).astype(object)
+    pagamentos = rng.choice(PAGAMENTO_PREDEFINIDO, compras, p=PESOS_PAGAMENTO)
+    usuarios = rng.choice(USUARIOS, compras, p=PESOS_USUARIOS)
+
+    # Expande as parcelas: mesma compra, um mês depois a cada parcela
+    compra = np.repeat(np.arange(compras), parcelas)[:n]
+    numero = np.arange(len(compra)) - np.repeat(np.cumsum(parcelas) - parcelas, parcelas)[:n]
+    total = parcelas[compra]
+    mes = datas_compra[compra].astype("datetime64[M]") + numero
+    dia = (datas_compra[compra] - datas_compra[compra].astype("datetime64[M]")).astype(int)
+    dia = np.where(total > 1, np.minimum(dia, 27), dia)  # parcelas num dia que existe em todo mês
+    datas = mes.astype("datetime64[D]") + dia
+
+    descricao = pd.Series(descricoes[compra])
+    parcelada = total > 1
+    descricao[parcelada] = (
+        descricao[parcelada] + " (" + pd.Series(numero + 1)[parcelada].astype(str)
+        + "/" + pd.Series(total)[parcelada].astype(str) + ")"
+    )
+
+    df = pd.DataFrame({
+        "Data": pd.to_datetime(datas).astype("datetime64[ns]"),
+        "Categoria": categorias[cat_idx][compra],
+        "Tag": tags[compra],
+        "Valor": valores[compra],
+        "Descricao": descricao.to_numpy(),
+        "Pagamento": pagamentos[compra],
+        "Usuario": usuarios[compra],
+        "id_original": np.arange(len(compra)),
+    })
+    return df[COLUNAS_DESPESA]
+
+
+def gerar_regras(n, seed=0):
+    """DataFrame de `n` regras de recorrência (aluguéis, assinaturas, planos), com e sem término."""
+    rng = np.random.default_rng(seed)
+    despesas = gerar_despesas(n, seed=seed)
+    ocorrencias = rng.integers(2, 61, n)
+    ocorrencias[rng.random(n) < PROPORCAO_SEM_TERMINO] = SEM_TERMINO
+    regras = despesas.rename(columns={"Data": "Inicio"}).assign(
+        id_regra=np.arange(n), Periodo=rng.choice(PERIODOS, n), Ocorrencias=ocorrencias,
+        Descricao=rng.choice(PALAVRAS_DESCRICAO, n),  # sem o "(i/N)" das parcelas
+    )
+    return regras[COLUNAS_REGRA]
+
+
+def gerar_extrato_csv(n, seed=0):
+    """
+    Extrato de cartão com `n` lançamentos, como os bancos exportam: CSV com ";", datas
+    dd/mm/aaaa, valores no padrão brasileiro (compras negativas) e codificação Latin-1.
+    """
+    rng = np.random.default_rng(seed)
+    dias = int((FIM - INICIO).astype(int))
+    datas = pd.to_datetime(np.sort(INICIO + rng.integers(0, dias + 1, n)))
+    modelos = rng.choice(ESTABELECIMENTOS, n)
+    descricoes = pd.Series(modelos).str.replace("{n}", "", regex=False) + pd.Series(rng.integers(1, 500, n).astype(str)).where(
+        pd.Series(modelos).str.contains("{n}", regex=False), ""
+    )
+    valores = np.round(rng.lognormal(4.0, 0.9, n), 2)
+    valores = np.where(rng.random(n) < PROPORCAO_CREDITOS, valores, -valores)
+    extrato = pd.DataFrame({
+        "Data": datas.strftime("%d/%m/%Y"),
+        "Descrição": descricoes,
+        "Valor": format_brl(valores, simbolo=False).to_numpy(),
+    })
+    return extrato.to_csv(sep=";", index=False).encode("latin-1")
+
+
+def para_planilha(df):
+    """Valores da aba (cabeçalho + linhas em texto), no formato gravado pelo SheetsStorage."""
+    return [COLUNAS_DESPESA] + _formatar_para_planilha(df[COLUNAS_DESPESA]).astype(str).values.tolist()
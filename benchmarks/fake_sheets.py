@@ -0,0 +1,189 @@
+"""
+Substituto em memória do cliente do gspread, com latência simulada.
+
+Implementa só o que o SheetsStorage usa (open, open_by_key, worksheet, get_values, row_values,
+col_values, batch_get, append_rows, update, batch_update, clear, get_all_values, batch_update da
+planilha e get_lastUpdateTime). As células são guardadas como texto, como a API
+devolve com FORMATTED_VALUE.
+"""
+# ======================== IMPORTS ========================
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import gspread
+
+# ======================== CONSTANTES ========================
+LATENCIA_PADRAO = 0.15          # segundos por chamada (ida e volta até a API)
+SEGUNDOS_POR_MIL_CELULAS = 0.002  # custo de transferir/processar as células de cada chamada
+
+_INTERVALO_LINHA = re.compile(r"^[A-Z]+(\d+):[A-Z]+(\d+)$")
+_INTERVALO = re.compile(r"^([A-Z]+)(\d+):([A-Z]+)(\d*)$")  # "A5:H20" ou coluna aberta "C2:C"
+
+
+def _numero_coluna(letras):
+    numero = 0
+    for letra in letras:
+        numero = numero * 26 + ord(letra) - ord("A") + 1
+    return numero
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, valores=None, id_=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = id_
+        self._valores = [list(linha) for linha in (valores or [])]
+
+    def _chamada(self, metodo, celulas=0):
+        self.spreadsheet.client.registrar(metodo, celulas)
+
+    def _tocar(self):
+        self.spreadsheet.tocar()
+
+    # --- leitura ---
+    def get_values(self, *args, **kwargs):
+        self._chamada("get_values", sum(len(linha) for linha in self._valores))
+        # Só a lista externa é copiada: quem lê não altera as linhas
+        return list(self._valores)
+
+    def get_all_values(self, *args, **kwargs):
+        self._chamada("get_all_values", sum(len(linha) for linha in self._valores))
+        return [list(linha) for linha in self._valores]
+
+    def row_values(self, linha, **kwargs):
+        valores = list(self._valores[linha - 1]) if linha <= len(self._valores) else []
+        self._chamada("row_values", len(valores))
+        return valores
+
+    def col_values(self, coluna, **kwargs):
+        valores = [linha[coluna - 1] if coluna <= len(linha) else "" for linha in self._valores]
+        self._chamada("col_values", len(valores))
+        return valores
+
+    def batch_get(self, intervalos, **kwargs):
+        blocos = []
+        for intervalo in intervalos:
+            col_ini, lin_ini, col_fim, lin_fim = _INTERVALO.match(intervalo).groups()
+            linhas = self._valores[int(lin_ini) - 1: int(lin_fim) if lin_fim else None]
+            bloco = [linha[_numero_coluna(col_ini) - 1: _numero_coluna(col_fim)] for linha in linhas]
+            # Como a API, omite as células vazias do fim de cada linha e as linhas vazias do fim
+            bloco = [linha[: max((i + 1 for i, v in enumerate(linha) if v != ""), default=0)] for linha in bloco]
+            while bloco and not bloco[-1]:
+                bloco.pop()
+            blocos.append(bloco)
+        self._chamada("batch_get", sum(len(linha) for bloco in blocos for linha in bloco))
+        return blocos
+
+    # --- escrita ---
+    def append_rows(self, linhas, **kwargs):
+        self._chamada("append_rows", sum(len(linha) for linha in linhas))
+        primeira = len(self._valores) + 1
+        self._valores.extend([str(v) for v in linha] for linha in linhas)
+        self._tocar()
+        # Como a API (values.append), informa o intervalo em que as linhas foram gravadas
+        largura = max((len(linha) for linha in linhas), default=1)
+        ultima = gspread.utils.rowcol_to_a1(len(self._valores), largura)
+        return {"updates": {"updatedRange": f"{self.title}!A{primeira}:{ultima}"}}
+
+    def update(self, range_name=None, values=None, **kwargs):
+        # Como no gspread 5, aceita update(valores) escrevendo a partir de A1
+        if values is None:
+            range_name, values = "A1", range_name
+        self._chamada("update", sum(len(linha) for linha in values))
+        if range_name != "A1":
+            raise NotImplementedError("FakeWorksheet.update só escreve a partir de A1.")
+        for i, linha in enumerate(values):
+            if i < len(self._valores):
+                self._valores[i] = [str(v) for v in linha]
+            else:
+                self._valores.append([str(v) for v in linha])
+        self._tocar()
+
+    def batch_update(self, atualizacoes, **kwargs):
+        self._chamada("batch_update", sum(len(linha) for a in atualizacoes for linha in a["values"]))
+        for atualizacao in atualizacoes:
+            inicio, fim = _INTERVALO_LINHA.match(atualizacao["range"]).groups()
+            for deslocamento, linha in enumerate(atualizacao["values"][: int(fim) - int(inicio) + 1]):
+                self._valores[int(inicio) - 1 + deslocamento] = [str(v) for v in linha]
+        self._tocar()
+
+    def clear(self):
+        self._chamada("clear")
+        self._valores = []
+        self._tocar()
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+        self.id = f"fake-{title}"
+        self._abas = {}
+        self._atualizada_em = datetime.now(timezone.utc)
+
+    def tocar(self):
+        self._atualizada_em = datetime.now(timezone.utc)
+
+    def add_worksheet(self, title, valores=None, **kwargs):
+        aba = FakeWorksheet(self, title, valores, id_=len(self._abas))
+        self._abas[title] = aba
+        return aba
+
+    def worksheet(self, title):
+        self.client.registrar("worksheet")
+        if title not in self._abas:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._abas[title]
+
+    def get_lastUpdateTime(self):
+        self.client.registrar("get_lastUpdateTime")
+        return self._atualizada_em.isoformat()
+
+    def batch_update(self, corpo):
+        """Só os pedidos deleteDimension de linhas, como os enviados por SheetsStorage.delete."""
+        self.client.registrar("spreadsheet.batch_update")
+        for pedido in corpo["requests"]:
+            intervalo = pedido["deleteDimension"]["range"]
+            aba = next(a for a in self._abas.values() if a.id == intervalo["sheetId"])
+            del aba._valores[intervalo["startIndex"]:intervalo["endIndex"]]
+        self.tocar()
+
+
+class FakeClient:
+    """
+    Cliente falso: cada chamada dorme `latencia` segundos mais um custo proporcional
+    às células transferidas, e é contada em `chamadas` (por método) e por thread, para
+    separar as chamadas feitas pela fila de escrita em segundo plano.
+    """
+
+    def __init__(self, latencia=LATENCIA_PADRAO, segundos_por_mil_celulas=SEGUNDOS_POR_MIL_CELULAS):
+        self.latencia = latencia
+        self.segundos_por_mil_celulas = segundos_por_mil_celulas
+        self.chamadas = Counter()
+        self.chamadas_por_thread = Counter()
+        self._planilhas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, metodo, celulas=0):
+        with self._lock:
+            self.chamadas[metodo] += 1
+            self.chamadas_por_thread[threading.get_ident()] += 1
+        espera = self.latencia + celulas / 1000 * self.segundos_por_mil_celulas
+        if espera > 0:
+            time.sleep(espera)
+
+    def criar_planilha(self, title):
+        planilha = FakeSpreadsheet(self, title)
+        self._planilhas[title] = planilha
+        return planilha
+
+    def open(self, title):
+        self.registrar("open")
+        return self._planilhas[title]
+
+    def open_by_key(self, key):
+        self.registrar("open_by_key")
+        return next(p for p in self._planilhas.values() if p.id == key)
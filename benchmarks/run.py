@@ -0,0 +1,377 @@
+"""
+Suíte de benchmarks do FinApp.
+
+Gera históricos sintéticos (dados_sinteticos.py), monta um Google Sheets falso em memória
+com latência simulada (fake_sheets.py) e cronometra os caminhos quentes do app: leitura
+da planilha, load_expenses, o bloco de filtros do main(), os dashboards, save_expenses e
+as gravações da grade. O resultado vai para um JSON, para comparar execuções ao longo do tempo.
+
+Uso:
+    python benchmarks/run.py                                  # 1k, 10k, 100k e 1M linhas
+    python benchmarks/run.py --tamanhos 1000 10000 --latencia 0
+    python benchmarks/run.py --comparar benchmarks/resultados/anterior.json
+
+As funções do Streamlit rodam sem servidor ("bare mode"): os gráficos são montados,
+mas nada é enviado a um navegador.
+"""
+# ======================== IMPORTS ========================
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import streamlit.logger  # noqa: E402
+
+# Sem `streamlit run`, cada chamada st.* avisa que não há contexto de script
+streamlit.logger.set_log_level("error")
+
+import app  # noqa: E402
+import write_queue  # noqa: E402
+from figures import FigureCache  # noqa: E402
+from ids import IdAllocator  # noqa: E402
+from watcher import RevisionWatcher  # noqa: E402
+from importer import ler_extrato, preparar_importacao  # noqa: E402
+from export import FORMATOS, exportar  # noqa: E402
+from filters import FilterIndex  # noqa: E402
+from sheets import SheetsConnection  # noqa: E402
+from storage import SheetsStorage  # noqa: E402
+from store import ExpenseStore  # noqa: E402
+
+from recurrence import data_horizonte, expandir  # noqa: E402
+from schema import aplicar_esquema  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+from dados_sinteticos import gerar_despesas, gerar_extrato_csv, gerar_regras, para_planilha  # noqa: E402
+from fake_sheets import LATENCIA_PADRAO, SEGUNDOS_POR_MIL_CELULAS, FakeClient  # noqa: E402
+
+# ======================== CONSTANTES ========================
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000, 1_000_000]
+REPETICOES_PADRAO = 3
+DIRETORIO_RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+
+# Filtros usados nas medições: um mês de um usuário, como na abertura do app
+FILTRO = {"usuario": "Ana", "ano": 2025, "mes": 6, "categorias": ["Todas"]}
+LINHAS_EDITADAS = 3
+LINHAS_EXCLUIDAS = 3
+LINHAS_EXTRATO = 5000
+BUSCA = "pedido pre"  # dois termos: um trecho de palavra e um início de palavra
+
+
+# ======================== AMBIENTE ISOLADO ========================
+@contextmanager
+def app_isolado(storage, diretorio):
+    """
+    Aponta os recursos compartilhados do app (storage, store, fila de escrita, cache de
+    figuras, snapshot e journal) para instâncias do benchmark e restaura tudo ao sair. `estado["store"]` pode
+    ser trocado para simular um processo recém-iniciado.
+    """
+    nomes = ["get_storage", "get_expense_store", "get_write_queue", "get_id_allocator", "get_figure_cache", "SNAPSHOT_DIR", "SNAPSHOT_PARTITIONS_DIR", "SNAPSHOT_CATALOG_FILE", "SNAPSHOT_RULES_FILE", "JOURNAL_FILE"]
+    originais = {nome: getattr(app, nome) for nome in nomes}
+    janela_original = write_queue.JANELA_AGRUPAMENTO
+    estado = {"store": ExpenseStore()}
+    try:
+        app.SNAPSHOT_DIR = diretorio
+        app.SNAPSHOT_PARTITIONS_DIR = os.path.join(diretorio, "despesas")
+        app.SNAPSHOT_CATALOG_FILE = os.path.join(diretorio, "catalogo.json")
+        app.SNAPSHOT_RULES_FILE = os.path.join(diretorio, "recorrencias.parquet")
+        app.JOURNAL_FILE = os.path.join(diretorio, "fila_escrita.jsonl")
+        app.get_storage = lambda: storage
+        estado["ids"] = IdAllocator(storage)
+        app.get_id_allocator = lambda: estado["ids"]
+        app.get_expense_store = lambda: estado["store"]
+        estado["figuras"] = FigureCache()
+        app.get_figure_cache = lambda: estado["figuras"]
+        # Sem a janela de agrupamento, o tempo até sincronizar é só o do backend
+        write_queue.JANELA_AGRUPAMENTO = 0
+        estado["fila"] = originais["get_write_queue"]()
+        app.get_write_queue = lambda: estado["fila"]
+        yield estado
+    finally:
+        for nome, valor in originais.items():
+            setattr(app, nome, valor)
+        write_queue.JANELA_AGRUPAMENTO = janela_original
+
+
+# ======================== MEDIÇÃO ========================
+def medir(nome, funcao, repeticoes, client, preparar=None):
+    """
+    Roda `preparar` (fora do cronômetro) e `funcao` `repeticoes` vezes; devolve o resumo em ms
+    e a média de chamadas à API feitas pela própria operação (sem as da fila em segundo plano).
+    """
+    thread = threading.get_ident()
+    tempos = []
+    chamadas = []
+    for _ in range(repeticoes):
+        if preparar is not None:
+            preparar()
+        antes = client.chamadas_por_thread[thread]
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        chamadas.append(client.chamadas_por_thread[thread] - antes)
+    return {
+        "operacao": nome,
+        "ms_min": round(min(tempos), 3),
+        "ms_mediana": round(statistics.median(tempos), 3),
+        "ms_media": round(statistics.fmean(tempos), 3),
+        "chamadas_api": round(statistics.fmean(chamadas), 2),
+        "repeticoes": repeticoes,
+    }
+
+
+def _pagina_editada(pagina, rng):
+    """Página como a grade devolveria depois de o usuário editar algumas células."""
+    editada = pagina.copy()
+    linhas = rng.choice(len(editada), min(LINHAS_EDITADAS, len(editada)), replace=False)
+    editada.iloc[linhas, editada.columns.get_loc("Valor")] += 1.0
+    editada.iloc[linhas, editada.columns.get_loc("Descricao")] = "editado no benchmark"
+    return editada
+
+
+def rodar_tamanho(n, args):
+    """Executa todas as medições para um histórico de `n` despesas."""
+    df_inicial = gerar_despesas(n, seed=args.seed)
+    client = FakeClient(latencia=args.latencia, segundos_por_mil_celulas=args.segundos_por_mil_celulas)
+    planilha = client.criar_planilha(app.SHEET_NAME)
+    planilha.add_worksheet(app.WORKSHEET_NAME, para_planilha(df_inicial))
+    storage = SheetsStorage(SheetsConnection(client, app.SHEET_NAME, planilha.id), app.WORKSHEET_NAME)
+    rng = np.random.default_rng(args.seed)
+    r = args.repeticoes
+    resultados = []
+
+    def registrar(nome, funcao, preparar=None, repeticoes=r):
+        resultado = medir(nome, funcao, repeticoes, client, preparar)
+        resultado["tamanho"] = n
+        resultados.append(resultado)
+        print(f"  {nome:<45}{resultado['ms_mediana']:>12.1f} ms  ({resultado['chamadas_api']:g} chamadas)")
+
+    with tempfile.TemporaryDirectory() as diretorio, app_isolado(storage, diretorio) as estado:
+        fila = estado["fila"]
+
+        def processo_novo(apagar_snapshot, carregar=False):
+            def preparar():
+                estado["store"] = ExpenseStore()
+                if apagar_snapshot:
+                    shutil.rmtree(app.SNAPSHOT_PARTITIONS_DIR, ignore_errors=True)
+                    if os.path.exists(app.SNAPSHOT_CATALOG_FILE):
+                        os.remove(app.SNAPSHOT_CATALOG_FILE)
+                if carregar:
+                    app.load_expenses()
+            return preparar
+
+        # --- leitura ---
+        registrar("SheetsStorage.load", storage.load)
+        registrar(f"SheetsStorage.load (ano {FILTRO['ano']})", lambda: storage.load([FILTRO["ano"]]))
+        registrar("load_expenses (planilha)", app.load_expenses, processo_novo(apagar_snapshot=True))
+        registrar("load_expenses (snapshot)", app.load_expenses, processo_novo(apagar_snapshot=False))
+        registrar("load_expenses (sem mudanças)", app.load_expenses)
+        # O que a thread do vigia faz a cada INTERVALO_VERIFICACAO quando ninguém gravou nada
+        vigia = RevisionWatcher(storage, lambda revisao: None, intervalo=3600)
+        vigia.revisao = storage.revision()
+        registrar("vigia de revisão (sem mudanças)", vigia._verificar)
+
+        # --- anos anteriores, carregados sob demanda (Tendências ou ano "Todos") ---
+        def historico():
+            app.garantir_particoes(estado["store"].catalog["particoes"])
+        registrar("garantir_particoes (histórico, planilha)", historico, processo_novo(apagar_snapshot=True, carregar=True))
+        registrar("garantir_particoes (histórico, cache)", historico, processo_novo(apagar_snapshot=False, carregar=True))
+
+        # --- filtros (BLOCO 5 do main) ---
+        store = estado["store"]
+        df, indice = store.indexed()
+        registrar("filtros (índice novo)", lambda: df.take(FilterIndex(df).select(**FILTRO)))
+        registrar("filtros (memorizados)", lambda: df.take(indice.select(**FILTRO)))
+
+        # --- esquema compacto (conversão na carga e o que ela economiza nos agrupamentos) ---
+        lido = storage.load()
+        registrar("esquema: aplicar ao frame lido", lambda: aplicar_esquema(lido))
+        registrar("groupby Categoria (sem esquema)", lambda: lido.groupby("Categoria")["Valor"].sum())
+        compacto = aplicar_esquema(lido)
+        registrar("groupby Categoria (esquema compacto)", lambda: compacto.groupby("Categoria", observed=True)["Valor"].sum())
+
+        # --- busca textual (índice invertido, cruzado com os filtros da tabela) ---
+        registrar("busca: montar índice", lambda: SearchIndex.from_frame(store.df))
+        busca = SearchIndex.from_frame(store.df)
+        registrar(f"busca: {BUSCA!r}", lambda: busca.search(BUSCA), busca._memo.clear)
+        gravadas = df.take(indice.select(**FILTRO, ocorrencias=False))
+        registrar(f"busca: {BUSCA!r} + filtros (memorizada)", lambda: gravadas[
+            np.isin(gravadas["id_original"].to_numpy(), busca.search(BUSCA))
+        ])
+
+        # --- recorrências (expandidas a cada carga e a cada regra nova ou excluída) ---
+        regras = gerar_regras(max(1, n // 50), seed=args.seed)
+        registrar(f"recorrências: expandir {len(regras)} regras", lambda: expandir(regras, horizonte=data_horizonte()))
+
+        # --- dashboards ---
+        df_filtrado = df.take(indice.select(**FILTRO))
+        cube = store.cube
+        app.st.session_state["filtro_usuario"] = FILTRO["usuario"]
+        fatia = cube.slice(FILTRO["usuario"], FILTRO["ano"], FILTRO["mes"], FILTRO["categorias"])
+        registrar("render_dashboard", lambda: app.render_dashboard(df_filtrado, fatia))
+        registrar("render_dashboard_analise_mensal", lambda: app.render_dashboard_analise_mensal(cube, FILTRO["ano"], FILTRO["mes"]))
+        registrar("render_dashboard_tendencias", lambda: app.render_dashboard_tendencias(cube.slice(usuario=FILTRO["usuario"])))
+        registrar("render_dashboard_deep_dive", lambda: app.render_dashboard_deep_dive(
+            df_filtrado, cube.slice(FILTRO["usuario"], FILTRO["ano"], FILTRO["mes"], FILTRO["categorias"]),
+        ))
+        # Com a chave, a partir da segunda repetição as figuras vêm do cache compartilhado
+        chave = (store.version, "Visão Detalhada", FILTRO["usuario"], FILTRO["ano"], FILTRO["mes"], None)
+        registrar("render_dashboard_deep_dive (figuras em cache)", lambda: app.render_dashboard_deep_dive(
+            df_filtrado, cube.slice(FILTRO["usuario"], FILTRO["ano"], FILTRO["mes"], FILTRO["categorias"]), chave,
+        ))
+
+        # --- exportação do histórico (em blocos, direto no disco) ---
+        for formato, (extensao, _) in FORMATOS.items():
+            def exportar_historico(formato=formato, extensao=extensao):
+                with open(os.path.join(diretorio, f"exportacao.{extensao}"), "wb") as destino:
+                    exportar(store.df, formato, destino)
+            # O XLSX grava célula a célula: uma repetição basta
+            registrar(f"exportar {formato} (histórico)", exportar_historico, repeticoes=1 if formato == "XLSX" else r)
+
+        # --- escrita: caminho do app (store + fila) ---
+        # A primeira chamada reserva um bloco no backend; as seguintes não saem do processo
+        registrar("get_next_id (parcelas de 12)", lambda: app.get_next_id(12))
+
+        def nova_despesa():
+            linha = df_inicial.iloc[[0]].copy()
+            linha["id_original"] = app.get_next_id()
+            return linha
+
+        registrar("save_expenses (nova despesa)", lambda: app.save_expenses(novas=nova_despesa()), fila.wait_idle)
+
+        pagina = {}
+
+        def preparar_edicao():
+            fila.wait_idle()
+            atual = estado["store"].df
+            pagina["enviada"] = app._pagina_ordenada(atual, "Data", True, 1)
+            pagina["devolvida"] = _pagina_editada(pagina["enviada"], rng)
+
+        registrar("grade: salvar edições", lambda: app.salvar_edicoes_da_grade(pagina["enviada"], pagina["devolvida"]), preparar_edicao)
+
+        excluir = {}
+
+        def preparar_exclusao():
+            fila.wait_idle()
+            excluir["ids"] = estado["store"].df["id_original"].sample(LINHAS_EXCLUIDAS, random_state=rng.integers(1 << 31)).tolist()
+
+        registrar("grade: excluir", lambda: app.excluir_despesas(excluir["ids"]), preparar_exclusao)
+        fila.wait_idle()
+
+        # --- importação de extrato: leitura em blocos, deduplicação e um único append ---
+        extrato = {"seed": args.seed}
+
+        def preparar_extrato():
+            fila.wait_idle()
+            extrato["seed"] += 1  # um extrato diferente a cada repetição, para não ser todo duplicado
+            extrato["bytes"] = gerar_extrato_csv(LINHAS_EXTRATO, seed=extrato["seed"])
+
+        def importar_extrato():
+            lido = ler_extrato(io.BytesIO(extrato["bytes"]), "extrato.csv")
+            novas, _ = preparar_importacao(lido, estado["store"].df, "Cartão", "Ana", 0)
+            inicio = app.get_next_id(len(novas))
+            novas = novas.assign(id_original=np.arange(inicio, inicio + len(novas), dtype=int))
+            estado["store"].apply(novas=novas)
+            app.save_expenses(novas=novas)
+            extrato["novas"] = novas
+
+        registrar(f"importar extrato CSV ({LINHAS_EXTRATO} linhas)", importar_extrato, preparar_extrato)
+        fila.wait_idle()
+
+        # --- escrita: custo no backend (o que a fila faz em segundo plano) ---
+        registrar("SheetsStorage.append (1 linha)", lambda: storage.append(nova_despesa()))
+        registrar(f"SheetsStorage.append (extrato, {LINHAS_EXTRATO} linhas)", lambda: storage.append(extrato["novas"]), repeticoes=1)
+        registrar("SheetsStorage.update", lambda: storage.update(pagina["devolvida"]), preparar_edicao)
+        registrar(
+            "SheetsStorage.update (merge com originais)",
+            lambda: storage.update(pagina["devolvida"], originais=pagina["enviada"]), preparar_edicao,
+        )
+        registrar("SheetsStorage.delete", lambda: storage.delete(excluir["ids"]), preparar_exclusao)
+
+    return resultados
+
+
+# ======================== RELATÓRIOS ========================
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(resultados, caminho_base):
+    """Imprime a razão entre as medianas desta execução e as de um JSON anterior."""
+    with open(caminho_base, encoding="utf-8") as f:
+        base = {(r["tamanho"], r["operacao"]): r for r in json.load(f)["resultados"]}
+    print(f"\nComparação com {caminho_base} (mediana atual / anterior):")
+    for r in resultados:
+        anterior = base.get((r["tamanho"], r["operacao"]))
+        if anterior is None or not anterior["ms_mediana"]:
+            continue
+        razao = r["ms_mediana"] / anterior["ms_mediana"]
+        print(f"  {r['tamanho']:>9,}  {r['operacao']:<45}{razao:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO)
+    parser.add_argument("--repeticoes", type=int, default=REPETICOES_PADRAO)
+    parser.add_argument("--latencia", type=float, default=LATENCIA_PADRAO, help="segundos por chamada à API falsa")
+    parser.add_argument("--segundos-por-mil-celulas", type=float, default=SEGUNDOS_POR_MIL_CELULAS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--saida", help="arquivo JSON de saída (padrão: benchmarks/resultados/<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    resultados = []
+    for n in args.tamanhos:
+        print(f"\n{n:,} despesas")
+        resultados.extend(rodar_tamanho(n, args))
+
+    relatorio = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_atual(),
+        "ambiente": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plataforma": platform.platform(),
+        },
+        "configuracao": {
+            "tamanhos": args.tamanhos,
+            "repeticoes": args.repeticoes,
+            "latencia_s": args.latencia,
+            "segundos_por_mil_celulas": args.segundos_por_mil_celulas,
+            "seed": args.seed,
+            "filtro": FILTRO,
+        },
+        "resultados": resultados,
+    }
+    saida = args.saida or os.path.join(DIRETORIO_RESULTADOS, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {saida}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == "__main__":
+    main()
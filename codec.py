@@ -0,0 +1,268 @@
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+
+# ======================== CONSTANTES ========================
+FORMATO_DATA_BR = "%d/%m/%Y"
+FORMATO_DATA_ISO = "%Y-%m-%d"
+
+# Caracteres aceitos antes do primeiro dígito no caminho rápido de leitura ("R$ -1.234,56")
+_PREFIXOS_VALOR = tuple(ord(ch) for ch in " R$+-")
+# Centavos com mais dígitos que isso não cabem com folga num int64
+_MAX_DIGITOS = 17
+
+_ZERO, _VIRGULA, _PONTO, _MENOS, _NUL = ord("0"), ord(","), ord("."), ord("-"), 0
+
+
+# ======================== AUXILIARES ========================
+# Os textos são montados e lidos como matrizes de códigos Unicode (uma linha por valor,
+# uma coluna por caractere), o que troca o laço em Python por elemento por algumas
+# operações do NumPy por coluna.
+
+def _matriz_de_textos(textos):
+    """Matriz (n, largura) de códigos uint32 dos textos; posições além do fim ficam com 0."""
+    arr = np.ascontiguousarray(textos, dtype=str)
+    return arr.view(np.uint32).reshape(len(arr), arr.dtype.itemsize // 4)
+
+
+def _textos_de_matriz(matriz):
+    """Inverso de _matriz_de_textos: devolve um array de objetos str (zeros à direita são descartados)."""
+    matriz = np.ascontiguousarray(matriz, dtype=np.uint32)
+    return matriz.view(f"<U{matriz.shape[1]}").ravel().astype(object)
+
+
+def _quantidade_de_digitos(inteiros):
+    """Número de dígitos decimais de cada inteiro não negativo (0 tem 1 dígito)."""
+    digitos = np.ones(len(inteiros), dtype=np.int64)
+    resto = inteiros // 10
+    while True:
+        ativo = resto > 0
+        if not ativo.any():
+            return digitos
+        digitos += ativo
+        resto //= 10
+
+
+# ======================== MOEDA ========================
+def _ler_textos_rapido(textos):
+    """
+    Lê textos no formato "[R$][-]1.234,56" direto da matriz de caracteres.
+
+    Devolve (centavos, ok); as linhas com ok=False (espaços no meio, mais de 2 casas
+    decimais, notação científica...) precisam do caminho lento.
+    """
+    colunas = _matriz_de_textos(textos).T.copy()  # uma linha por posição: acesso contíguo
+    n = colunas.shape[1]
+    centavos = np.zeros(n, dtype=np.int64)
+    negativo = np.zeros(n, dtype=bool)
+    invalido = np.zeros(n, dtype=bool)
+    casas = np.zeros(n, dtype=np.int64)
+    digitos = np.zeros(n, dtype=np.int64)
+    # 0 = antes do número, 1 = parte inteira, 2 = parte decimal
+    estado = np.zeros(n, dtype=np.int8)
+
+    for caractere in colunas:
+        eh_digito = (caractere - _ZERO) <= 9  # uint32: valores abaixo de "0" dão a volta
+        eh_virgula = caractere == _VIRGULA
+        eh_nulo = caractere == _NUL
+        prefixo, inteira, decimal = estado == 0, estado == 1, estado == 2
+
+        invalido |= prefixo & ~(eh_digito | eh_nulo | np.isin(caractere, _PREFIXOS_VALOR))
+        invalido |= inteira & ~(eh_digito | eh_nulo | eh_virgula | (caractere == _PONTO))
+        invalido |= decimal & ~(eh_digito | eh_nulo)
+        negativo |= prefixo & (caractere == _MENOS)
+
+        centavos = np.where(eh_digito, centavos * 10 + (caractere - _ZERO).astype(np.int64), centavos)
+        digitos += eh_digito
+        casas += decimal & eh_digito
+        estado = np.where(prefixo & eh_digito, 1, np.where(inteira & eh_virgula, 2, estado)).astype(np.int8)
+
+    ok = ~invalido & (estado > 0) & (casas <= 2) & (digitos <= _MAX_DIGITOS)
+    centavos *= 10 ** (2 - np.minimum(casas, 2))
+    centavos[~ok] = 0
+    return np.where(negativo, -centavos, centavos), ok
+
+
+def _ler_textos_lento(textos):
+    """Leitura tolerante (espaços, notação científica, mais casas decimais) com o acessor .str."""
+    limpo = (
+        textos.str.strip()
+        .str.replace("R$", "", regex=False)
+        .str.replace(" ", "", regex=False)
+        .str.replace(".", "", regex=False)
+        .str.replace(",", ".", regex=False)
+    )
+    reais = pd.to_numeric(limpo, errors="coerce").to_numpy(dtype=float)
+    return np.nan_to_num(np.rint(reais * 100), nan=0.0).astype(np.int64)
+
+
+def parse_centavos(valores):
+    """
+    Converte valores em reais para centavos inteiros (int64), de forma vetorizada.
+
+    Aceita números e textos no padrão brasileiro ("1.234,56", "R$ 12,5", "-3,10");
+    vazios, nulos e textos inválidos viram 0, como em safe_parse_value.
+    """
+    serie = pd.Series(valores, copy=False)
+    if serie.empty:
+        return np.zeros(0, dtype=np.int64)
+
+    tipo = pd.api.types.infer_dtype(serie, skipna=True)
+    if tipo not in ("string", "mixed", "mixed-integer"):
+        reais = pd.to_numeric(serie, errors="coerce").to_numpy(dtype=float)
+        return np.nan_to_num(np.rint(reais * 100), nan=0.0).astype(np.int64)
+
+    if tipo == "string":
+        eh_texto = serie.notna().to_numpy()
+    else:
+        # Textos e números podem vir misturados (ex.: dados devolvidos pela grade)
+        eh_texto = serie.map(type).to_numpy() == str
+    centavos = np.zeros(len(serie), dtype=np.int64)
+    if not eh_texto.all():
+        numeros = pd.to_numeric(serie[~eh_texto], errors="coerce").to_numpy(dtype=float)
+        centavos[~eh_texto] = np.nan_to_num(np.rint(numeros * 100), nan=0.0).astype(np.int64)
+    if eh_texto.any():
+        textos = serie[eh_texto]
+        lidos, ok = _ler_textos_rapido(textos.to_numpy())
+        if not ok.all():
+            lidos[~ok] = _ler_textos_lento(textos[~ok])
+        centavos[eh_texto] = lidos
+    return centavos
+
+
+def parse_brl(valores):
+    """Como parse_centavos, mas devolve uma Series de floats em reais (arredondados a 2 casas)."""
+    serie = pd.Series(valores, copy=False)
+    return pd.Series(parse_centavos(serie) / 100, index=serie.index)
+
+
+def _formatar_centavos(centavos, separador_milhar, prefixo):
+    """Monta os textos "<prefixo>[-]<inteiro>,<cc>" a partir dos centavos, um dígito por vez para todas as linhas."""
+    centavos = np.asarray(centavos, dtype=np.int64)
+    n = len(centavos)
+    if n == 0:
+        return np.empty(0, dtype=object)
+    negativo = centavos < 0
+    absoluto = np.abs(centavos)
+    inteiro = absoluto // 100
+
+    digitos = _quantidade_de_digitos(inteiro)
+    separadores = (digitos - 1) // 3 if separador_milhar else 0
+    comprimento = len(prefixo) + negativo + digitos + separadores + 3
+    matriz = np.zeros((n, int(comprimento.max())), dtype=np.uint32)
+    linhas = np.arange(n)
+
+    # Da direita para a esquerda: centavos, vírgula e a parte inteira com separadores
+    fim = comprimento - 1
+    matriz[linhas, fim] = _ZERO + absoluto % 10
+    matriz[linhas, fim - 1] = _ZERO + absoluto // 10 % 10
+    matriz[linhas, fim - 2] = _VIRGULA
+    posicao = fim - 3
+    ativo = np.ones(n, dtype=bool)
+    escritos = 0
+    while ativo.any():
+        if separador_milhar and escritos and escritos % 3 == 0:
+            matriz[linhas[ativo], posicao[ativo]] = ord(separador_milhar)
+            posicao[ativo] -= 1
+        matriz[linhas[ativo], posicao[ativo]] = _ZERO + inteiro[ativo] % 10
+        posicao[ativo] -= 1
+        inteiro //= 10
+        escritos += 1
+        ativo = inteiro > 0
+
+    matriz[linhas[negativo], posicao[negativo]] = _MENOS
+    for i, caractere in enumerate(prefixo):
+        matriz[:, i] = ord(caractere)
+    return _textos_de_matriz(matriz)
+
+
+def _centavos_de_numeros(valores):
+    serie = pd.Series(valores, copy=False)
+    reais = pd.to_numeric(serie, errors="coerce").fillna(0).to_numpy(dtype=float)
+    return serie.index, np.rint(reais * 100).astype(np.int64)
+
+
+def format_brl(valores, simbolo=True):
+    """Formata valores em reais como "R$ 1.234,56" (ou "1.234,56" sem o símbolo), vetorizado."""
+    indice, centavos = _centavos_de_numeros(valores)
+    return pd.Series(_formatar_centavos(centavos, ".", "R$ " if simbolo else ""), index=indice)
+
+
+def format_planilha(valores):
+    """Formato gravado na planilha: duas casas, vírgula decimal e sem milhar ("1234,56")."""
+    indice, centavos = _centavos_de_numeros(valores)
+    return pd.Series(_formatar_centavos(centavos, "", ""), index=indice)
+
+
+# ======================== DATAS ========================
+def parse_datas(valores):
+    """
+    Converte datas em texto para datetime64, aceitando ISO ("2024-05-31", com ou sem hora)
+    e o padrão brasileiro ("31/05/2024"). Valores inválidos viram NaT.
+    """
+    serie = pd.Series(valores, copy=False)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    datas = pd.to_datetime(serie, format="ISO8601", errors="coerce")
+    faltando = datas.isna()
+    if faltando.any():
+        # Conferir os nulos do texto custa quase tanto quanto a conversão: só quando sobrou algum NaT
+        faltando &= serie.notna()
+    if faltando.any():
+        # Só o que não é ISO passa pelas conversões mais caras (espaços, formato brasileiro)
+        texto = serie[faltando].astype(str).str.strip()
+        outras = pd.to_datetime(texto, format="ISO8601", errors="coerce")
+        outras = outras.fillna(pd.to_datetime(texto, format=FORMATO_DATA_BR, errors="coerce"))
+        datas = datas.where(~faltando, outras)
+    return datas
+
+
+# Posição (coluna inicial, nº de dígitos) de dia, mês e ano, e dos separadores, em cada formato fixo
+_LAYOUT_DATAS = {
+    FORMATO_DATA_BR: ({"dia": (0, 2), "mes": (3, 2), "ano": (6, 4)}, {2: "/", 5: "/"}),
+    FORMATO_DATA_ISO: ({"ano": (0, 4), "mes": (5, 2), "dia": (8, 2)}, {4: "-", 7: "-"}),
+}
+
+
+def format_datas(valores, formato=FORMATO_DATA_BR):
+    """Formata datas (NaT vira texto vazio)."""
+    datas = pd.to_datetime(pd.Series(valores, copy=False), errors="coerce")
+    if formato not in _LAYOUT_DATAS:
+        return datas.dt.strftime(formato).fillna("")
+
+    campos, separadores = _LAYOUT_DATAS[formato]
+    valida = datas.notna().to_numpy()
+    partes = {
+        "dia": datas.dt.day.fillna(0).to_numpy(dtype=np.int64),
+        "mes": datas.dt.month.fillna(0).to_numpy(dtype=np.int64),
+        "ano": datas.dt.year.fillna(0).to_numpy(dtype=np.int64),
+    }
+    matriz = np.zeros((len(datas), 10), dtype=np.uint32)
+    for campo, (inicio, largura) in campos.items():
+        numero = partes[campo]
+        for i in range(largura - 1, -1, -1):
+            matriz[:, inicio + i] = _ZERO + numero % 10
+            numero = numero // 10
+    for coluna, separador in separadores.items():
+        matriz[:, coluna] = ord(separador)
+    matriz[~valida] = 0
+    return pd.Series(_textos_de_matriz(matriz), index=datas.index)
+
+
+# ======================== TEXTO ========================
+def texto_sem_nulos(valores):
+    """
+    Série de textos com os nulos como "". Passa por object antes de preencher: numa coluna
+    categórica (ver schema.py) um fillna("") exigiria "" entre as categorias.
+    """
+    serie = pd.Series(valores, dtype=object, copy=False)
+    return serie.where(serie.notna(), "").astype(str)
+
+
+def normalizar_texto(textos):
+    """Minúsculas, sem acentos e com espaços simples: a forma usada para comparar e buscar descrições."""
+    serie = texto_sem_nulos(textos)
+    return (
+        serie.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+        .str.casefold().str.replace(r"\s+", " ", regex=True).str.strip()
+    )
@@ -0,0 +1,96 @@
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+
+from codec import parse_centavos, texto_sem_nulos
+
+# ======================== CONSTANTES ========================
+DIMENSOES = ["Usuario", "AnoMes", "Categoria", "Tag", "Pagamento"]
+SEM_DATA = -1  # AnoMes das despesas sem data válida
+
+
+def ano_mes(datas):
+    """Chave inteira AAAAMM (ex.: 202405) para uma série de datas; SEM_DATA para datas inválidas."""
+    datas = pd.to_datetime(datas, errors="coerce")
+    chave = (datas.dt.year * 100 + datas.dt.month).fillna(SEM_DATA)
+    return chave.astype(np.int32)
+
+
+def ano_mes_para_timestamp(chaves):
+    """Converte chaves AAAAMM em Timestamps do primeiro dia do mês (para os eixos dos gráficos)."""
+    return pd.to_datetime(pd.Series(chaves).astype(str), format="%Y%m")
+
+
+# ======================== CUBO ========================
+class AggregateCube:
+    """
+    Somas e contagens de Valor por (Usuario, AnoMes, Categoria, Tag, Pagamento).
+    As somas são guardadas em centavos inteiros, então incluir e retirar linhas
+    repetidamente não acumula erro de ponto flutuante.
+
+    O cubo tem no máximo usuários × meses × categorias × tags × pagamentos linhas,
+    independentemente de quantas despesas existam, então os dashboards leem fatias
+    dele em vez de agrupar as despesas a cada rerun. Instâncias são imutáveis:
+    `with_rows`/`without_rows` devolvem um cubo novo, atualizado só com a diferença.
+    """
+
+    def __init__(self, data):
+        # data: DataFrame indexado pelas DIMENSOES, com as colunas Centavos e Quantidade
+        self.data = data
+
+    @staticmethod
+    def _agregar(df):
+        if df is None or df.empty:
+            indice = pd.MultiIndex.from_arrays([[] for _ in DIMENSOES], names=DIMENSOES)
+            return pd.DataFrame({"Centavos": pd.Series(dtype=np.int64), "Quantidade": pd.Series(dtype=np.int64)}, index=indice)
+        chaves = pd.DataFrame({
+            "Usuario": texto_sem_nulos(df["Usuario"]),
+            "AnoMes": ano_mes(df["Data"]),
+            "Categoria": texto_sem_nulos(df["Categoria"]),
+            "Tag": texto_sem_nulos(df["Tag"]) if "Tag" in df.columns else "",
+            "Pagamento": texto_sem_nulos(df["Pagamento"]),
+            "Centavos": parse_centavos(df["Valor"]),
+        })
+        return chaves.groupby(DIMENSOES, sort=False).agg(Centavos=("Centavos", "sum"), Quantidade=("Centavos", "size"))
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(cls._agregar(df))
+
+    def _combinar(self, delta, sinal):
+        if delta.empty:
+            return self
+        combinado = self.data.add(delta * sinal, fill_value=0)
+        combinado = combinado[combinado["Quantidade"] > 0].astype(np.int64)
+        return AggregateCube(combinado)
+
+    def with_rows(self, df):
+        """Cubo novo incluindo as linhas informadas."""
+        return self._combinar(self._agregar(df), 1)
+
+    def without_rows(self, df):
+        """Cubo novo sem as linhas informadas (que precisam ter sido incluídas antes)."""
+        return self._combinar(self._agregar(df), -1)
+
+    def slice(self, usuario="Todos", ano="Todos", mes=0, categorias=None, anos_meses=None):
+        """
+        Fatia do cubo como DataFrame (uma linha por célula, com Valor em reais), usando as mesmas convenções
+        dos filtros da sidebar: "Todos" para usuário/ano, 0 para todos os meses e
+        categorias contendo "Todas" (ou None) para todas as categorias.
+        `anos_meses` restringe a uma lista explícita de chaves AAAAMM.
+        """
+        fatia = self.data.reset_index()
+        mascara = np.ones(len(fatia), dtype=bool)
+        if usuario != "Todos":
+            mascara &= (fatia["Usuario"] == usuario).to_numpy()
+        if ano != "Todos":
+            mascara &= (fatia["AnoMes"] // 100 == int(ano)).to_numpy()
+        if mes != 0:
+            mascara &= (fatia["AnoMes"] % 100 == int(mes)).to_numpy()
+        if categorias is not None and "Todas" not in categorias:
+            mascara &= fatia["Categoria"].isin(categorias).to_numpy()
+        if anos_meses is not None:
+            mascara &= fatia["AnoMes"].isin(anos_meses).to_numpy()
+        fatia = fatia[mascara]
+        fatia["Valor"] = fatia["Centavos"] / 100
+        return fatia
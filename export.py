@@ -0,0 +1,103 @@
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from codec import format_brl, format_datas
+from storage import COLUNAS_DESPESA
+
+# ======================== CONSTANTES ========================
+LINHAS_POR_BLOCO = 20_000   # linhas convertidas de cada vez: limita a memória extra da exportação
+MAX_LINHAS_XLSX = 1_048_575  # limite de linhas de uma aba do Excel, sem contar o cabeçalho
+COLUNAS_EXPORTADAS = [col for col in COLUNAS_DESPESA if col != "id_original"]
+FORMATO_DATA_XLSX = "dd/mm/yyyy"
+FORMATO_VALOR_XLSX = '"R$" #,##0.00'
+
+# Extensão e tipo MIME de cada formato oferecido no app
+FORMATOS = {
+    "CSV": ("csv", "text/csv"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _blocos(df, tamanho_bloco):
+    for inicio in range(0, len(df), tamanho_bloco):
+        yield df.iloc[inicio:inicio + tamanho_bloco]
+
+
+# ======================== FORMATOS ========================
+def exportar_csv(df, destino, tamanho_bloco=LINHAS_POR_BLOCO):
+    """
+    CSV no padrão brasileiro (";" como separador, datas dd/mm/aaaa e valores "1.234,56"),
+    em UTF-8 com BOM para o Excel reconhecer os acentos. Cada bloco é formatado e gravado
+    antes do próximo, então o texto do arquivo inteiro nunca fica em memória.
+    """
+    destino.write(";".join(COLUNAS_EXPORTADAS).encode("utf-8-sig") + b"\n")
+    for bloco in _blocos(df[COLUNAS_EXPORTADAS], tamanho_bloco):
+        texto = bloco.assign(
+            Data=format_datas(bloco["Data"]).to_numpy(),
+            Valor=format_brl(bloco["Valor"].fillna(0.0), simbolo=False).where(bloco["Valor"].notna(), "").to_numpy(),
+        )
+        destino.write(texto.to_csv(sep=";", header=False, index=False, lineterminator="\n").encode("utf-8"))
+
+
+def exportar_xlsx(df, destino, tamanho_bloco=LINHAS_POR_BLOCO):
+    """
+    Planilha do Excel com datas e valores como números formatados. O XlsxWriter em modo
+    `constant_memory` grava cada linha no disco assim que a próxima começa; acima do limite
+    de linhas do Excel, as despesas continuam numa aba nova.
+    """
+    livro = xlsxwriter.Workbook(destino, {"constant_memory": True})
+    negrito = livro.add_format({"bold": True})
+    formatos = {
+        "Data": livro.add_format({"num_format": FORMATO_DATA_XLSX}),
+        "Valor": livro.add_format({"num_format": FORMATO_VALOR_XLSX}),
+    }
+    col_data, col_valor = COLUNAS_EXPORTADAS.index("Data"), COLUNAS_EXPORTADAS.index("Valor")
+    colunas_texto = [i for i, col in enumerate(COLUNAS_EXPORTADAS) if col not in formatos]
+
+    aba, linha = None, MAX_LINHAS_XLSX
+    for bloco in _blocos(df[COLUNAS_EXPORTADAS], tamanho_bloco):
+        datas = pd.to_datetime(bloco["Data"], errors="coerce").to_numpy().astype("datetime64[us]").tolist()
+        valores = bloco["Valor"].to_numpy(dtype=np.float64)
+        textos = bloco.drop(columns=["Data", "Valor"]).astype(object)
+        textos = textos.where(textos.notna(), "").astype(str).to_numpy().tolist()
+        for data, valor, campos in zip(datas, valores, textos):
+            if linha >= MAX_LINHAS_XLSX:
+                aba = livro.add_worksheet(f"Despesas {len(livro.worksheets()) + 1}" if aba else "Despesas")
+                aba.write_row(0, 0, COLUNAS_EXPORTADAS, negrito)
+                linha = 0
+            linha += 1
+            if not pd.isna(data):
+                aba.write_datetime(linha, col_data, data, formatos["Data"])
+            if not np.isnan(valor):
+                aba.write_number(linha, col_valor, valor, formatos["Valor"])
+            for coluna, campo in zip(colunas_texto, campos):
+                aba.write_string(linha, coluna, campo)
+    if aba is None:
+        livro.add_worksheet("Despesas").write_row(0, 0, COLUNAS_EXPORTADAS, negrito)
+    livro.close()
+
+
+def exportar_parquet(df, destino, tamanho_bloco=LINHAS_POR_BLOCO):
+    """Parquet com os tipos do app, um row group por bloco."""
+    df = df[COLUNAS_EXPORTADAS]
+    # Esquema explícito: um bloco com uma coluna de texto toda vazia não pode virar o tipo nulo.
+    # Categóricas e texto Arrow (dtype.kind "O", ver schema.py) também são gravadas como texto.
+    esquema = pa.schema([
+        (col, pa.string() if df[col].dtype.kind == "O" else pa.from_numpy_dtype(df[col].dtype)) for col in df.columns
+    ])
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for bloco in _blocos(df, tamanho_bloco):
+            escritor.write_table(pa.Table.from_pandas(bloco, schema=esquema, preserve_index=False))
+
+
+_EXPORTADORES = {"CSV": exportar_csv, "XLSX": exportar_xlsx, "Parquet": exportar_parquet}
+
+
+def exportar(df, formato, destino, tamanho_bloco=LINHAS_POR_BLOCO):
+    """Grava as despesas no arquivo binário `destino` (aberto para escrita) no formato pedido (ver FORMATOS)."""
+    _EXPORTADORES[formato](df, destino, tamanho_bloco)
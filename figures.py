@@ -0,0 +1,56 @@
+# ======================== IMPORTS ========================
+import threading
+from collections import OrderedDict
+
+# ======================== CONSTANTES ========================
+MAX_FIGURAS_EM_CACHE = 64
+
+
+# ======================== CACHE DE FIGURAS ========================
+class FigureCache:
+    """
+    LRU das figuras Plotly já montadas, compartilhado por todas as sessões do processo.
+
+    A chave começa pela versão dos dados (ExpenseStore.version) e segue com tudo o que
+    define a figura: filtros da sidebar, dashboard, nome do gráfico e seleções locais.
+    Sessões olhando a mesma fatia reaproveitam a mesma figura; quando aparece uma versão
+    nova, as figuras das anteriores são descartadas de uma vez.
+
+    As figuras devolvidas são compartilhadas e não devem ser alteradas por quem as lê.
+    """
+
+    def __init__(self, max_figuras=MAX_FIGURAS_EM_CACHE):
+        self.max_figuras = max_figuras
+        self._figuras = OrderedDict()
+        self._lock = threading.Lock()
+        self._versao = None
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave, construir):
+        """Figura da `chave` (cuja versão dos dados é `chave[0]`), montada com `construir()` se faltar."""
+        versao = chave[0]
+        with self._lock:
+            if self._versao is None or versao > self._versao:
+                self._figuras.clear()
+                self._versao = versao
+            figura = self._figuras.get(chave)
+            if figura is not None:
+                self._figuras.move_to_end(chave)
+                self.acertos += 1
+                return figura
+            self.faltas += 1
+
+        # Montada fora do lock: duas sessões podem montar a mesma figura ao mesmo tempo,
+        # o que só desperdiça trabalho, enquanto as demais figuras seguem disponíveis.
+        figura = construir()
+        with self._lock:
+            # Quem leu uma versão que já ficou para trás não guarda nada
+            if versao == self._versao:
+                self._figuras[chave] = figura
+                if len(self._figuras) > self.max_figuras:
+                    self._figuras.popitem(last=False)
+        return figura
+
+    def __len__(self):
+        return len(self._figuras)
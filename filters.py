@@ -0,0 +1,104 @@
+# ======================== IMPORTS ========================
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from cube import SEM_DATA, ano_mes
+
+# ======================== CONSTANTES ========================
+COLUNAS_CATEGORICAS = ["Usuario", "Categoria", "Tag", "Pagamento"]
+MAX_FILTROS_MEMORIZADOS = 128
+
+
+# ======================== ÍNDICE DE FILTROS ========================
+class FilterIndex:
+    """
+    Índice somente leitura sobre uma versão do DataFrame de despesas.
+
+    Guarda códigos inteiros (factorize) das colunas categóricas e a chave AAAAMM
+    ordenada por data, de modo que os filtros da sidebar viram uma busca binária
+    no intervalo de datas seguida de comparações de inteiros. `select` devolve as
+    posições das linhas (não cópias) e memoriza o resultado por combinação de filtros.
+
+    As primeiras `gravadas` linhas são despesas gravadas; as demais, ocorrências de
+    regras de recorrência (que podem ser deixadas de fora da seleção).
+    """
+
+    def __init__(self, df, gravadas=None):
+        self.n = len(df)
+        self.gravadas = self.n if gravadas is None else gravadas
+        datas = pd.to_datetime(df["Data"], errors="coerce")
+        # NaT vira o menor int64, então as despesas sem data ficam no início da ordem
+        self._ordem = np.argsort(datas.to_numpy().view(np.int64), kind="stable")
+        self._anomes_ordenado = ano_mes(datas).to_numpy()[self._ordem]
+
+        self._codigos = {}
+        self._valores = {}
+        for col in COLUNAS_CATEGORICAS:
+            serie = df[col] if col in df.columns else pd.Series("", index=df.index)
+            codigos, valores = pd.factorize(serie)
+            self._codigos[col] = codigos.astype(np.int32)
+            self._valores[col] = {valor: codigo for codigo, valor in enumerate(valores)}
+
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()  # o índice é compartilhado entre as sessões
+
+    # --- opções para os widgets ---
+    def anos(self):
+        """Anos presentes, do mais recente para o mais antigo."""
+        chaves = np.unique(self._anomes_ordenado[self._anomes_ordenado != SEM_DATA])
+        return sorted({int(c) // 100 for c in chaves}, reverse=True)
+
+    def valores(self, coluna):
+        """Valores distintos (não nulos) de uma coluna categórica, em ordem alfabética."""
+        return sorted(v for v in self._valores[coluna] if isinstance(v, str))
+
+    # --- filtragem ---
+    def _codigos_de(self, coluna, valores):
+        mapa = self._valores[coluna]
+        return np.array([mapa[v] for v in valores if v in mapa], dtype=np.int32)
+
+    def select(self, usuario="Todos", ano="Todos", mes=0, categorias=None, ocorrencias=True):
+        """
+        Posições (ordem original do DataFrame) das linhas que passam pelos filtros,
+        com as mesmas convenções da sidebar: "Todos", 0 para todos os meses e
+        categorias contendo "Todas" (ou None) para todas. Com `ocorrencias=False`,
+        só as despesas gravadas.
+        """
+        todas_categorias = categorias is None or "Todas" in categorias
+        chave = (usuario, ano, int(mes), None if todas_categorias else tuple(sorted(categorias)), ocorrencias)
+        with self._memo_lock:
+            if chave in self._memo:
+                self._memo.move_to_end(chave)
+                return self._memo[chave]
+
+        if ano != "Todos":
+            # Intervalo contínuo de chaves AAAAMM: busca binária na ordem por data
+            inicio = int(ano) * 100 + (int(mes) if mes else 1)
+            fim = int(ano) * 100 + (int(mes) if mes else 12)
+            i = np.searchsorted(self._anomes_ordenado, inicio, side="left")
+            j = np.searchsorted(self._anomes_ordenado, fim, side="right")
+            posicoes = self._ordem[i:j]
+        elif mes:
+            # Mesmo mês em todos os anos não é contínuo; compara só a parte do mês
+            posicoes = self._ordem[self._anomes_ordenado % 100 == int(mes)]
+        else:
+            posicoes = self._ordem
+
+        if usuario != "Todos":
+            posicoes = posicoes[np.isin(self._codigos["Usuario"][posicoes], self._codigos_de("Usuario", [usuario]))]
+        if not todas_categorias:
+            posicoes = posicoes[np.isin(self._codigos["Categoria"][posicoes], self._codigos_de("Categoria", categorias))]
+        if not ocorrencias:
+            posicoes = posicoes[posicoes < self.gravadas]
+
+        posicoes = np.sort(posicoes)
+        posicoes.setflags(write=False)
+
+        with self._memo_lock:
+            self._memo[chave] = posicoes
+            if len(self._memo) > MAX_FILTROS_MEMORIZADOS:
+                self._memo.popitem(last=False)
+        return posicoes
@@ -0,0 +1,39 @@
+# ======================== IMPORTS ========================
+import threading
+
+from storage import SEQUENCIA_DESPESAS
+
+# ======================== CONSTANTES ========================
+IDS_POR_BLOCO = 1000  # ids reservados no backend de uma vez, por processo
+
+
+# ======================== ALOCADOR ========================
+class IdAllocator:
+    """
+    Distribui id_original únicos para as despesas novas, sem ler o histórico (ou id_regra
+    para as regras de recorrência, com `sequencia=SEQUENCIA_REGRAS`).
+
+    O backend guarda um contador persistente (ver ExpenseStorage.reserve_ids) e entrega
+    blocos de ids que nenhum outro processo vai receber. O alocador, compartilhado pelas
+    sessões do processo, reserva um bloco e o consome localmente: cada despesa, série de
+    parcelas ou extrato importado recebe ids consecutivos em O(1), e só quando o bloco
+    acaba há uma nova chamada ao backend. Ids reservados e não usados são descartados,
+    então a sequência pode ter buracos.
+    """
+
+    def __init__(self, storage, ids_por_bloco=IDS_POR_BLOCO, sequencia=SEQUENCIA_DESPESAS):
+        self.storage = storage
+        self.ids_por_bloco = ids_por_bloco
+        self.sequencia = sequencia
+        self._lock = threading.Lock()
+        self._livres = range(0)
+
+    def allocate(self, quantidade=1):
+        """Devolve o primeiro de `quantidade` ids consecutivos, reservados só para quem chamou."""
+        with self._lock:
+            if len(self._livres) < quantidade:
+                # O resto do bloco atual é descartado para que os ids saiam consecutivos
+                self._livres = self.storage.reserve_ids(max(quantidade, self.ids_por_bloco), self.sequencia)
+            inicio = self._livres[0]
+            self._livres = self._livres[quantidade:]
+            return inicio
@@ -0,0 +1,300 @@
+# ======================== IMPORTS ========================
+import codecs
+import csv
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from codec import normalizar_texto, parse_centavos, parse_datas, texto_sem_nulos
+from storage import COLUNAS_DESPESA, empty_expenses_frame
+
+# ======================== CONSTANTES ========================
+TAMANHO_BLOCO = 2000         # linhas (CSV) ou lançamentos (OFX) por bloco lido
+TAMANHO_AMOSTRA = 64 * 1024  # bytes lidos para detectar codificação e separador
+CATEGORIA_PADRAO = "Outros"
+
+# Nomes aceitos (já normalizados: minúsculas, sem acentos) para cada campo do CSV
+COLUNAS_CSV = {
+    "Data": ["data", "date", "data lancamento", "data da compra", "data de lancamento", "dt"],
+    "Valor": ["valor", "amount", "valor (r$)", "valor r$", "value", "quantia"],
+    "Descricao": ["descricao", "title", "historico", "lancamento", "estabelecimento", "description", "memo"],
+}
+
+# Palavras da descrição que indicam Categoria/Tag quando o histórico não tem a mesma descrição
+PALAVRAS_CHAVE = {
+    "uber": ("Transporte", "Uber/99"),
+    "99app": ("Transporte", "Uber/99"),
+    "99 pop": ("Transporte", "Uber/99"),
+    "posto": ("Transporte", "Combustível"),
+    "shell": ("Transporte", "Combustível"),
+    "ipiranga": ("Transporte", "Combustível"),
+    "estacionamento": ("Transporte", "Estacionamento"),
+    "ifood": ("Alimentação", "iFood/Delivery"),
+    "rappi": ("Alimentação", "iFood/Delivery"),
+    "restaurante": ("Alimentação", "Restaurante"),
+    "padaria": ("Alimentação", "Padaria"),
+    "supermercado": ("Mercado", "Supermercado"),
+    "mercado": ("Mercado", "Supermercado"),
+    "hortifruti": ("Mercado", "Hortifruti"),
+    "acougue": ("Mercado", "Açougue"),
+    "farmacia": ("Saúde", "Farmácia"),
+    "drogaria": ("Saúde", "Farmácia"),
+    "droga raia": ("Saúde", "Farmácia"),
+    "academia": ("Saúde", "Academia"),
+    "smartfit": ("Saúde", "Academia"),
+    "cinema": ("Lazer", "Cinema"),
+    "netflix": ("Outros", "Assinaturas"),
+    "spotify": ("Outros", "Assinaturas"),
+    "amazon prime": ("Outros", "Assinaturas"),
+    "petshop": ("Zara", "Petshop"),
+    "petz": ("Zara", "Petshop"),
+    "cobasi": ("Zara", "Petshop"),
+    "condominio": ("Casa", "Condomínio"),
+    "aluguel": ("Casa", "Aluguel"),
+    "enel": ("Casa", "Luz"),
+    "sabesp": ("Casa", "Água"),
+    "internet": ("Casa", "Internet"),
+    "tarifa": ("Outros", "Taxas"),
+    "anuidade": ("Outros", "Taxas"),
+    "iof": ("Outros", "Taxas"),
+}
+
+_CAMPOS_OFX = {"Data": "DTPOSTED", "Valor": "TRNAMT", "Nome": "NAME", "Memo": "MEMO"}
+_BLOCO_OFX = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+
+
+# ======================== AUXILIARES ========================
+def _abrir_texto(arquivo):
+    """
+    Envolve o arquivo binário num leitor de texto, detectando a codificação pela amostra
+    inicial (UTF-8, senão Latin-1, comum nos extratos dos bancos). Devolve (texto, amostra).
+    """
+    amostra = arquivo.read(TAMANHO_AMOSTRA)
+    arquivo.seek(0)
+    try:
+        # Decodificador incremental: um caractere cortado no fim da amostra não é erro
+        decodificada = codecs.getincrementaldecoder("utf-8-sig")().decode(amostra, final=False)
+        codificacao = "utf-8-sig"
+    except UnicodeDecodeError:
+        decodificada = amostra.decode("latin-1")
+        codificacao = "latin-1"
+    return io.TextIOWrapper(arquivo, encoding=codificacao, newline=""), decodificada
+
+
+def _colunas_csv(nomes):
+    """Coluna do CSV usada para cada campo de COLUNAS_CSV, pelos nomes do cabeçalho."""
+    normalizadas = dict(zip(normalizar_texto(pd.Index(nomes)), nomes))
+    colunas = {campo: next((normalizadas[n] for n in aceitos if n in normalizadas), None) for campo, aceitos in COLUNAS_CSV.items()}
+    faltando = [campo for campo, coluna in colunas.items() if coluna is None]
+    if faltando:
+        raise ValueError(f"Colunas não encontradas no CSV: {', '.join(faltando)} (cabeçalho: {', '.join(nomes)}).")
+    return colunas
+
+
+def _centavos_pt_ou_ponto(textos, decimal_virgula):
+    """
+    Centavos de textos com vírgula decimal ("1.234,56") ou ponto decimal ("1234.56"). Valores
+    com vírgula são sempre lidos no formato brasileiro; os sem vírgula ("100", "1.234") também,
+    se o extrato usa vírgula (`decimal_virgula`), e senão com ponto decimal.
+    """
+    pt = np.full(len(textos), bool(decimal_virgula)) | textos.str.contains(",", regex=False).to_numpy()
+    centavos = np.zeros(len(textos), dtype=np.int64)
+    if pt.any():
+        centavos[pt] = parse_centavos(textos[pt])
+    if not pt.all():
+        limpo = textos[~pt].str.replace("R$", "", regex=False).str.replace(" ", "", regex=False)
+        reais = pd.to_numeric(limpo, errors="coerce").to_numpy(dtype=float)
+        centavos[~pt] = np.nan_to_num(np.rint(reais * 100), nan=0.0).astype(np.int64)
+    return centavos
+
+
+# ======================== LEITURA ========================
+def ler_csv(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Lê um extrato CSV em blocos de `tamanho_bloco` linhas e gera DataFrames com Data,
+    Centavos (com sinal, como no extrato) e Descricao. O separador (";", ",", tab ou "|")
+    e a codificação são detectados; as colunas são localizadas pelos nomes em COLUNAS_CSV.
+    O formato dos valores é decidido uma vez, antes de ler qualquer bloco, pela amostra
+    inicial do arquivo (a mesma da codificação): se algum valor dela tem vírgula, os valores
+    sem vírgula ("1.234") também são lidos no formato brasileiro; senão, com ponto decimal.
+    Assim o mesmo extrato é lido do mesmo jeito qualquer que seja `tamanho_bloco`.
+    """
+    texto, amostra = _abrir_texto(arquivo)
+    try:
+        cabecalho = amostra.split("\n", 1)[0]
+        try:
+            separador = csv.Sniffer().sniff(cabecalho, delimiters=";,\t|").delimiter
+        except csv.Error:
+            separador = ";" if ";" in cabecalho else ","
+        # Só as linhas completas da amostra: a última pode ter sido cortada no meio
+        completas = amostra[: amostra.rfind("\n") + 1] if len(amostra) >= TAMANHO_AMOSTRA else amostra
+        inicio = pd.read_csv(io.StringIO(completas), sep=separador, dtype=str, keep_default_na=False)
+        colunas = _colunas_csv(list(inicio.columns))
+        decimal_virgula = bool(inicio[colunas["Valor"]].str.contains(",", regex=False).any())
+
+        leitor = pd.read_csv(texto, sep=separador, dtype=str, keep_default_na=False, chunksize=tamanho_bloco)
+        for bloco in leitor:
+            valores = bloco[colunas["Valor"]].str.strip()
+            yield pd.DataFrame({
+                "Data": parse_datas(bloco[colunas["Data"]].str.strip()),
+                "Centavos": _centavos_pt_ou_ponto(valores, decimal_virgula),
+                "Descricao": bloco[colunas["Descricao"]].str.strip(),
+            })
+    finally:
+        texto.detach()  # o arquivo original continua aberto para quem o passou
+
+
+def ler_ofx(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Lê um extrato OFX (SGML ou XML) em blocos de até `tamanho_bloco` lançamentos
+    (<STMTTRN>) e gera DataFrames no mesmo formato de `ler_csv`. A descrição é o MEMO
+    ou, na falta dele, o NAME.
+    """
+    texto, _ = _abrir_texto(arquivo)
+    try:
+        pendente = ""
+        blocos = []
+        while True:
+            trecho = texto.read(TAMANHO_AMOSTRA)
+            pendente += trecho
+            # Só os lançamentos completos; o resto espera o próximo trecho
+            fim = 0
+            for achado in _BLOCO_OFX.finditer(pendente):
+                blocos.append(achado.group(1))
+                fim = achado.end()
+            pendente = pendente[fim:]
+            while len(blocos) >= tamanho_bloco or (not trecho and blocos):
+                yield _frame_ofx(blocos[:tamanho_bloco])
+                blocos = blocos[tamanho_bloco:]
+            if not trecho:
+                return
+    finally:
+        texto.detach()
+
+
+def _frame_ofx(blocos):
+    blocos = pd.Series(blocos, dtype=object)
+    campos = {
+        nome: blocos.str.extract(rf"<{tag}>\s*([^<\r\n]*)", flags=re.IGNORECASE, expand=False).fillna("").str.strip()
+        for nome, tag in _CAMPOS_OFX.items()
+    }
+    valores = campos["Valor"].str.replace(",", ".", regex=False)
+    return pd.DataFrame({
+        "Data": pd.to_datetime(campos["Data"].str[:8], format="%Y%m%d", errors="coerce"),
+        "Centavos": _centavos_pt_ou_ponto(valores, decimal_virgula=False),
+        "Descricao": campos["Memo"].where(campos["Memo"] != "", campos["Nome"]),
+    })
+
+
+def ler_extrato(arquivo, nome, tamanho_bloco=TAMANHO_BLOCO):
+    """Lê o extrato inteiro (CSV ou OFX, pela extensão de `nome`), bloco a bloco, num único DataFrame."""
+    leitor = ler_ofx if nome.lower().endswith(".ofx") else ler_csv
+    blocos = [bloco for bloco in leitor(arquivo, tamanho_bloco) if not bloco.empty]
+    if not blocos:
+        return pd.DataFrame({"Data": pd.Series(dtype="datetime64[ns]"), "Centavos": pd.Series(dtype=np.int64), "Descricao": pd.Series(dtype=object)})
+    return pd.concat(blocos, ignore_index=True)
+
+
+# ======================== DEDUPLICAÇÃO ========================
+def chaves_deduplicacao(datas, centavos, descricoes):
+    """
+    Hash (uint64) de (dia, centavos, descrição normalizada, ocorrência) de cada linha.
+    A ocorrência numera as repetições da mesma tripla, então dois lançamentos idênticos
+    no extrato só são descartados se também houver dois iguais já gravados.
+    """
+    base = pd.DataFrame({
+        "dia": pd.to_datetime(pd.Series(datas, copy=False), errors="coerce").dt.normalize().to_numpy(),
+        "centavos": np.asarray(centavos, dtype=np.int64),
+        "descricao": normalizar_texto(descricoes).to_numpy(),
+    })
+    base["ocorrencia"] = base.groupby(["dia", "centavos", "descricao"], dropna=False, sort=False).cumcount()
+    return pd.util.hash_pandas_object(base, index=False).to_numpy()
+
+
+# ======================== CATEGORIZAÇÃO ========================
+def categorizar(descricoes, historico, palavras=PALAVRAS_CHAVE):
+    """
+    Categoria e Tag de cada descrição: a combinação mais usada no `historico` para a mesma
+    descrição (normalizada) e, sem histórico, a primeira palavra-chave encontrada; o resto
+    fica em CATEGORIA_PADRAO, sem tag.
+    """
+    normalizadas = normalizar_texto(descricoes).reset_index(drop=True)
+    categorias = pd.Series(CATEGORIA_PADRAO, index=normalizadas.index, dtype=object)
+    tags = pd.Series("", index=normalizadas.index, dtype=object)
+    resolvidas = np.zeros(len(normalizadas), dtype=bool)
+
+    if historico is not None and not historico.empty:
+        anteriores = pd.DataFrame({
+            "descricao": normalizar_texto(historico["Descricao"]).to_numpy(),
+            # No store os nulos já viram "" (ver schema.py): despesa sem categoria conta como a padrão
+            "Categoria": texto_sem_nulos(historico["Categoria"]).replace("", CATEGORIA_PADRAO).to_numpy(),
+            "Tag": texto_sem_nulos(historico["Tag"]).to_numpy(),
+        })
+        contagens = anteriores[anteriores["descricao"] != ""].value_counts(sort=True)
+        # value_counts ordena da mais frequente para a menos: a primeira de cada descrição vence
+        preferidas = contagens.reset_index().drop_duplicates("descricao").set_index("descricao")
+        posicoes = preferidas.index.get_indexer(normalizadas)
+        resolvidas = posicoes >= 0
+        categorias[resolvidas] = preferidas["Categoria"].to_numpy()[posicoes[resolvidas]]
+        tags[resolvidas] = preferidas["Tag"].to_numpy()[posicoes[resolvidas]]
+
+    for palavra, (categoria, tag) in palavras.items():
+        if resolvidas.all():
+            break
+        achou = ~resolvidas & normalizadas.str.contains(palavra, regex=False).to_numpy()
+        categorias[achou] = categoria
+        tags[achou] = tag
+        resolvidas |= achou
+    return categorias, tags
+
+
+# ======================== IMPORTAÇÃO ========================
+def preparar_importacao(extrato, existentes, pagamento, usuario, proximo_id, despesas_negativas=None):
+    """
+    Converte o extrato lido em despesas novas (colunas COLUNAS_DESPESA) e devolve
+    (novas, resumo).
+
+    Só os lançamentos do sinal das despesas entram, com o valor em módulo: com
+    `despesas_negativas=None` o sinal é o da maioria dos lançamentos (extratos de conta
+    trazem débitos negativos; faturas de cartão, compras positivas). Linhas sem data ou
+    com valor zero são ignoradas, e as que já existem em `existentes` (mesmo dia, valor e
+    descrição) são descartadas. As novas recebem ids a partir de `proximo_id`.
+    """
+    centavos = extrato["Centavos"].to_numpy(dtype=np.int64)
+    if despesas_negativas is None:
+        despesas_negativas = (centavos < 0).sum() > (centavos > 0).sum()
+    do_sinal = centavos < 0 if despesas_negativas else centavos > 0
+    validas = do_sinal & extrato["Data"].notna().to_numpy()
+    candidatas = extrato[validas].reset_index(drop=True)
+    candidatas["Centavos"] = np.abs(candidatas["Centavos"].to_numpy())
+
+    novas_chaves = chaves_deduplicacao(candidatas["Data"], candidatas["Centavos"], candidatas["Descricao"])
+    if existentes is not None and not existentes.empty:
+        chaves_gravadas = chaves_deduplicacao(existentes["Data"], parse_centavos(existentes["Valor"]), existentes["Descricao"])
+        # Index.isin usa uma tabela hash sobre as chaves já gravadas
+        duplicadas = pd.Index(novas_chaves).isin(chaves_gravadas)
+    else:
+        duplicadas = np.zeros(len(candidatas), dtype=bool)
+    candidatas = candidatas[~duplicadas].reset_index(drop=True)
+
+    categorias, tags = categorizar(candidatas["Descricao"], existentes)
+    novas = pd.DataFrame({
+        "Data": candidatas["Data"].dt.normalize(),
+        "Categoria": categorias.to_numpy(),
+        "Tag": tags.to_numpy(),
+        "Valor": candidatas["Centavos"].to_numpy() / 100,
+        "Descricao": candidatas["Descricao"].to_numpy(),
+        "Pagamento": pagamento,
+        "Usuario": usuario,
+        "id_original": np.arange(proximo_id, proximo_id + len(candidatas), dtype=int),
+    })[COLUNAS_DESPESA] if len(candidatas) else empty_expenses_frame()
+
+    resumo = {
+        "lidas": len(extrato),
+        "novas": len(novas),
+        "duplicadas": int(np.count_nonzero(duplicadas)),
+        "ignoradas": int(len(extrato) - np.count_nonzero(validas)),
+    }
+    return novas, resumo
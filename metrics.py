@@ -0,0 +1,260 @@
+# ======================== IMPORTS ========================
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import gspread
+
+# ======================== CONSTANTES ========================
+# Limites superiores (segundos) dos baldes dos histogramas de latência
+BALDES_LATENCIA = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+ARQUIVO_JSON = "metricas.json"
+ARQUIVO_PROMETHEUS = "metricas.prom"
+
+
+# ======================== HISTOGRAMA ========================
+class _Serie:
+    """Contagem, soma e histograma cumulativo de durações (e bytes, para chamadas à API)."""
+
+    def __init__(self):
+        self.contagem = 0
+        self.erros = 0
+        self.soma = 0.0
+        self.maximo = 0.0
+        self.bytes = 0
+        self.baldes = [0] * (len(BALDES_LATENCIA) + 1)  # o último é +Inf
+
+    def observar(self, segundos, erro=False):
+        self.contagem += 1
+        self.erros += int(erro)
+        self.soma += segundos
+        self.maximo = max(self.maximo, segundos)
+        for i, limite in enumerate(BALDES_LATENCIA):
+            if segundos <= limite:
+                self.baldes[i] += 1
+                return
+        self.baldes[-1] += 1
+
+    def quantil(self, q):
+        """Estimativa pelo limite do balde (como o histogram_quantile do Prometheus, sem interpolar)."""
+        if not self.contagem:
+            return 0.0
+        alvo = q * self.contagem
+        acumulado = 0
+        for limite, quantidade in zip(BALDES_LATENCIA + [self.maximo], self.baldes):
+            acumulado += quantidade
+            if acumulado >= alvo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+    def resumo(self):
+        return {
+            "contagem": self.contagem,
+            "erros": self.erros,
+            "soma_s": round(self.soma, 6),
+            "media_ms": round(self.soma / self.contagem * 1000, 3) if self.contagem else 0.0,
+            "p95_ms": round(self.quantil(0.95) * 1000, 3),
+            "max_ms": round(self.maximo * 1000, 3),
+            "bytes": self.bytes,
+            "baldes": dict(zip([str(b) for b in BALDES_LATENCIA] + ["+Inf"], self.baldes)),
+        }
+
+
+# ======================== REGISTRO ========================
+class MetricsRegistry:
+    """
+    Métricas do processo: duração dos blocos de cada rerun (spans) e chamadas ao Google
+    Sheets (contagem, erros, latência e bytes transferidos por método).
+
+    É compartilhado por todas as sessões; os spans do rerun em andamento ficam numa
+    lista por thread, já que o Streamlit executa cada rerun numa thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._api = {}
+        self._local = threading.local()
+        self.iniciado_em = datetime.now()
+        self._ultima_exportacao = 0.0
+
+    # --- spans ---
+    def iniciar_rerun(self):
+        """Começa uma nova lista de spans para o rerun da thread atual."""
+        self._local.rerun = []
+
+    def spans_do_rerun(self):
+        """[(nome, ms)] dos spans concluídos no rerun atual, na ordem em que terminaram."""
+        return list(getattr(self._local, "rerun", []))
+
+    @contextmanager
+    def span(self, nome):
+        """Mede a duração do bloco; o tempo é registrado mesmo se o bloco sair com exceção (st.rerun/st.stop)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            with self._lock:
+                self._spans.setdefault(nome, _Serie()).observar(segundos)
+            getattr(self._local, "rerun", []).append((nome, round(segundos * 1000, 2)))
+
+    # --- chamadas à API ---
+    @contextmanager
+    def chamada_api(self, metodo):
+        """Mede uma chamada ao gspread; os bytes das requisições HTTP feitas dentro dela são somados a ela."""
+        pilha = self._local.__dict__.setdefault("api", [])
+        pilha.append(metodo)
+        inicio = time.perf_counter()
+        erro = False
+        try:
+            yield
+        except Exception:
+            erro = True
+            raise
+        finally:
+            pilha.pop()
+            segundos = time.perf_counter() - inicio
+            with self._lock:
+                self._api.setdefault(metodo, _Serie()).observar(segundos, erro)
+
+    def registrar_bytes(self, quantidade):
+        """Soma bytes à chamada em andamento na thread atual (ou a "outros", fora de uma chamada medida)."""
+        pilha = getattr(self._local, "api", None)
+        metodo = pilha[-1] if pilha else "outros"
+        with self._lock:
+            self._api.setdefault(metodo, _Serie()).bytes += quantidade
+
+    # --- leitura e exportação ---
+    def snapshot(self):
+        """Estado atual em estruturas simples (serializáveis em JSON)."""
+        with self._lock:
+            return {
+                "gerado_em": datetime.now().isoformat(timespec="seconds"),
+                "iniciado_em": self.iniciado_em.isoformat(timespec="seconds"),
+                "spans": {nome: serie.resumo() for nome, serie in sorted(self._spans.items())},
+                "api": {metodo: serie.resumo() for metodo, serie in sorted(self._api.items())},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """Formato de texto do Prometheus (útil com o textfile collector do node_exporter)."""
+        linhas = []
+        with self._lock:
+            familias = [
+                ("finapp_span_seconds", "Duração dos blocos de cada rerun do app.", "bloco", self._spans),
+                ("finapp_sheets_call_seconds", "Latência das chamadas ao Google Sheets.", "metodo", self._api),
+            ]
+            for nome, ajuda, rotulo, series in familias:
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} histogram"]
+                for chave, serie in sorted(series.items()):
+                    acumulado = 0
+                    for limite, quantidade in zip([str(b) for b in BALDES_LATENCIA] + ["+Inf"], serie.baldes):
+                        acumulado += quantidade
+                        linhas.append(f'{nome}_bucket{{{rotulo}="{_escapar(chave)}",le="{limite}"}} {acumulado}')
+                    linhas.append(f'{nome}_sum{{{rotulo}="{_escapar(chave)}"}} {serie.soma:.6f}')
+                    linhas.append(f'{nome}_count{{{rotulo}="{_escapar(chave)}"}} {serie.contagem}')
+
+            linhas += ["# HELP finapp_sheets_call_errors_total Chamadas ao Google Sheets que terminaram em erro.",
+                       "# TYPE finapp_sheets_call_errors_total counter"]
+            linhas += [f'finapp_sheets_call_errors_total{{metodo="{_escapar(m)}"}} {s.erros}' for m, s in sorted(self._api.items())]
+            linhas += ["# HELP finapp_sheets_bytes_total Bytes enviados e recebidos nas chamadas ao Google Sheets.",
+                       "# TYPE finapp_sheets_bytes_total counter"]
+            linhas += [f'finapp_sheets_bytes_total{{metodo="{_escapar(m)}"}} {s.bytes}' for m, s in sorted(self._api.items())]
+        return "\n".join(linhas) + "\n"
+
+    def exportar(self, diretorio):
+        """Grava metricas.json e metricas.prom no diretório (de forma atômica) e devolve os caminhos."""
+        os.makedirs(diretorio, exist_ok=True)
+        caminhos = []
+        for arquivo, conteudo in ((ARQUIVO_JSON, self.to_json()), (ARQUIVO_PROMETHEUS, self.to_prometheus())):
+            caminho = os.path.join(diretorio, arquivo)
+            tmp = caminho + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(conteudo)
+            os.replace(tmp, caminho)
+            caminhos.append(caminho)
+        return caminhos
+
+    def exportar_se_devido(self, diretorio, intervalo):
+        """Exporta no máximo uma vez a cada `intervalo` segundos (chamado ao fim de cada rerun)."""
+        with self._lock:
+            agora = time.monotonic()
+            if agora - self._ultima_exportacao < intervalo:
+                return
+            self._ultima_exportacao = agora
+        try:
+            self.exportar(diretorio)
+        except OSError:
+            pass  # métricas não podem derrubar a página
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._api.clear()
+            self.iniciado_em = datetime.now()
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# ======================== INSTRUMENTAÇÃO DO GSPREAD ========================
+class _Instrumentado:
+    """
+    Proxy de um objeto do gspread (Client, Spreadsheet ou Worksheet): cada método público
+    chamado passa por `chamada_api`, e Spreadsheets/Worksheets devolvidos também são embrulhados.
+    """
+
+    def __init__(self, alvo, registro):
+        object.__setattr__(self, "_alvo", alvo)
+        object.__setattr__(self, "_registro", registro)
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._alvo, nome)
+        if nome.startswith("_"):
+            return atributo
+        if not callable(atributo):
+            return _embrulhar(atributo, self._registro)
+
+        def chamada(*args, **kwargs):
+            with self._registro.chamada_api(nome):
+                resultado = atributo(*args, **kwargs)
+            return _embrulhar(resultado, self._registro)
+
+        return chamada
+
+    def __setattr__(self, nome, valor):
+        setattr(self._alvo, nome, valor)
+
+    def __repr__(self):
+        return f"<instrumentado {self._alvo!r}>"
+
+
+def _embrulhar(valor, registro):
+    if isinstance(valor, (gspread.Spreadsheet, gspread.Worksheet)):
+        return _Instrumentado(valor, registro)
+    if isinstance(valor, list) and valor and isinstance(valor[0], (gspread.Spreadsheet, gspread.Worksheet)):
+        return [_Instrumentado(v, registro) for v in valor]
+    return valor
+
+
+def instrumentar_cliente(client, registro):
+    """
+    Devolve o cliente do gspread embrulhado para registrar cada chamada em `registro`.
+    Os bytes vêm de um hook de resposta na sessão HTTP do cliente (corpo enviado + recebido).
+    """
+    sessao = getattr(client, "session", None)
+    if sessao is not None and hasattr(sessao, "hooks"):
+        def contar_bytes(resposta, *args, **kwargs):
+            corpo = (resposta.request.body if resposta.request is not None else None) or b""
+            if isinstance(corpo, str):
+                corpo = corpo.encode()
+            registro.registrar_bytes(len(corpo) + len(resposta.content or b""))
+        sessao.hooks.setdefault("response", []).append(contar_bytes)
+    return _Instrumentado(client, registro)
@@ -0,0 +1,100 @@
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+
+from storage import COLUNAS_DESPESA, ID_INVALIDO, SEM_TERMINO, empty_expenses_frame
+
+# ======================== CONSTANTES ========================
+HORIZONTE_MESES = 12     # regras sem término são expandidas ao menos até 12 meses depois do mês atual
+# id_original das ocorrências: elas não têm linha própria no backend. Difere de ID_INVALIDO,
+# dado às linhas da planilha sem id válido, para que umas não se confundam com as outras
+ID_OCORRENCIA = ID_INVALIDO - 1
+
+
+def data_horizonte(hoje=None):
+    """Último dia do mês HORIZONTE_MESES à frente de `hoje`: até onde as regras sem término são expandidas."""
+    mes = np.datetime64(hoje or "today", "M") + HORIZONTE_MESES
+    return pd.Timestamp((mes + 1).astype("datetime64[D]") - 1)
+
+
+# ======================== EXPANSÃO ========================
+def expandir(regras, inicio=None, fim=None, horizonte=None, com_id_regra=False):
+    """
+    Ocorrências das regras, no formato das despesas, com Data entre `inicio` e `fim`.
+
+    Uma regra gera `Ocorrencias` lançamentos (ou infinitos, com SEM_TERMINO) a cada
+    `Periodo` meses a partir de `Inicio`, sempre no mesmo dia do mês, limitado ao último
+    dia dos meses mais curtos (como `data + relativedelta(months=i)`). Regras com
+    término levam "(i/N)" na descrição. As regras sem término só vão até `horizonte`
+    (ou `fim`); uma das duas datas é obrigatória se houver alguma. Com `com_id_regra`, o
+    resultado tem também a coluna id_regra, da regra que gerou cada ocorrência.
+
+    Tudo é calculado em arrays: a janela é convertida em intervalos de índices de
+    ocorrência por regra e só as ocorrências dentro dela são montadas.
+    """
+    if regras.empty:
+        vazio = empty_expenses_frame()
+        return vazio.assign(id_regra=pd.Series(dtype=int)) if com_id_regra else vazio
+
+    primeira = pd.to_datetime(regras["Inicio"]).to_numpy().astype("datetime64[D]")
+    mes_inicial = primeira.astype("datetime64[M]")
+    dia = (primeira - mes_inicial.astype("datetime64[D]")).astype(np.int64)
+    periodo = np.maximum(regras["Periodo"].to_numpy(np.int64), 1)
+    total = regras["Ocorrencias"].to_numpy(np.int64)
+    sem_termino = total <= SEM_TERMINO
+
+    limite = fim if horizonte is None else (horizonte if fim is None else min(pd.Timestamp(fim), pd.Timestamp(horizonte)))
+    if sem_termino.any() and limite is None:
+        raise ValueError("Regras sem término precisam de `fim` ou `horizonte` para serem expandidas.")
+
+    # Intervalo [k_ini, k_fim] de índices de ocorrência de cada regra, pelos meses da janela;
+    # o dia exato é conferido no final
+    meses = mes_inicial.astype(np.int64)
+    k_ini = np.zeros(len(regras), dtype=np.int64)
+    if inicio is not None:
+        mes_ini = np.datetime64(pd.Timestamp(inicio), "M").astype(np.int64)
+        k_ini = np.maximum(0, (mes_ini - meses) // periodo)
+    k_fim = np.where(sem_termino, np.iinfo(np.int64).max, total - 1)
+    if fim is not None:
+        mes_fim = np.datetime64(pd.Timestamp(fim), "M").astype(np.int64)
+        k_fim = np.minimum(k_fim, (mes_fim - meses) // periodo)
+    if limite is not None:
+        mes_limite = np.datetime64(pd.Timestamp(limite), "M").astype(np.int64)
+        k_fim = np.where(sem_termino, np.minimum(k_fim, (mes_limite - meses) // periodo), k_fim)
+
+    quantidade = np.maximum(k_fim - k_ini + 1, 0)
+    linha = np.repeat(np.arange(len(regras)), quantidade)
+    k = np.arange(len(linha)) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade) + k_ini[linha]
+
+    mes = mes_inicial[linha] + k * periodo[linha]
+    dias_no_mes = ((mes + 1).astype("datetime64[D]") - mes.astype("datetime64[D]")).astype(np.int64)
+    datas = pd.to_datetime(mes.astype("datetime64[D]") + np.minimum(dia[linha], dias_no_mes - 1)).astype("datetime64[ns]")
+
+    descricao = regras["Descricao"].to_numpy(dtype=object)[linha]
+    com_termino = ~sem_termino[linha]
+    if com_termino.any():
+        descricao = pd.Series(descricao, dtype=object)
+        descricao[com_termino] = (
+            descricao[com_termino] + " (" + pd.Series(k + 1)[com_termino].astype(str)
+            + "/" + pd.Series(total[linha])[com_termino].astype(str) + ")"
+        )
+        descricao = descricao.to_numpy()
+
+    ocorrencias = pd.DataFrame({
+        "Data": datas,
+        "Categoria": regras["Categoria"].to_numpy(dtype=object)[linha],
+        "Tag": regras["Tag"].to_numpy(dtype=object)[linha],
+        "Valor": regras["Valor"].to_numpy(dtype=float)[linha],
+        "Descricao": descricao,
+        "Pagamento": regras["Pagamento"].to_numpy(dtype=object)[linha],
+        "Usuario": regras["Usuario"].to_numpy(dtype=object)[linha],
+        "id_original": np.full(len(linha), ID_OCORRENCIA, dtype=int),
+        "id_regra": regras["id_regra"].to_numpy(dtype=int)[linha],
+    })
+
+    dentro = np.ones(len(ocorrencias), dtype=bool)
+    if inicio is not None:
+        dentro &= (ocorrencias["Data"] >= pd.Timestamp(inicio)).to_numpy()
+    if fim is not None:
+        dentro &= (ocorrencias["Data"] <= pd.Timestamp(fim)).to_numpy()
+    return ocorrencias[dentro].reset_index(drop=True)[COLUNAS_DESPESA + (["id_regra"] if com_id_regra else [])]
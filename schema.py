@@ -0,0 +1,97 @@
+# ======================== IMPORTS ========================
+import numpy as np
+import pandas as pd
+
+from codec import parse_datas, texto_sem_nulos
+from storage import COLUNAS_DESPESA
+
+# ======================== CONSTANTES ========================
+# Poucos valores distintos repetidos em todas as linhas: viram códigos inteiros + categorias
+COLUNAS_CATEGORICAS = ["Categoria", "Tag", "Pagamento", "Usuario"]
+TIPO_TEXTO = pd.StringDtype("pyarrow")  # Descricao: quase todos distintos, guardados num buffer Arrow
+TIPO_ID = np.int32
+
+
+# ======================== ESQUEMA ========================
+def _categorica(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype) and not serie.hasnans:
+        return serie
+    # astype("category") ordena as categorias: ordenar pela coluna continua sendo ordem alfabética
+    return texto_sem_nulos(serie).astype("category")
+
+
+def aplicar_esquema(df):
+    """
+    Converte as colunas de despesa do DataFrame para os tipos compactos do store: Data em
+    datetime64, Valor em float64, id_original em int32, Categoria/Tag/Pagamento/Usuario
+    categóricas e Descricao em texto Arrow, sem nulos nas colunas de texto. Colunas que já
+    estão no tipo certo não são copiadas, então reaplicar o esquema custa quase nada.
+    """
+    colunas = {}
+    if "Data" in df.columns and not pd.api.types.is_datetime64_ns_dtype(df["Data"]):
+        colunas["Data"] = parse_datas(df["Data"]).astype("datetime64[ns]")
+    if "Valor" in df.columns and df["Valor"].dtype != np.float64:
+        colunas["Valor"] = pd.to_numeric(df["Valor"], errors="coerce").astype(np.float64)
+    if "id_original" in df.columns and df["id_original"].dtype != TIPO_ID:
+        ids = df["id_original"].astype(np.int64)
+        # Um id fora do int32 seria truncado em silêncio: nesse caso a coluna fica em int64
+        if ids.empty or ids.abs().max() <= np.iinfo(TIPO_ID).max:
+            colunas["id_original"] = ids.astype(TIPO_ID)
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns:
+            original = df[col]
+            serie = _categorica(original)
+            if serie is not original:
+                colunas[col] = serie
+    if "Descricao" in df.columns and (df["Descricao"].dtype != TIPO_TEXTO or df["Descricao"].hasnans):
+        colunas["Descricao"] = texto_sem_nulos(df["Descricao"]).astype(TIPO_TEXTO)
+    return df.assign(**colunas) if colunas else df
+
+
+def unificar_categorias(frames):
+    """
+    Os mesmos frames com o esquema aplicado e, em cada coluna categórica, a mesma lista
+    (ordenada) de categorias: assim pd.concat e atribuições entre eles mantêm as colunas
+    categóricas em vez de voltar para object.
+    """
+    frames = [aplicar_esquema(df) for df in frames]
+    for col in COLUNAS_CATEGORICAS:
+        presentes = [df for df in frames if col in df.columns]
+        categorias = pd.Index(sorted(set().union(*(df[col].cat.categories for df in presentes))))
+        frames = [
+            df.assign(**{col: df[col].cat.set_categories(categorias)})
+            if col in df.columns and not df[col].cat.categories.equals(categorias) else df
+            for df in frames
+        ]
+    return frames
+
+
+def concatenar(frames):
+    """pd.concat de frames de despesas mantendo os tipos compactos."""
+    return pd.concat(unificar_categorias(frames), ignore_index=True)
+
+
+# ======================== VALIDAÇÃO E MEMÓRIA ========================
+def validar(df, valores_conhecidos):
+    """
+    Problemas encontrados nas despesas, sem alterá-las: quantidade de linhas sem data
+    válida e, para cada coluna de `valores_conhecidos` (ex.: {"Categoria": [...]}), a
+    contagem dos valores fora da lista, do mais frequente para o menos.
+    """
+    desconhecidos = {}
+    for col, conhecidos in valores_conhecidos.items():
+        contagem = df[col].value_counts(sort=True)
+        contagem = contagem[(contagem > 0) & ~contagem.index.isin(conhecidos)]
+        if not contagem.empty:
+            desconhecidos[col] = {str(valor): int(n) for valor, n in contagem.items()}
+    return {"sem_data": int(df["Data"].isna().sum()), "desconhecidos": desconhecidos}
+
+
+def uso_de_memoria(df):
+    """Bytes ocupados por coluna (com o conteúdo dos textos) e o tipo de cada uma, da maior para a menor."""
+    colunas = [col for col in COLUNAS_DESPESA if col in df.columns]
+    return pd.DataFrame({
+        "Coluna": colunas,
+        "Tipo": [str(df[col].dtype) for col in colunas],
+        "Bytes": df[colunas].memory_usage(index=False, deep=True).to_numpy(),
+    }).sort_values("Bytes", ascending=False, ignore_index=True)
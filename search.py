@@ -0,0 +1,231 @@
+# ======================== IMPORTS ========================
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from codec import normalizar_texto, texto_sem_nulos
+
+# ======================== CONSTANTES ========================
+COLUNAS_BUSCA = ["Descricao", "Tag"]
+MAX_BUSCAS_MEMORIZADAS = 128
+MAX_ALTERACOES_PENDENTES = 1000  # despesas fora da base antes de remontar o índice
+TEXTOS_POR_BLOCO = 8192          # textos por bloco ao extrair os trigramas
+
+_SEPARADOR = ord(" ")
+_PALAVRA = re.compile(r"\w+")
+
+
+def _termos(consulta):
+    """
+    Palavras da consulta, normalizadas como em codec.normalizar_texto, sem repetição e em
+    ordem (a chave do memo). Feito direto na string: uma Series de 1 item custaria mais que a busca.
+    """
+    texto = unicodedata.normalize("NFKD", str(consulta)).encode("ascii", "ignore").decode("ascii").casefold()
+    return tuple(sorted(set(_PALAVRA.findall(texto))))
+
+
+def _chave(trigrama):
+    """Código inteiro de um trigrama ASCII (os 3 bytes num int)."""
+    a, b, c = trigrama.encode("ascii")
+    return (a << 16) | (b << 8) | c
+
+
+def _trigramas_por_texto(textos):
+    """
+    Pares (trigrama, código do texto) distintos, ordenados por trigrama e texto.
+    Os textos (ASCII) viram matrizes de bytes, em blocos de textos de tamanho parecido.
+    """
+    tamanhos = pd.Series(textos, dtype=object).str.len().to_numpy(dtype=np.int64)
+    ordem = np.argsort(tamanhos, kind="stable")
+    pares = []
+    for inicio in range(0, len(ordem), TEXTOS_POR_BLOCO):
+        codigos = ordem[inicio:inicio + TEXTOS_POR_BLOCO]
+        largura = int(tamanhos[codigos].max())
+        if largura < 3:
+            continue
+        matriz = np.array(textos[codigos].tolist(), dtype=f"S{largura}").view(np.uint8)
+        matriz = matriz.reshape(len(codigos), largura).astype(np.int64)
+        gramas = (matriz[:, :-2] << 16) | (matriz[:, 1:-1] << 8) | matriz[:, 2:]
+        validos = np.arange(largura - 2) < (tamanhos[codigos] - 2)[:, None]
+        pares.append((gramas[validos] << 32) | codigos[np.nonzero(validos)[0]])
+    if not pares:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pares = np.unique(np.concatenate(pares))
+    return pares >> 32, pares & 0xFFFFFFFF
+
+
+def _intersecao(a, b):
+    """Interseção de dois arrays ordenados sem repetição, em O(len(a) log len(b))."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return a
+    posicoes = np.searchsorted(b, a).clip(max=len(b) - 1)
+    return a[b[posicoes] == a]
+
+
+# ======================== ÍNDICE DE BUSCA ========================
+class SearchIndex:
+    """
+    Índice invertido de trigramas para a busca textual em Descricao e Tag.
+
+    Os textos são normalizados (minúsculas, sem acentos, ver codec.normalizar_texto),
+    reduzidos a palavras separadas por espaço e indexados uma vez por texto distinto:
+    cada trigrama aponta para os textos que o contêm (listas ordenadas num único array,
+    como um CSR) e cada texto para os id_original das despesas que o usam. Um termo com
+    3 ou mais caracteres casa com qualquer trecho de palavra (interseção das listas dos
+    seus trigramas, conferida no texto quando o termo é mais longo); termos mais curtos
+    casam com o início das palavras, pelos trigramas que começam com o espaço. Todos os
+    termos da consulta precisam casar.
+
+    Despesas novas, editadas e excluídas ficam fora da base montada (`add`/`update`/`remove`),
+    numa lista pequena conferida a cada busca, até a base ser remontada. A base nunca é
+    alterada no lugar, então `copy` só copia essa lista: o store atualiza uma cópia e a
+    publica junto com a versão, sem mexer no índice que outras sessões estão consultando.
+    Quem consulta cruza os ids com o seu frame.
+    """
+
+    def __init__(self, ids=(), textos=()):
+        self._lock = threading.Lock()  # o índice é compartilhado entre as sessões
+        self._memo = OrderedDict()
+        self._montar(np.asarray(ids, dtype=np.int64), np.asarray(textos, dtype=object))
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(df["id_original"].to_numpy(dtype=np.int64), cls._textos_de(df).to_numpy(dtype=object))
+
+    def __len__(self):
+        with self._lock:
+            fora = np.isin(self._ids_base, np.fromiter(self._fora_da_base, dtype=np.int64)).sum()
+            return len(self._ids_base) - int(fora) + len(self._pendentes)
+
+    @staticmethod
+    def _textos_de(df):
+        """
+        Forma indexada: " palavra palavra " (o espaço inicial marca o começo das palavras).
+        Só os textos distintos passam pela normalização, que é a parte cara.
+        """
+        partes = [texto_sem_nulos(df[col]) for col in COLUNAS_BUSCA]
+        codigos, unicos = pd.factorize(partes[0].str.cat(partes[1:], sep=" "))
+        texto = normalizar_texto(unicos).str.replace(r"\W+", " ", regex=True).str.strip()
+        return pd.Series((" " + texto + " ").to_numpy()[codigos], index=df.index, dtype=object)
+
+    def _montar(self, ids, textos):
+        codigos, unicos = pd.factorize(textos)
+        self._textos = np.asarray(unicos, dtype=object)
+        ordem = np.argsort(codigos, kind="stable")
+        self._ids_base = ids[ordem]
+        self._inicio_ids = np.searchsorted(codigos[ordem], np.arange(len(self._textos) + 1))
+        gramas, self._textos_dos_gramas = _trigramas_por_texto(self._textos)
+        self._gramas, inicio = np.unique(gramas, return_index=True)
+        self._inicio_gramas = np.append(inicio, len(gramas))
+        self._fora_da_base = set()  # ids da base excluídos ou reindexados depois da montagem
+        self._pendentes = {}        # id_original -> texto das despesas novas ou editadas
+        self._memo.clear()
+
+    def copy(self):
+        """Cópia independente para atualizar; compartilha os arrays da base montada."""
+        copia = SearchIndex.__new__(SearchIndex)
+        with self._lock:
+            copia.__dict__.update(self.__dict__)
+            copia._fora_da_base = set(self._fora_da_base)
+            copia._pendentes = dict(self._pendentes)
+        copia._lock = threading.Lock()
+        copia._memo = OrderedDict()
+        return copia
+
+    def _remontar(self):
+        fica = ~np.isin(self._ids_base, np.fromiter(self._fora_da_base, dtype=np.int64))
+        codigos = np.repeat(np.arange(len(self._textos)), np.diff(self._inicio_ids))
+        ids = np.concatenate([self._ids_base[fica], np.fromiter(self._pendentes, dtype=np.int64)])
+        textos = np.concatenate([self._textos[codigos[fica]], np.array(list(self._pendentes.values()), dtype=object)])
+        self._montar(ids, textos)
+
+    # --- atualização ---
+    def add(self, df):
+        """Indexa as despesas do DataFrame (uma despesa já indexada com o mesmo id é substituída)."""
+        if df.empty:
+            return
+        ids = df["id_original"].astype(int).tolist()
+        textos = self._textos_de(df).tolist()
+        with self._lock:
+            self._memo.clear()
+            self._fora_da_base.update(ids)
+            self._pendentes.update(zip(ids, textos))
+            if len(self._fora_da_base) > MAX_ALTERACOES_PENDENTES:
+                self._remontar()
+
+    def update(self, df):
+        """Reindexa as despesas editadas (linhas completas, já com os valores novos)."""
+        self.add(df)
+
+    def remove(self, ids):
+        """Retira do índice as despesas com esses id_original."""
+        with self._lock:
+            self._memo.clear()
+            for id_ in ids:
+                self._fora_da_base.add(int(id_))
+                self._pendentes.pop(int(id_), None)
+
+    # --- consulta ---
+    def _lista(self, inicio, fim):
+        """Textos (ordenados) com algum trigrama de código entre `inicio` e `fim`, inclusive."""
+        i = np.searchsorted(self._gramas, inicio, side="left")
+        j = np.searchsorted(self._gramas, fim, side="right")
+        lista = self._textos_dos_gramas[self._inicio_gramas[i]:self._inicio_gramas[j]]
+        return lista if j - i <= 1 else np.unique(lista)
+
+    def _listas_do_termo(self, termo):
+        if len(termo) >= 3:
+            return [self._lista(_chave(termo[k:k + 3]), _chave(termo[k:k + 3])) for k in range(len(termo) - 2)]
+        if len(termo) == 2:
+            return [self._lista(_chave(" " + termo), _chave(" " + termo))]
+        # Uma letra: todos os trigramas " x?", um intervalo contínuo de códigos
+        inicio = (_SEPARADOR << 16) | (ord(termo) << 8)
+        return [self._lista(inicio, inicio | 0xFF)]
+
+    def _ids_da_base(self, termos):
+        listas = sorted((lista for termo in termos for lista in self._listas_do_termo(termo)), key=len)
+        textos = listas[0]
+        for lista in listas[1:]:
+            if not len(textos):
+                break
+            textos = _intersecao(textos, lista)
+        # Os trigramas de um termo podem aparecer no texto fora de ordem: confere o termo inteiro
+        longos = [t for t in termos if len(t) > 3]
+        if longos and len(textos):
+            textos = textos[[all(t in self._textos[c] for t in longos) for c in textos]]
+
+        inicios = self._inicio_ids[textos]
+        tamanhos = self._inicio_ids[textos + 1] - inicios
+        deslocamentos = np.repeat(inicios - np.cumsum(tamanhos) + tamanhos, tamanhos)
+        return self._ids_base[deslocamentos + np.arange(tamanhos.sum())]
+
+    def search(self, consulta):
+        """
+        id_original (ordenados, somente leitura) das despesas cuja Descricao ou Tag contém
+        todos os termos da consulta, sem diferenciar acentos nem maiúsculas. Sem termos,
+        todas as despesas.
+        """
+        termos = _termos(consulta)
+        with self._lock:
+            if termos in self._memo:
+                self._memo.move_to_end(termos)
+                return self._memo[termos]
+
+            ids = self._ids_da_base(termos) if termos else self._ids_base
+            if self._fora_da_base:
+                ids = ids[~np.isin(ids, np.fromiter(self._fora_da_base, dtype=np.int64))]
+            procurados = [t if len(t) >= 3 else " " + t for t in termos]
+            pendentes = [id_ for id_, texto in self._pendentes.items() if all(t in texto for t in procurados)]
+
+            resultado = np.sort(np.concatenate([ids, np.array(pendentes, dtype=np.int64)]))
+            resultado.setflags(write=False)
+            self._memo[termos] = resultado
+            if len(self._memo) > MAX_BUSCAS_MEMORIZADAS:
+                self._memo.popitem(last=False)
+            return resultado
@@ -0,0 +1,177 @@
+# ======================== IMPORTS ========================
+import random
+import threading
+import time
+
+import gspread
+import requests
+from google.auth.exceptions import TransportError
+
+# ======================== CONSTANTES ========================
+MAX_TENTATIVAS = 5
+ESPERA_BASE = 1.0        # segundos; dobra a cada tentativa (com jitter)
+ESPERA_MAXIMA = 32.0
+MAX_CHAMADAS_SIMULTANEAS = 4  # por processo, somando todas as sessões
+STATUS_TEMPORARIOS = {429, 500, 502, 503, 504}
+STATUS_REABRIR = {401, 404}   # token expirado/revogado ou planilha/aba que mudou de lugar
+
+
+class SheetsUnavailableError(Exception):
+    """O Google Sheets não respondeu (limite de requisições, instabilidade ou rede), mesmo após novas tentativas."""
+
+
+def _status_http(erro):
+    if isinstance(erro, gspread.exceptions.APIError):
+        return getattr(erro.response, "status_code", None)
+    return None
+
+
+def erro_temporario(erro):
+    """
+    Se o erro pode passar sozinho (limite de requisições, instabilidade do Google ou rede),
+    valendo a pena tentar de novo mais tarde; os demais (requisição recusada, sem permissão)
+    se repetiriam a cada nova tentativa.
+    """
+    if isinstance(erro, (SheetsUnavailableError, requests.exceptions.ConnectionError, requests.exceptions.Timeout, TransportError)):
+        return True
+    return _status_http(erro) in STATUS_TEMPORARIOS
+
+
+def requisicao_recusada(erro):
+    """
+    Se o erro garante que o Google não aplicou a requisição: 429, ou SheetsUnavailableError
+    vindo de uma operação não idempotente (que `executar` só repete em 429). Depois de um
+    5xx ou de uma falha de rede a escrita pode ter sido aplicada mesmo assim.
+    """
+    return isinstance(erro, SheetsUnavailableError) or _status_http(erro) == 429
+
+
+# ======================== CONEXÃO ========================
+class SheetsConnection:
+    """
+    Conexão com uma planilha do Google Sheets, compartilhada por todas as sessões.
+
+    A planilha é aberta pela chave (abrir pelo título faz uma busca no Drive a cada vez);
+    sem chave configurada, é aberta pelo título uma única vez e a chave é guardada.
+    Spreadsheet, Worksheets e cabeçalhos ficam em cache até `invalidar`, chamado
+    automaticamente quando a API responde 401/404. Todas as chamadas reutilizam a sessão
+    HTTP do cliente.
+
+    `executar` aplica novas tentativas com espera exponencial (e jitter) em 429/5xx e falhas
+    de rede, limita as chamadas simultâneas e, depois de um 429, faz todas as sessões
+    esperarem juntas em vez de insistirem. Se ainda assim não houver resposta, levanta
+    SheetsUnavailableError para que o app mostre os dados que já tem.
+    """
+
+    def __init__(self, client, sheet_name, sheet_key=None):
+        self.client = client
+        self.sheet_name = sheet_name
+        self.sheet_key = sheet_key
+        self._lock = threading.Lock()
+        self._planilha = None
+        self._abas = {}
+        self._cabecalhos = {}
+        self._semaforo = threading.BoundedSemaphore(MAX_CHAMADAS_SIMULTANEAS)
+        self._pausa_ate = 0.0  # time.monotonic() até quando ninguém chama a API (após um 429)
+
+    # --- objetos em cache ---
+    def spreadsheet(self):
+        with self._lock:
+            if self._planilha is None:
+                if self.sheet_key:
+                    self._planilha = self.client.open_by_key(self.sheet_key)
+                else:
+                    self._planilha = self.client.open(self.sheet_name)
+                    self.sheet_key = self._planilha.id
+            return self._planilha
+
+    def worksheet(self, titulo):
+        with self._lock:
+            aba = self._abas.get(titulo)
+        if aba is None:
+            aba = self.spreadsheet().worksheet(titulo)
+            with self._lock:
+                self._abas[titulo] = aba
+        return aba
+
+    def header(self, titulo):
+        """Primeira linha da aba (lida uma vez; vazia se a aba estiver vazia)."""
+        with self._lock:
+            cabecalho = self._cabecalhos.get(titulo)
+        if cabecalho is None:
+            cabecalho = self.worksheet(titulo).row_values(1)
+            if cabecalho:
+                with self._lock:
+                    self._cabecalhos[titulo] = cabecalho
+        return cabecalho
+
+    def forget_header(self, titulo):
+        """Descarta o cabeçalho em cache (depois de escritas que podem tê-lo alterado)."""
+        with self._lock:
+            self._cabecalhos.pop(titulo, None)
+
+    def invalidar(self):
+        with self._lock:
+            self._planilha = None
+            self._abas.clear()
+            self._cabecalhos.clear()
+
+    # --- novas tentativas ---
+    def _esperar_pausa(self):
+        while True:
+            with self._lock:
+                restante = self._pausa_ate - time.monotonic()
+            if restante <= 0:
+                return
+            time.sleep(restante)
+
+    def _pausar(self, segundos):
+        with self._lock:
+            self._pausa_ate = max(self._pausa_ate, time.monotonic() + segundos)
+
+    def executar(self, operacao, idempotente=True, max_tentativas=MAX_TENTATIVAS):
+        """
+        Executa `operacao()` (que pode fazer várias chamadas à API) com novas tentativas.
+
+        Operações não idempotentes (acrescentar linhas) só são repetidas em 429, quando
+        é garantido que o Google não aplicou a requisição.
+        """
+        reaberta = False
+        ultimo_erro = None
+        for tentativa in range(max_tentativas):
+            self._esperar_pausa()
+            with self._semaforo:
+                try:
+                    return operacao()
+                except gspread.exceptions.APIError as e:
+                    status = _status_http(e)
+                    if status in STATUS_REABRIR and not reaberta:
+                        # Recomeça do zero: reabre a planilha (e renova o token, se for o caso)
+                        self.invalidar()
+                        reaberta = True
+                        ultimo_erro = e
+                        continue
+                    if status not in STATUS_TEMPORARIOS or (not idempotente and status != 429):
+                        raise
+                    ultimo_erro = e
+                except (gspread.exceptions.WorksheetNotFound, gspread.exceptions.SpreadsheetNotFound):
+                    if reaberta:
+                        raise
+                    self.invalidar()
+                    reaberta = True
+                    continue
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, TransportError) as e:
+                    if not idempotente:
+                        raise
+                    ultimo_erro = e
+                    status = None
+
+            if tentativa + 1 < max_tentativas:
+                espera = min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa)
+                espera += random.uniform(0, espera)
+                if status == 429:
+                    self._pausar(espera)  # vale para todas as sessões
+                else:
+                    time.sleep(espera)
+
+        raise SheetsUnavailableError(f"Google Sheets indisponível no momento ({ultimo_erro}).") from ultimo_erro
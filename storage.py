@@ -0,0 +1,921 @@
+# ======================== IMPORTS ========================
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+import gspread
+import numpy as np
+import pandas as pd
+
+from codec import FORMATO_DATA_ISO, format_datas, format_planilha, parse_brl, parse_datas, texto_sem_nulos
+
+# ======================== CONSTANTES ========================
+COLUNAS_DESPESA = ["Data", "Categoria", "Tag", "Valor", "Descricao", "Pagamento", "Usuario", "id_original"]
+# Regras de despesas recorrentes (expandidas em ocorrências por recurrence.py)
+COLUNAS_REGRA = ["id_regra", "Inicio", "Periodo", "Ocorrencias", "Categoria", "Tag", "Valor", "Descricao", "Pagamento", "Usuario"]
+SEM_TERMINO = 0  # valor de Ocorrencias para regras sem data de término
+ID_INVALIDO = -1  # id_original das linhas da planilha cujo id está vazio ou não é um número
+# As despesas são particionadas por ano da Data; as sem data válida ficam numa partição à parte
+PARTICAO_SEM_DATA = 0
+LINHAS_POR_LEITURA = 5000    # linhas da aba de despesas por leitura (abaixo dos limites de resposta da API)
+MAX_LEITURAS_PARALELAS = 4   # leituras simultâneas de um load (a SheetsConnection limita o processo)
+IDS_POR_LINHA = 1000  # ids reservados por linha acrescentada na aba de ids do Sheets
+# Sequências de ids com contador próprio no backend (ver ExpenseStorage.reserve_ids)
+SEQUENCIA_DESPESAS = "id_original"
+SEQUENCIA_REGRAS = "id_regra"
+
+
+def empty_expenses_frame():
+    """DataFrame vazio com as colunas e tipos esperados pelo app."""
+    df = pd.DataFrame(columns=COLUNAS_DESPESA)
+    df["Data"] = pd.to_datetime(df["Data"])
+    df["Valor"] = df["Valor"].astype(float)
+    df["id_original"] = df["id_original"].astype(int)
+    return df
+
+
+def empty_rules_frame():
+    """DataFrame vazio com as colunas e tipos das regras de recorrência."""
+    df = pd.DataFrame(columns=COLUNAS_REGRA)
+    df["Inicio"] = pd.to_datetime(df["Inicio"])
+    df["Valor"] = df["Valor"].astype(float)
+    for col in ["id_regra", "Periodo", "Ocorrencias"]:
+        df[col] = df[col].astype(int)
+    return df
+
+
+def particao_por_ano(datas):
+    """Partição de cada data: o ano, ou PARTICAO_SEM_DATA para datas inválidas."""
+    anos = pd.to_datetime(pd.Series(datas, copy=False), errors="coerce").dt.year
+    return anos.fillna(PARTICAO_SEM_DATA).astype(int)
+
+
+def _catalogo(datas, ids):
+    """Resumo devolvido por `catalog`: partições existentes (em ordem) e o maior id_original."""
+    ids = pd.to_numeric(pd.Series(ids, dtype=object), errors="coerce").dropna()
+    return {
+        "particoes": sorted(int(p) for p in particao_por_ano(datas).unique()),
+        "maior_id": int(ids.max()) if not ids.empty else -1,
+    }
+
+
+# ======================== CONCORRÊNCIA ========================
+def _comparaveis(df, colunas):
+    """Células em texto canônico (datas ISO, valores com 2 casas), indexadas por id_original."""
+    texto = pd.DataFrame(index=pd.Index(df["id_original"].astype(int), name="id_original"))
+    for col in colunas:
+        if col == "Data":
+            texto[col] = format_datas(df[col], FORMATO_DATA_ISO).to_numpy()
+        elif col == "Valor":
+            valores = pd.to_numeric(df[col], errors="coerce").round(2)
+            texto[col] = valores.map("{:.2f}".format).where(valores.notna(), "").to_numpy()
+        else:
+            texto[col] = texto_sem_nulos(df[col]).to_numpy()
+    return texto
+
+
+def mesclar_alteracoes(atuais, originais, editadas):
+    """
+    Merge de três vias das linhas editadas, por id_original e coluna.
+
+    `originais` são as linhas como a sessão as leu, `editadas` as mesmas linhas com as
+    alterações dela e `atuais` o que o backend tem agora (talvez já alterado por outra
+    pessoa). Cada célula alterada pela sessão é aplicada se o backend ainda tem o valor
+    original (ou já tem o novo); se outra pessoa a alterou para outro valor, a alteração
+    dela fica e a despesa entra nos conflitos, assim como as despesas que não existem mais.
+
+    Devolve (linhas a gravar, completas e tipadas, só as que mudam; ids em conflito).
+    """
+    colunas = [col for col in COLUNAS_DESPESA if col != "id_original" and col in editadas.columns and col in originais.columns]
+    atuais = atuais.drop_duplicates("id_original").set_index("id_original", drop=False)
+    editadas = editadas.drop_duplicates("id_original", keep="last")
+    ids = editadas["id_original"].astype(int)
+    presentes = ids[ids.isin(atuais.index)]
+    conflitos = ids[~ids.isin(atuais.index)].tolist()
+
+    base = _comparaveis(originais.drop_duplicates("id_original"), colunas).reindex(presentes)
+    nossa = _comparaveis(editadas, colunas).loc[presentes]
+    deles = _comparaveis(atuais.loc[presentes].reset_index(drop=True), colunas)
+    # Linhas sem valor original conhecido: as células editadas valem como alteração da sessão
+    alteradas_por_nos = (nossa != base).to_numpy()
+    alteradas_por_outros = ((deles != base) & (deles != nossa)).to_numpy() & base.notna().to_numpy()
+    aplicar = alteradas_por_nos & ~alteradas_por_outros
+
+    conflitos += presentes[(alteradas_por_nos & alteradas_por_outros).any(axis=1)].tolist()
+    linhas = aplicar.any(axis=1)
+    mescladas = atuais.loc[presentes[linhas]].reset_index(drop=True)
+    valores = editadas.set_index("id_original").loc[presentes[linhas]]
+    for j, col in enumerate(colunas):
+        usar = aplicar[linhas, j]
+        if usar.any():
+            coluna = mescladas[col].copy()
+            coluna[usar] = valores[col].to_numpy()[usar]
+            mescladas[col] = coluna
+    return mescladas, sorted(conflitos)
+
+
+def resultado_da_escrita(conflitos=(), revisao_anterior=None, revisao=None):
+    """
+    O que as escritas devolvem: os id_original em conflito (só update) e as revisões do
+    backend logo antes e logo depois da escrita. As revisões só são informadas quando o
+    backend garante que entre as duas não houve outra escrita (o SQLite as lê na mesma
+    transação); o Sheets só expõe o modifiedTime do Drive, então lá elas ficam None.
+    """
+    return {"conflitos": sorted(conflitos), "revisao_anterior": revisao_anterior, "revisao": revisao}
+
+
+# ======================== INTERFACE ========================
+class ExpenseStorage:
+    """
+    Interface comum dos backends de armazenamento das despesas.
+
+    Todos os métodos trabalham com o DataFrame "tipado" do app (Data como datetime,
+    Valor como float, id_original como int) e sinalizam falhas levantando exceções;
+    quem chama decide como mostrar o erro na interface. As escritas (append, update,
+    delete, replace_all e as das regras) devolvem resultado_da_escrita.
+    """
+
+    name = "base"
+
+    def load(self, particoes=None, ao_receber=None):
+        """
+        Lê as despesas. Com `particoes` (anos, e PARTICAO_SEM_DATA para as sem data),
+        só as dessas partições. Se `ao_receber` for informado, também recebe as despesas
+        em blocos à medida que chegam, das mais recentes para as mais antigas.
+        """
+        raise NotImplementedError
+
+    def catalog(self):
+        """
+        Partições existentes e maior id_original, sem ler as despesas inteiras:
+        {"particoes": [...], "maior_id": int} (maior_id é -1 se não houver despesas).
+        """
+        raise NotImplementedError
+
+    def load_with_catalog(self, particoes):
+        """
+        O catálogo e as despesas das `particoes` que existem nele: (catálogo, DataFrame).
+        Os backends que leem o catálogo das mesmas colunas que guiam o `load` fazem as duas
+        coisas com uma leitura só.
+        """
+        catalogo = self.catalog()
+        existentes = [p for p in particoes if p in catalogo["particoes"]]
+        return catalogo, self.load(existentes) if existentes else empty_expenses_frame()
+
+    def append(self, df):
+        """Acrescenta linhas novas."""
+        raise NotImplementedError
+
+    def update(self, df, originais=None):
+        """
+        Atualiza as linhas cujos id_original aparecem em `df`. Com `originais` (as mesmas
+        linhas como foram lidas), só as células alteradas são gravadas, mescladas com o que
+        o backend tem agora (ver mesclar_alteracoes); os id_original em conflito vão em
+        "conflitos" no resultado.
+        """
+        raise NotImplementedError
+
+    def delete(self, ids):
+        """Remove as linhas dos id_original informados."""
+        raise NotImplementedError
+
+    def replace_all(self, df, revisao=None):
+        """
+        Substitui todo o conteúdo pelo DataFrame informado (usado como fallback). Se a revisão
+        atual não for `revisao` (a que o DataFrame reflete), outra pessoa gravou depois: as
+        linhas são gravadas por id_original e as que só existem no backend são mantidas.
+        """
+        raise NotImplementedError
+
+    def load_rules(self):
+        """Lê as regras de despesas recorrentes (colunas COLUNAS_REGRA)."""
+        raise NotImplementedError
+
+    def append_rules(self, df):
+        """Acrescenta regras de recorrência novas."""
+        raise NotImplementedError
+
+    def delete_rules(self, ids):
+        """Remove as regras dos id_regra informados."""
+        raise NotImplementedError
+
+    def reserve_ids(self, quantidade, sequencia=SEQUENCIA_DESPESAS):
+        """
+        Reserva, num contador persistente, pelo menos `quantidade` ids consecutivos que nenhuma
+        outra reserva (de qualquer processo) vai devolver. Devolve o `range` reservado.
+        `sequencia` escolhe o contador: id_original das despesas ou id_regra das regras.
+        """
+        raise NotImplementedError
+
+    def existing_ids(self, ids, sequencia=SEQUENCIA_DESPESAS):
+        """
+        Quais dos `ids` (id_original das despesas ou id_regra das regras, conforme a
+        `sequencia`) já estão gravados. Usado para não acrescentar de novo linhas de uma
+        escrita que pode ter sido aplicada apesar do erro.
+        """
+        raise NotImplementedError
+
+    def revision(self):
+        """Identificador da versão atual dos dados, ou None se não for possível obtê-lo."""
+        return None
+
+
+# ======================== GOOGLE SHEETS ========================
+def _aba_ja_existe(erro):
+    """Se o APIError é a recusa de criar uma aba com um nome já usado na planilha."""
+    return getattr(erro.response, "status_code", None) == 400 and "already exists" in str(erro)
+
+
+def _formatar_para_planilha(df):
+    """Converte Data e Valor para o formato de texto usado na planilha."""
+    df = df.copy()
+    df["Data"] = format_datas(df["Data"], FORMATO_DATA_ISO)
+    df["Valor"] = format_planilha(df["Valor"])
+    return df
+
+
+def _formatar_regras_para_planilha(df):
+    """Converte Inicio e Valor das regras para o formato de texto usado na planilha."""
+    df = df.copy()
+    df["Inicio"] = format_datas(df["Inicio"], FORMATO_DATA_ISO)
+    df["Valor"] = format_planilha(df["Valor"])
+    return df
+
+
+def _intervalos(linhas):
+    """Agrupa números de linha em intervalos (inicio, fim) de linhas consecutivas, em ordem crescente."""
+    alvo = sorted(set(linhas))
+    if not alvo:
+        return []
+    intervalos = []
+    inicio = fim = alvo[0]
+    for linha in alvo[1:]:
+        if linha == fim + 1:
+            fim = linha
+        else:
+            intervalos.append((inicio, fim))
+            inicio = fim = linha
+    intervalos.append((inicio, fim))
+    return intervalos
+
+
+def _ultima_coluna(cabecalho):
+    """Letra da última coluna do cabeçalho (ex.: "H")."""
+    return gspread.utils.rowcol_to_a1(1, len(cabecalho)).rstrip("0123456789")
+
+
+def _frame_da_planilha(values):
+    """Monta o DataFrame tipado a partir das células (cabeçalho na primeira linha) lidas da planilha."""
+    if len(values) < 2:
+        return empty_expenses_frame()
+    largura = len(values[0])
+    # Leituras por intervalo omitem as células vazias do fim de cada linha
+    linhas = [linha + [""] * (largura - len(linha)) if len(linha) < largura else linha for linha in values[1:]]
+    df = pd.DataFrame(linhas, columns=values[0])
+    if "id_original" not in df.columns:
+        df["id_original"] = list(range(len(df)))
+    df["id_original"] = pd.to_numeric(df["id_original"], errors="coerce").fillna(ID_INVALIDO).astype(int)
+
+    if "Valor" in df.columns:
+        df["Valor"] = parse_brl(df["Valor"])
+
+    if "Data" in df.columns:
+        df["Data"] = parse_datas(df["Data"])
+    return df
+
+
+def _excluir_linhas(worksheet, linhas):
+    """Remove as linhas (números da planilha) numa única requisição."""
+    # Remove os intervalos de linhas consecutivas de baixo para cima,
+    # para que a exclusão de um intervalo não desloque os próximos.
+    intervalos = _intervalos(linhas)[::-1]
+    if not intervalos:
+        return
+
+    requisicoes = [
+        {"deleteDimension": {"range": {
+            "sheetId": worksheet.id, "dimension": "ROWS",
+            "startIndex": inicio - 1, "endIndex": fim,
+        }}}
+        for inicio, fim in intervalos
+    ]
+    worksheet.spreadsheet.batch_update({"requests": requisicoes})
+
+
+def _linhas_na_ordem_do_cabecalho(df, cabecalho):
+    """Reordena as colunas do DataFrame conforme o cabeçalho da planilha e converte tudo para texto."""
+    faltando = [col for col in df.columns if col not in cabecalho]
+    if faltando:
+        raise ValueError(f"Colunas ausentes na planilha: {faltando}")
+    df = df.reindex(columns=cabecalho)
+    # Colunas categóricas (ver schema.py) não aceitam "" como valor novo: viram object antes de preencher
+    df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return df.fillna("").astype(str).values.tolist()
+
+
+class SheetsStorage(ExpenseStorage):
+    """
+    Despesas guardadas numa aba de uma planilha do Google Sheets (via gspread).
+
+    A planilha, a aba e o cabeçalho vêm do cache da SheetsConnection, e cada operação
+    passa por `conexao.executar` (novas tentativas em 429/5xx). As regras de recorrência
+    ficam numa aba própria, criada na primeira regra gravada.
+
+    As partições por ano não são abas separadas: `load(particoes)` lê as colunas Data e
+    id_original, localiza as linhas dos anos pedidos e busca só esses trechos, em blocos
+    de LINHAS_POR_LEITURA linhas lidos em paralelo, dos mais recentes para os mais antigos.
+
+    Os ids reservados ficam numa aba própria por sequência (despesas e regras): a primeira
+    linha guarda o id inicial e cada reserva acrescenta linhas. O Google serializa os appends, então o número da linha
+    recebida identifica o bloco, sem ler nem travar nada.
+    """
+
+    name = "sheets"
+
+    def __init__(self, conexao, worksheet_name, rules_worksheet_name="Recorrencias", ids_worksheet_name="Ids",
+                 rule_ids_worksheet_name="IdsRecorrencias"):
+        self.conexao = conexao
+        self.worksheet_name = worksheet_name
+        self.rules_worksheet_name = rules_worksheet_name
+        self.ids_worksheet_name = ids_worksheet_name
+        self.rule_ids_worksheet_name = rule_ids_worksheet_name
+
+    def _worksheet(self):
+        return self.conexao.worksheet(self.worksheet_name)
+
+    def _mapear_linhas_por_id(self, worksheet, titulo=None, coluna="id_original"):
+        """Lê apenas a coluna de id (o cabeçalho vem do cache) e devolve (cabeçalho, {id: nº da linha})."""
+        cabecalho = self.conexao.header(titulo or self.worksheet_name)
+        if coluna not in cabecalho:
+            raise ValueError(f"A planilha não possui a coluna '{coluna}'.")
+        coluna_id = cabecalho.index(coluna) + 1
+        ids = pd.to_numeric(pd.Series(worksheet.col_values(coluna_id)[1:], dtype=object), errors="coerce")
+        # A linha 1 é o cabeçalho, então a primeira despesa está na linha 2
+        linhas = {int(id_): i + 2 for i, id_ in enumerate(ids) if pd.notna(id_)}
+        return cabecalho, linhas
+
+    def _colunas_de_particao(self, worksheet):
+        """
+        Lê só as colunas Data e id_original (uma chamada) e devolve (cabeçalho, datas, ids),
+        alinhadas pelas linhas da planilha a partir da linha 2.
+        """
+        cabecalho = self.conexao.header(self.worksheet_name)
+        if not {"Data", "id_original"} <= set(cabecalho):
+            raise ValueError("A planilha não possui as colunas 'Data' e 'id_original'.")
+        letras = [_ultima_coluna(cabecalho[: cabecalho.index(col) + 1]) for col in ["Data", "id_original"]]
+        blocos = worksheet.batch_get([f"{letra}2:{letra}" for letra in letras], value_render_option="FORMATTED_VALUE")
+        datas, ids = ([linha[0] if linha else "" for linha in bloco] for bloco in blocos)
+        # As células vazias do fim de uma coluna não vêm na resposta
+        total = max(len(datas), len(ids))
+        datas += [""] * (total - len(datas))
+        ids += [""] * (total - len(ids))
+        return cabecalho, datas, ids
+
+    def load(self, particoes=None, ao_receber=None):
+        # Cada bloco passa pelo seu próprio `executar` (novas tentativas por bloco), então a
+        # leitura inteira não fica dentro de outro `executar`
+        colunas = self.conexao.executar(self._colunas_para_leitura)
+        if colunas is None:
+            # Planilha antiga, sem as colunas Data e id_original: uma leitura só
+            df = self.conexao.executar(lambda: _frame_da_planilha(self._worksheet().get_values(value_render_option="FORMATTED_VALUE")))
+            if ao_receber is not None and not df.empty:
+                ao_receber(df)
+            return df
+        cabecalho, datas, _ = colunas
+        dentro = np.ones(len(datas), dtype=bool) if particoes is None else particao_por_ano(datas).isin(list(particoes)).to_numpy()
+        return self._ler_em_blocos(cabecalho, np.flatnonzero(dentro), datas, ao_receber)
+
+    def load_with_catalog(self, particoes):
+        # As colunas Data e id_original lidas para escolher as linhas também dão o catálogo
+        colunas = self.conexao.executar(self._colunas_para_leitura)
+        if colunas is None:
+            return super().load_with_catalog(particoes)
+        cabecalho, datas, ids = colunas
+        catalogo = _catalogo(datas, ids)
+        existentes = [p for p in particoes if p in catalogo["particoes"]]
+        dentro = particao_por_ano(datas).isin(existentes).to_numpy()
+        return catalogo, self._ler_em_blocos(cabecalho, np.flatnonzero(dentro), datas)
+
+    def _colunas_para_leitura(self):
+        """
+        (cabeçalho, datas já convertidas, ids) das linhas da aba; None se faltarem as colunas
+        Data e id_original.
+        """
+        cabecalho = self.conexao.header(self.worksheet_name)
+        if not cabecalho:
+            return [], pd.Series([], dtype="datetime64[ns]"), []
+        if not {"Data", "id_original"} <= set(cabecalho):
+            return None
+        _, datas, ids = self._colunas_de_particao(self._worksheet())
+        return cabecalho, parse_datas(pd.Series(datas, dtype=object)), ids
+
+    def _ler_bloco(self, cabecalho, linhas):
+        """Lê o trecho da aba que cobre `linhas` (índices a partir da linha 2) e devolve só essas linhas, tipadas."""
+        inicio, fim = linhas[0] + 2, linhas[-1] + 2
+        (bloco,) = self.conexao.executar(
+            lambda: self._worksheet().batch_get([f"A{inicio}:{_ultima_coluna(cabecalho)}{fim}"], value_render_option="FORMATTED_VALUE")
+        )
+        # A resposta omite as linhas vazias do fim do trecho
+        bloco = bloco + [[]] * (fim - inicio + 1 - len(bloco))
+        return _frame_da_planilha([cabecalho] + [bloco[i] for i in linhas - linhas[0]])
+
+    def _ler_em_blocos(self, cabecalho, linhas, datas, ao_receber=None):
+        """
+        Lê as linhas pedidas em blocos de LINHAS_POR_LEITURA linhas da aba, em paralelo.
+        Os blocos com as datas mais recentes são pedidos primeiro (a aba costuma estar em
+        ordem de lançamento, então são os do fim) e cada um é convertido assim que chega.
+        O resultado fica na ordem da aba.
+        """
+        if not len(linhas):
+            return empty_expenses_frame()
+        numero_bloco = linhas // LINHAS_POR_LEITURA
+        blocos = np.split(linhas, np.flatnonzero(np.diff(numero_bloco)) + 1)
+        # Blocos só com linhas sem data vão por último
+        mais_recente = [datas.iloc[bloco].max() for bloco in blocos]
+        ordem = sorted(range(len(blocos)), key=lambda i: pd.Timestamp.min if pd.isna(mais_recente[i]) else mais_recente[i], reverse=True)
+
+        lidos = [None] * len(blocos)
+        with ThreadPoolExecutor(max_workers=MAX_LEITURAS_PARALELAS, thread_name_prefix="sheets-load") as executor:
+            futuros = {executor.submit(self._ler_bloco, cabecalho, blocos[i]): i for i in ordem}
+            try:
+                for futuro in as_completed(futuros):
+                    df = futuro.result()
+                    lidos[futuros[futuro]] = df
+                    if ao_receber is not None and not df.empty:
+                        ao_receber(df)
+            except BaseException:
+                for futuro in futuros:
+                    futuro.cancel()
+                raise
+        return pd.concat(lidos, ignore_index=True)
+
+    def catalog(self):
+        return self.conexao.executar(self._catalog)
+
+    def _catalog(self):
+        if not self.conexao.header(self.worksheet_name):
+            return _catalogo([], [])
+        _, datas, ids = self._colunas_de_particao(self._worksheet())
+        return _catalogo(parse_datas(pd.Series(datas, dtype=object)), ids)
+
+    def append(self, df):
+        """Acrescenta as linhas novas ao final da planilha com uma única chamada."""
+        # Não é idempotente: só é repetido quando a API recusa a chamada (429)
+        self.conexao.executar(lambda: self._append(df), idempotente=False)
+        return resultado_da_escrita()
+
+    def _append(self, df):
+        worksheet = self._worksheet()
+        df = _formatar_para_planilha(df)
+        cabecalho = self.conexao.header(self.worksheet_name)
+        if not cabecalho:
+            # Planilha vazia: escreve o cabeçalho junto com as linhas
+            cabecalho = df.columns.tolist()
+            worksheet.update([cabecalho] + _linhas_na_ordem_do_cabecalho(df, cabecalho), value_input_option="USER_ENTERED")
+            return
+        worksheet.append_rows(_linhas_na_ordem_do_cabecalho(df, cabecalho), value_input_option="USER_ENTERED")
+
+    def update(self, df, originais=None):
+        """
+        Atualiza, em lote, somente as linhas cujos id_original estão no DataFrame. Com
+        `originais`, relê essas linhas (uma chamada) e grava o merge com elas.
+        """
+        return resultado_da_escrita(self.conexao.executar(lambda: self._update(df, originais)))
+
+    def _ler_linhas(self, worksheet, cabecalho, linhas):
+        """Lê as linhas (números da planilha, em ordem crescente) com um único batch_get."""
+        ultima = _ultima_coluna(cabecalho)
+        intervalos = _intervalos(linhas)
+        if not intervalos:
+            return empty_expenses_frame()
+        blocos = worksheet.batch_get([f"A{inicio}:{ultima}{fim}" for inicio, fim in intervalos], value_render_option="FORMATTED_VALUE")
+        return _frame_da_planilha([cabecalho] + [linha for bloco in blocos for linha in bloco])
+
+    def _update(self, df, originais=None):
+        worksheet = self._worksheet()
+        cabecalho, linhas = self._mapear_linhas_por_id(worksheet)
+        conflitos = []
+        if originais is not None:
+            atuais = self._ler_linhas(worksheet, cabecalho, [linhas[id_] for id_ in df["id_original"].astype(int) if id_ in linhas])
+            df, conflitos = mesclar_alteracoes(atuais, originais, df)
+        ultima_coluna = _ultima_coluna(cabecalho)
+        valores = _linhas_na_ordem_do_cabecalho(_formatar_para_planilha(df), cabecalho)
+
+        atualizacoes = []
+        for id_, linha_valores in zip(df["id_original"].astype(int), valores):
+            if id_ not in linhas:
+                raise KeyError(f"id_original {id_} não encontrado na planilha.")
+            linha = linhas[id_]
+            atualizacoes.append({"range": f"A{linha}:{ultima_coluna}{linha}", "values": [linha_valores]})
+        if atualizacoes:
+            worksheet.batch_update(atualizacoes, value_input_option="USER_ENTERED")
+        return conflitos
+
+    def delete(self, ids):
+        """Remove da planilha as linhas dos id_original informados, numa única requisição."""
+        # Repetir é seguro: as linhas são localizadas de novo pelo id a cada tentativa
+        self.conexao.executar(lambda: self._delete(ids))
+        return resultado_da_escrita()
+
+    def _delete(self, ids):
+        worksheet = self._worksheet()
+        _, linhas = self._mapear_linhas_por_id(worksheet)
+        _excluir_linhas(worksheet, [linhas[int(id_)] for id_ in ids if int(id_) in linhas])
+
+    def replace_all(self, df, revisao=None):
+        """
+        Limpa a aba e reescreve tudo; em caso de falha, restaura o conteúdo anterior. Se a
+        planilha mudou desde `revisao`, grava por id_original sem apagar as linhas dos outros.
+        """
+        if revisao is not None and self.revision() != revisao:
+            self.conexao.executar(lambda: self._upsert(df))
+            return resultado_da_escrita()
+        try:
+            self.conexao.executar(lambda: self._replace_all(df))
+        finally:
+            self.conexao.forget_header(self.worksheet_name)
+        return resultado_da_escrita()
+
+    def _upsert(self, df):
+        """Regrava as linhas que já existem (por id_original) e acrescenta as demais ao final."""
+        worksheet = self._worksheet()
+        cabecalho, linhas = self._mapear_linhas_por_id(worksheet)
+        if not cabecalho:
+            self._append(df)
+            return
+        existe = df["id_original"].astype(int).isin(linhas).to_numpy()
+        existentes = df[existe].assign(_linha=df["id_original"][existe].astype(int).map(linhas)).sort_values("_linha")
+        valores = _linhas_na_ordem_do_cabecalho(_formatar_para_planilha(existentes.drop(columns="_linha")), cabecalho)
+        ultima = _ultima_coluna(cabecalho)
+        # Um intervalo por bloco de linhas consecutivas, na ordem da planilha
+        atualizacoes, i = [], 0
+        for inicio, fim in _intervalos(existentes["_linha"].tolist()):
+            atualizacoes.append({"range": f"A{inicio}:{ultima}{fim}", "values": valores[i:i + fim - inicio + 1]})
+            i += fim - inicio + 1
+        if atualizacoes:
+            worksheet.batch_update(atualizacoes, value_input_option="USER_ENTERED")
+        if not existe.all():
+            worksheet.append_rows(
+                _linhas_na_ordem_do_cabecalho(_formatar_para_planilha(df[~existe]), cabecalho), value_input_option="USER_ENTERED"
+            )
+
+    def _replace_all(self, df):
+        worksheet = self._worksheet()
+        if df.empty:
+            worksheet.clear()
+            return
+
+        # Manter o backup é uma boa prática caso a escrita falhe.
+        backup = worksheet.get_all_values()
+        df = _formatar_para_planilha(df)
+        try:
+            worksheet.clear()
+            data = [df.columns.tolist()] + df.astype(str).values.tolist()
+            worksheet.update(data, value_input_option="USER_ENTERED")
+        except Exception:
+            worksheet.clear() # Limpa qualquer escrita parcial.
+            worksheet.update(backup) # Escreve os dados do backup de volta.
+            raise
+
+    def load_rules(self):
+        return self.conexao.executar(self._load_rules)
+
+    def _load_rules(self):
+        try:
+            values = self.conexao.worksheet(self.rules_worksheet_name).get_values(value_render_option="FORMATTED_VALUE")
+        except gspread.exceptions.WorksheetNotFound:
+            return empty_rules_frame()  # nenhuma regra gravada ainda
+        if len(values) < 2:
+            return empty_rules_frame()
+        df = pd.DataFrame(values[1:], columns=values[0]).reindex(columns=COLUNAS_REGRA)
+        for col in ["id_regra", "Periodo", "Ocorrencias"]:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+        df["Inicio"] = parse_datas(df["Inicio"])
+        df["Valor"] = parse_brl(df["Valor"])
+        df["Tag"] = df["Tag"].fillna("")
+        return df
+
+    def append_rules(self, df):
+        self.conexao.executar(lambda: self._append_rules(df), idempotente=False)
+        return resultado_da_escrita()
+
+    def _append_rules(self, df):
+        try:
+            worksheet = self.conexao.worksheet(self.rules_worksheet_name)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = self.conexao.spreadsheet().add_worksheet(self.rules_worksheet_name, rows=1, cols=len(COLUNAS_REGRA))
+        df = _formatar_regras_para_planilha(df.reindex(columns=COLUNAS_REGRA))
+        cabecalho = self.conexao.header(self.rules_worksheet_name)
+        if not cabecalho:
+            worksheet.update([COLUNAS_REGRA] + _linhas_na_ordem_do_cabecalho(df, COLUNAS_REGRA), value_input_option="USER_ENTERED")
+            return
+        worksheet.append_rows(_linhas_na_ordem_do_cabecalho(df, cabecalho), value_input_option="USER_ENTERED")
+
+    def delete_rules(self, ids):
+        self.conexao.executar(lambda: self._delete_rules(ids))
+        return resultado_da_escrita()
+
+    def _delete_rules(self, ids):
+        worksheet = self.conexao.worksheet(self.rules_worksheet_name)
+        _, linhas = self._mapear_linhas_por_id(worksheet, self.rules_worksheet_name, "id_regra")
+        _excluir_linhas(worksheet, [linhas[int(id_)] for id_ in ids if int(id_) in linhas])
+
+    def existing_ids(self, ids, sequencia=SEQUENCIA_DESPESAS):
+        return self.conexao.executar(lambda: self._existing_ids(ids, sequencia))
+
+    def _existing_ids(self, ids, sequencia):
+        titulo = self.worksheet_name if sequencia == SEQUENCIA_DESPESAS else self.rules_worksheet_name
+        try:
+            if not self.conexao.header(titulo):
+                return set()
+            _, linhas = self._mapear_linhas_por_id(self.conexao.worksheet(titulo), titulo, sequencia)
+        except gspread.exceptions.WorksheetNotFound:
+            return set()  # aba de regras ainda não criada
+        return {int(id_) for id_ in ids if int(id_) in linhas}
+
+    def reserve_ids(self, quantidade, sequencia=SEQUENCIA_DESPESAS):
+        """Cada linha acrescentada na aba de ids da sequência reserva IDS_POR_LINHA ids."""
+        # Repetir a chamada é seguro: no pior caso um bloco fica reservado e sem uso
+        return self.conexao.executar(lambda: self._reserve_ids(quantidade, sequencia))
+
+    def _maior_id(self, sequencia):
+        """Maior id já gravado na sequência (-1 se nenhum), ponto de partida do contador."""
+        if sequencia == SEQUENCIA_DESPESAS:
+            return self._catalog()["maior_id"]
+        regras = self._load_rules()
+        return int(regras["id_regra"].max()) if not regras.empty else -1
+
+    def _aba_de_ids(self, sequencia):
+        """Aba de ids da sequência e o id inicial (guardado na primeira linha), criando a aba na primeira reserva."""
+        titulo = self.ids_worksheet_name if sequencia == SEQUENCIA_DESPESAS else self.rule_ids_worksheet_name
+        try:
+            worksheet = self.conexao.worksheet(titulo)
+        except gspread.exceptions.WorksheetNotFound:
+            try:
+                worksheet = self.conexao.spreadsheet().add_worksheet(titulo, rows=1, cols=2)
+            except gspread.exceptions.APIError as e:
+                if not _aba_ja_existe(e):
+                    raise
+                # Outro processo criou a aba ao mesmo tempo
+                worksheet = self.conexao.spreadsheet().worksheet(titulo)
+        cabecalho = self.conexao.header(titulo)
+        if len(cabecalho) < 2:
+            # Os ids já gravados ficam abaixo do início. O Sheets não tem escrita condicional,
+            # então o início é acrescentado como as reservas: processos que criam a aba ao
+            # mesmo tempo ficam com linhas diferentes, vale o da primeira e as outras contam
+            # só como blocos reservados (e descartados) em _reserve_ids
+            worksheet.append_rows([["inicio", self._maior_id(sequencia) + 1]], value_input_option="RAW", table_range="A1")
+            self.conexao.forget_header(titulo)
+            cabecalho = self.conexao.header(titulo)
+        return worksheet, int(cabecalho[1])
+
+    def _reserve_ids(self, quantidade, sequencia):
+        worksheet, inicio = self._aba_de_ids(sequencia)
+        linhas = max(1, -(-quantidade // IDS_POR_LINHA))
+        resposta = worksheet.append_rows([[IDS_POR_LINHA]] * linhas, value_input_option="RAW", table_range="A1")
+        # updatedRange é algo como "Ids!A7:A9": a primeira linha acrescentada é a 7
+        primeira = int(re.search(r"![A-Z]+(\d+)", resposta["updates"]["updatedRange"]).group(1))
+        inicio += (primeira - 2) * IDS_POR_LINHA
+        return range(inicio, inicio + linhas * IDS_POR_LINHA)
+
+    def revision(self):
+        """modifiedTime da planilha no Drive (None se não for possível consultar agora)."""
+        try:
+            # Poucas tentativas: sem revisão, o app segue com os dados que já tem
+            return self.conexao.executar(lambda: self.conexao.spreadsheet().get_lastUpdateTime(), max_tentativas=2)
+        except Exception:
+            return None
+
+
+# ======================== SQLITE ========================
+# Sequência -> (chave do contador na tabela meta, tabela cujos ids ele nunca repete)
+_CONTADORES_SQLITE = {SEQUENCIA_DESPESAS: ("proximo_id", "despesas"), SEQUENCIA_REGRAS: ("proximo_id_regra", "recorrencias")}
+
+class SQLiteStorage(ExpenseStorage):
+    """
+    Despesas guardadas num arquivo SQLite local (modo WAL).
+
+    Cada escrita incrementa um contador na tabela `meta`, usado como revisão.
+    Uma conexão é aberta por operação, o que torna a instância segura para ser
+    compartilhada entre as threads das sessões do Streamlit.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        diretorio = os.path.dirname(path)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS despesas (
+                    id_original INTEGER NOT NULL,
+                    Data        TEXT,
+                    Categoria   TEXT,
+                    Tag         TEXT,
+                    Valor       REAL,
+                    Descricao   TEXT,
+                    Pagamento   TEXT,
+                    Usuario     TEXT
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_despesas_id ON despesas(id_original);
+                CREATE INDEX IF NOT EXISTS idx_despesas_data ON despesas(Data);
+                CREATE INDEX IF NOT EXISTS idx_despesas_usuario ON despesas(Usuario);
+                CREATE INDEX IF NOT EXISTS idx_despesas_categoria ON despesas(Categoria);
+                CREATE TABLE IF NOT EXISTS recorrencias (
+                    id_regra    INTEGER PRIMARY KEY,
+                    Inicio      TEXT,
+                    Periodo     INTEGER,
+                    Ocorrencias INTEGER,
+                    Categoria   TEXT,
+                    Tag         TEXT,
+                    Valor       REAL,
+                    Descricao   TEXT,
+                    Pagamento   TEXT,
+                    Usuario     TEXT
+                );
+                CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta (chave, valor) VALUES ('revisao', 0);
+                INSERT OR IGNORE INTO meta (chave, valor) VALUES ('proximo_id', 0);
+                INSERT OR IGNORE INTO meta (chave, valor) VALUES ('proximo_id_regra', 0);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _para_registros(df):
+        """Converte o DataFrame em tuplas na ordem das colunas da tabela."""
+        df = df.reindex(columns=COLUNAS_DESPESA)
+        datas = pd.to_datetime(df["Data"], errors="coerce").dt.strftime("%Y-%m-%d")
+        registros = pd.DataFrame({
+            "id_original": df["id_original"].astype(int),
+            "Data": datas.where(datas.notna(), None),
+            "Categoria": df["Categoria"], "Tag": texto_sem_nulos(df["Tag"]),
+            "Valor": pd.to_numeric(df["Valor"], errors="coerce").fillna(0).round(2),
+            "Descricao": df["Descricao"], "Pagamento": df["Pagamento"], "Usuario": df["Usuario"],
+        })
+        return list(registros.astype(object).itertuples(index=False, name=None))
+
+    @staticmethod
+    def _incrementar_revisao(conn, conflitos=()):
+        """
+        Incrementa o contador na transação da escrita e devolve o resultado_da_escrita. A
+        transação já detém o lock de escrita, então a revisão anterior é exatamente a que a
+        escrita encontrou.
+        """
+        conn.execute("UPDATE meta SET valor = valor + 1 WHERE chave = 'revisao'")
+        (valor,) = conn.execute("SELECT valor FROM meta WHERE chave = 'revisao'").fetchone()
+        return resultado_da_escrita(conflitos, f"sqlite-{valor - 1}", f"sqlite-{valor}")
+
+    def load(self, particoes=None, ao_receber=None):
+        consulta = f"SELECT {', '.join(COLUNAS_DESPESA)} FROM despesas"
+        parametros = []
+        if particoes is not None:
+            # Intervalos de datas usam o índice de Data (Data é texto ISO)
+            condicoes = []
+            for particao in sorted(set(particoes)):
+                if particao == PARTICAO_SEM_DATA:
+                    condicoes.append("Data IS NULL")
+                else:
+                    condicoes.append("(Data >= ? AND Data < ?)")
+                    parametros += [f"{particao:04d}-01-01", f"{particao + 1:04d}-01-01"]
+            consulta += f" WHERE {' OR '.join(condicoes) or '0'}"
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(consulta + " ORDER BY rowid", conn, params=parametros)
+        if df.empty:
+            return empty_expenses_frame()
+        df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
+        df["id_original"] = df["id_original"].astype(int)
+        if ao_receber is not None:
+            ao_receber(df)  # a consulta local é rápida: um bloco só
+        return df
+
+    def catalog(self):
+        with closing(self._connect()) as conn:
+            anos = [linha[0] for linha in conn.execute("SELECT DISTINCT substr(Data, 1, 4) FROM despesas")]
+            (maior_id,) = conn.execute("SELECT MAX(id_original) FROM despesas").fetchone()
+        particoes = sorted(PARTICAO_SEM_DATA if ano is None else int(ano) for ano in anos)
+        return {"particoes": particoes, "maior_id": -1 if maior_id is None else int(maior_id)}
+
+    def append(self, df):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO despesas (id_original, Data, Categoria, Tag, Valor, Descricao, Pagamento, Usuario) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._para_registros(df),
+            )
+            return self._incrementar_revisao(conn)
+
+    def _ler_linhas(self, conn, ids):
+        """Linhas atuais dos id_original informados (em blocos, pelo limite de parâmetros do SQLite)."""
+        ids = [int(id_) for id_ in ids]
+        frames = [
+            pd.read_sql_query(
+                f"SELECT {', '.join(COLUNAS_DESPESA)} FROM despesas WHERE id_original IN ({', '.join('?' * len(bloco))})",
+                conn, params=bloco,
+            )
+            for bloco in (ids[i:i + 500] for i in range(0, len(ids), 500))
+        ]
+        df = pd.concat(frames, ignore_index=True) if frames else empty_expenses_frame()
+        df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
+        return df
+
+    def update(self, df, originais=None):
+        with closing(self._connect()) as conn, conn:
+            conflitos = []
+            if originais is not None:
+                # Leitura e escrita na mesma transação: ninguém grava entre o merge e o UPDATE
+                conn.execute("BEGIN IMMEDIATE")
+                df, conflitos = mesclar_alteracoes(self._ler_linhas(conn, df["id_original"]), originais, df)
+            # Reordena cada tupla para (valores..., id_original) para casar com o WHERE
+            registros = [registro[1:] + registro[:1] for registro in self._para_registros(df)]
+            cursor = conn.executemany(
+                "UPDATE despesas SET Data = ?, Categoria = ?, Tag = ?, Valor = ?, Descricao = ?, Pagamento = ?, Usuario = ? "
+                "WHERE id_original = ?",
+                registros,
+            )
+            if cursor.rowcount != len(registros):
+                raise KeyError("Uma ou mais despesas editadas não existem mais no banco.")
+            return self._incrementar_revisao(conn, conflitos)
+
+    def delete(self, ids):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM despesas WHERE id_original = ?", [(int(id_),) for id_ in ids])
+            return self._incrementar_revisao(conn)
+
+    def replace_all(self, df, revisao=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Alguém gravou depois de `revisao`: regrava por id_original sem apagar as linhas dos outros
+            if revisao is None or self._revisao(conn) == revisao:
+                conn.execute("DELETE FROM despesas")
+            conn.executemany(
+                "INSERT OR REPLACE INTO despesas (id_original, Data, Categoria, Tag, Valor, Descricao, Pagamento, Usuario) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._para_registros(df),
+            )
+            return self._incrementar_revisao(conn)
+
+    def load_rules(self):
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(f"SELECT {', '.join(COLUNAS_REGRA)} FROM recorrencias ORDER BY id_regra", conn)
+        if df.empty:
+            return empty_rules_frame()
+        df["Inicio"] = pd.to_datetime(df["Inicio"], errors="coerce")
+        return df
+
+    def append_rules(self, df):
+        df = df.reindex(columns=COLUNAS_REGRA)
+        inicio = pd.to_datetime(df["Inicio"], errors="coerce").dt.strftime("%Y-%m-%d")
+        registros = df.assign(Inicio=inicio.where(inicio.notna(), None), Tag=df["Tag"].fillna(""))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT INTO recorrencias ({', '.join(COLUNAS_REGRA)}) VALUES ({', '.join('?' * len(COLUNAS_REGRA))})",
+                list(registros.astype(object).itertuples(index=False, name=None)),
+            )
+            return self._incrementar_revisao(conn)
+
+    def delete_rules(self, ids):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM recorrencias WHERE id_regra = ?", [(int(id_),) for id_ in ids])
+            return self._incrementar_revisao(conn)
+
+    def existing_ids(self, ids, sequencia=SEQUENCIA_DESPESAS):
+        _, tabela = _CONTADORES_SQLITE[sequencia]
+        with closing(self._connect()) as conn:
+            linhas = conn.execute(
+                f"SELECT {sequencia} FROM {tabela} WHERE {sequencia} IN (SELECT value FROM json_each(?))",
+                (json.dumps([int(id_) for id_ in ids]),),
+            )
+            return {int(id_) for (id_,) in linhas}
+
+    def reserve_ids(self, quantidade, sequencia=SEQUENCIA_DESPESAS):
+        # Não incrementa a revisão: reservar ids não muda as despesas
+        chave, tabela = _CONTADORES_SQLITE[sequencia]
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Nunca abaixo dos ids já gravados (bancos anteriores ao contador ou ids vindos de fora)
+            (inicio,) = conn.execute(
+                f"SELECT MAX((SELECT valor FROM meta WHERE chave = ?), "
+                f"COALESCE((SELECT MAX({sequencia}) FROM {tabela}), -1) + 1)",
+                (chave,),
+            ).fetchone()
+            conn.execute("UPDATE meta SET valor = ? WHERE chave = ?", (inicio + quantidade, chave))
+        return range(inicio, inicio + quantidade)
+
+    @staticmethod
+    def _revisao(conn):
+        (valor,) = conn.execute("SELECT valor FROM meta WHERE chave = 'revisao'").fetchone()
+        return f"sqlite-{valor}"
+
+    def revision(self):
+        with closing(self._connect()) as conn:
+            return self._revisao(conn)
@@ -0,0 +1,293 @@
+# ======================== IMPORTS ========================
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cube import AggregateCube
+from filters import FilterIndex
+from recurrence import data_horizonte, expandir
+from schema import aplicar_esquema, concatenar, unificar_categorias
+from search import SearchIndex
+from storage import SEM_TERMINO, empty_expenses_frame, empty_rules_frame
+
+
+# ======================== STORE COMPARTILHADO ========================
+def _expandir(regras, **janela):
+    """Ocorrências das regras no esquema compacto e, em paralelo, o id_regra de cada uma."""
+    ocorrencias = expandir(regras, com_id_regra=True, **janela)
+    return aplicar_esquema(ocorrencias.drop(columns="id_regra")), ocorrencias["id_regra"].to_numpy(dtype=np.int64)
+
+
+class ExpenseStore:
+    """
+    DataFrame de despesas compartilhado por todas as sessões do processo.
+
+    O frame publicado nunca é alterado no lugar: cada mutação monta um frame novo
+    e troca a referência (copy-on-write), incrementando `version`. Assim as sessões
+    podem ler `df` sem copiar, e quem guarda resultados derivados (agregações,
+    filtros, figuras) pode usar `version` como chave de cache.
+
+    O cubo de agregados (`cube`) é montado na carga e depois atualizado só com as
+    linhas que entram e saem em cada mutação. O índice de filtros é montado sob
+    demanda, uma vez por versão. O índice de busca textual (`search`) é montado na
+    primeira busca e depois recebe só as despesas novas, editadas e excluídas, numa
+    cópia publicada junto com o frame e a versão.
+
+    As regras de recorrência (`rules`) ficam guardadas como regras; suas ocorrências
+    são expandidas só até o horizonte (ver recurrence.py), entram no cubo e no índice
+    como despesas comuns, mas nunca em `df`, que tem só as linhas gravadas. Na virada
+    do mês o horizonte avança na próxima leitura do cubo ou do índice, e `extend_horizon`
+    o leva até o fim de uma janela pedida (um ano futuro escolhido no filtro), expandindo
+    só os meses novos; regras novas e excluídas mexem só nas próprias ocorrências.
+
+    As despesas são particionadas por ano (ver storage.py). O store pode ter só algumas
+    partições carregadas (`partitions`, None quando estão todas); as demais entram sob
+    demanda com `add_partitions`. `catalog` lista as partições que existem no backend.
+
+    Todo frame que entra no store passa pelo esquema compacto (ver schema.py): colunas
+    categóricas, id_original em int32 e Descricao em texto Arrow. As categorias são
+    unificadas a cada concatenação, então `df` nunca volta para colunas object.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializa os carregamentos para que várias sessões abrindo juntas baixem os dados uma vez só
+        self.load_lock = threading.Lock()
+        self._df = aplicar_esquema(empty_expenses_frame())
+        self._regras = empty_rules_frame()
+        self._ocorrencias = aplicar_esquema(empty_expenses_frame())
+        self._regra_das_ocorrencias = np.empty(0, dtype=np.int64)  # id_regra de cada linha de _ocorrencias
+        self._horizonte = data_horizonte()
+        self._cube = AggregateCube.from_frame(self._df)
+        self._filter_index = None
+        self._busca = None
+        self._particoes = frozenset()
+        self.catalog = {"particoes": [], "maior_id": -1}
+        self.version = 0
+        self.revision = None  # revisão do backend que corresponde ao conteúdo atual
+        self.loaded = False
+
+    @property
+    def df(self):
+        return self._df
+
+    @property
+    def rules(self):
+        return self._regras
+
+    @property
+    def cube(self):
+        return self._cube
+
+    @property
+    def partitions(self):
+        """Partições carregadas, ou None se o store tem todas as despesas."""
+        return self._particoes
+
+    def missing_partitions(self, particoes):
+        """Partições pedidas que ainda não estão carregadas, em ordem."""
+        with self._lock:
+            if self._particoes is None:
+                return []
+            return sorted(set(particoes) - self._particoes)
+
+    def contents(self):
+        """Devolve (df, regras, partições carregadas, catálogo) de forma consistente, para o snapshot local."""
+        with self._lock:
+            return self._df, self._regras, self._particoes, self.catalog
+
+    def indexed(self):
+        """
+        Devolve (frame, FilterIndex) da mesma versão, montando o índice se necessário.
+        O frame tem as linhas gravadas seguidas das ocorrências das regras.
+        """
+        with self._lock:
+            self._avancar_horizonte()
+            if self._filter_index is None:
+                frame = self._com_ocorrencias()
+                self._filter_index = (frame, FilterIndex(frame, gravadas=len(self._df)))
+            return self._filter_index
+
+    def search(self, consulta):
+        """
+        id_original (ordenados) das despesas gravadas cuja Descricao ou Tag contém os termos
+        da consulta (ver search.py). O índice reflete sempre a versão mais recente.
+        """
+        with self._lock:
+            if self._busca is None:
+                self._busca = SearchIndex.from_frame(self._df)
+            busca = self._busca
+        return busca.search(consulta)
+
+    def horizon(self):
+        """Data até onde as regras sem término estão expandidas, ou None se não há nenhuma."""
+        with self._lock:
+            if not (self._regras["Ocorrencias"].astype(int) <= SEM_TERMINO).any():
+                return None
+            return self._horizonte
+
+    def extend_horizon(self, fim):
+        """Expande as regras sem término até `fim` (se ainda não estiverem) e devolve a versão."""
+        with self._lock:
+            self._avancar_horizonte(pd.Timestamp(fim))
+            return self.version
+
+    def _avancar_horizonte(self, fim=None):
+        """
+        Chamado com o lock adquirido: se o mês virou desde a última expansão (ou `fim` está
+        além dela), acrescenta as ocorrências das regras sem término entre o horizonte antigo
+        e o novo (as regras com término já estão expandidas por inteiro).
+        """
+        horizonte = data_horizonte() if fim is None else max(data_horizonte(), fim)
+        if horizonte <= self._horizonte:
+            return
+        sem_termino = self._regras[self._regras["Ocorrencias"].astype(int) <= SEM_TERMINO]
+        novas, regra_das_novas = _expandir(sem_termino, inicio=self._horizonte + pd.Timedelta(days=1), fim=horizonte)
+        self._horizonte = horizonte
+        if novas.empty:
+            return
+        self._ocorrencias = concatenar([self._ocorrencias, novas])
+        self._regra_das_ocorrencias = np.concatenate([self._regra_das_ocorrencias, regra_das_novas])
+        self._cube = self._cube.with_rows(novas)
+        self._filter_index = None
+        self.version += 1
+
+    def _com_ocorrencias(self):
+        if self._ocorrencias.empty:
+            return self._df
+        return concatenar([self._df, self._ocorrencias])
+
+    def snapshot(self):
+        """Devolve (version, df) de forma consistente."""
+        with self._lock:
+            return self.version, self._df
+
+    def versioned_cube(self):
+        """Devolve (version, cube) de forma consistente."""
+        with self._lock:
+            self._avancar_horizonte()
+            return self.version, self._cube
+
+    def replace(self, df, revision=None, regras=None, particoes=None, catalogo=None):
+        """
+        Publica um frame novo, com suas regras de recorrência (carga inicial ou recarga do backend).
+        `particoes` são as partições que o frame contém (None se for o histórico inteiro).
+        """
+        with self._lock:
+            self._df = aplicar_esquema(df).reset_index(drop=True)
+            self._particoes = None if particoes is None else frozenset(particoes)
+            if catalogo is not None:
+                self.catalog = catalogo
+            self._regras = (regras if regras is not None else empty_rules_frame()).reset_index(drop=True)
+            # Uma recarga mantém a janela que as sessões já pediram com extend_horizon
+            self._horizonte = max(data_horizonte(), self._horizonte)
+            self._ocorrencias, self._regra_das_ocorrencias = _expandir(self._regras, horizonte=self._horizonte)
+            self._cube = AggregateCube.from_frame(self._com_ocorrencias())
+            self.revision = revision
+            self._filter_index = None
+            self._busca = None
+            self.version += 1
+            self.loaded = True
+            return self.version
+
+    def add_partitions(self, df, particoes):
+        """
+        Acrescenta as despesas de partições carregadas sob demanda. Linhas cujo id_original
+        já está no store (criadas ou editadas nesta sessão, talvez ainda na fila) são ignoradas.
+        """
+        with self._lock:
+            if self._particoes is not None:
+                self._particoes = self._particoes | set(particoes)
+            novas = df[~df["id_original"].isin(self._df["id_original"])]
+            if novas.empty:
+                return self.version
+            if self._busca is not None:
+                busca = self._busca.copy()
+                busca.add(novas)
+                self._busca = busca
+            self._df = concatenar([self._df, novas])
+            self._cube = self._cube.with_rows(novas)
+            self._filter_index = None
+            self.version += 1
+            return self.version
+
+    def mark_synced(self, revision):
+        """Registra que o backend já contém o estado atual, na revisão informada."""
+        with self._lock:
+            self.revision = revision
+
+    def mark_stale(self):
+        """Registra que o backend pode não conter o estado atual: a próxima verificação recarrega o store."""
+        with self._lock:
+            self.revision = None
+
+    def apply(self, novas=None, alteradas=None, excluidas=None, novas_regras=None, regras_excluidas=None):
+        """
+        Aplica linhas novas, edições (por id_original) e exclusões, além de regras de
+        recorrência novas e excluídas (por id_regra), e devolve a nova versão.
+        """
+        with self._lock:
+            # As regras novas são expandidas até o mesmo horizonte das demais
+            self._avancar_horizonte()
+            df = self._df
+            cube = self._cube
+            # O índice de busca publicado não muda: as alterações vão numa cópia, trocada no final
+            busca = self._busca.copy() if self._busca is not None else None
+            regras = self._regras
+            ocorrencias = self._ocorrencias
+            regra_das_ocorrencias = self._regra_das_ocorrencias
+
+            if regras_excluidas:
+                ids = [int(id_) for id_ in regras_excluidas]
+                regras = regras[~regras["id_regra"].isin(ids)]
+                saem = np.isin(regra_das_ocorrencias, ids)
+                cube = cube.without_rows(ocorrencias[saem])
+                ocorrencias = ocorrencias[~saem].reset_index(drop=True)
+                regra_das_ocorrencias = regra_das_ocorrencias[~saem]
+
+            if novas_regras is not None and not novas_regras.empty:
+                novas_ocorrencias, regra_das_novas = _expandir(novas_regras, horizonte=self._horizonte)
+                cube = cube.with_rows(novas_ocorrencias)
+                ocorrencias = concatenar([ocorrencias, novas_ocorrencias])
+                regra_das_ocorrencias = np.concatenate([regra_das_ocorrencias, regra_das_novas])
+                regras = pd.concat([regras, novas_regras], ignore_index=True)
+
+            if regras is not self._regras:
+                self._regras = regras.reset_index(drop=True)
+                self._ocorrencias = ocorrencias
+                self._regra_das_ocorrencias = regra_das_ocorrencias
+
+            if excluidas:
+                removidas = df["id_original"].isin([int(id_) for id_ in excluidas])
+                cube = cube.without_rows(df[removidas])
+                df = df[~removidas]
+                if busca is not None:
+                    busca.remove(excluidas)
+
+            if alteradas is not None and not alteradas.empty:
+                # Categorias novas (uma Tag digitada na grade, por exemplo) entram antes da atribuição
+                df, alteradas = unificar_categorias([df, alteradas])
+                df = df.copy()
+                posicoes = pd.Index(df["id_original"]).get_indexer(alteradas["id_original"].astype(int))
+                encontradas = posicoes >= 0
+                cube = cube.without_rows(df.iloc[posicoes[encontradas]])
+                colunas = [col for col in alteradas.columns if col in df.columns and col != "id_original"]
+                for col in colunas:
+                    df.iloc[posicoes[encontradas], df.columns.get_loc(col)] = alteradas[col].to_numpy()[encontradas]
+                cube = cube.with_rows(df.iloc[posicoes[encontradas]])
+                if busca is not None:
+                    busca.update(df.iloc[posicoes[encontradas]])
+
+            if novas is not None and not novas.empty:
+                df = concatenar([df, novas])
+                cube = cube.with_rows(novas)
+                if busca is not None:
+                    busca.add(novas)
+
+            self._df = df.reset_index(drop=True)
+            self._cube = cube
+            self._busca = busca
+            self._filter_index = None
+            self.version += 1
+            return self.version
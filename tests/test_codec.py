@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from codec import (
+    FORMATO_DATA_BR, FORMATO_DATA_ISO, format_brl, format_datas, format_planilha, normalizar_texto, parse_brl,
+    parse_centavos, parse_datas, texto_sem_nulos,
+)
+
+
+# ======================== MOEDA ========================
+def test_format_brl_negativos_e_milhar():
+    valores = pd.Series([0, 0.01, -0.5, 1234.56, -1234567.8, 1000000])
+    assert format_brl(valores).tolist() == [
+        "R$ 0,00", "R$ 0,01", "R$ -0,50", "R$ 1.234,56", "R$ -1.234.567,80", "R$ 1.000.000,00",
+    ]
+    assert format_brl(valores, simbolo=False).tolist()[3] == "1.234,56"
+
+
+def test_format_planilha_sem_milhar():
+    assert format_planilha(pd.Series([1234.56, -3.1, 0])).tolist() == ["1234,56", "-3,10", "0,00"]
+
+
+def test_format_trata_nulos_como_zero():
+    assert format_brl(pd.Series([np.nan, None], dtype=object)).tolist() == ["R$ 0,00", "R$ 0,00"]
+
+
+@pytest.mark.parametrize("formatar", [format_brl, lambda v: format_brl(v, simbolo=False), format_planilha])
+def test_ida_e_volta_dos_valores(formatar):
+    rng = np.random.default_rng(0)
+    centavos = np.concatenate([rng.integers(-5_000_000, 500_000_000, 5000), [0, -1, 1, -100_000, 99_999_999]])
+    texto = formatar(pd.Series(centavos / 100))
+    assert (parse_centavos(texto) == centavos).all()
+    assert np.allclose(parse_brl(texto), centavos / 100)
+
+
+def test_parse_centavos_casos_especiais():
+    casos = pd.Series(
+        ["1.234,56", "R$ 12,5", " -3,10 ", "", None, "abc", 7, 12.0, np.nan, "0,01", "1,239", "12-3", "-R$ 5"], dtype=object,
+    )
+    esperado = [123456, 1250, -310, 0, 0, 0, 700, 1200, 0, 1, 124, 0, -500]
+    assert parse_centavos(casos).tolist() == esperado
+
+
+def test_parse_centavos_numeros_e_vazio():
+    assert parse_centavos(pd.Series([1.005, -2.5, np.nan])).tolist() == [100, -250, 0]
+    assert parse_centavos(pd.Series([], dtype=object)).tolist() == []
+
+
+def test_parse_brl_mantem_indice():
+    resultado = parse_brl(pd.Series(["1.234,56", "-0,50"], index=[10, 20]))
+    assert resultado.index.tolist() == [10, 20]
+    assert resultado.tolist() == [1234.56, -0.5]
+
+
+# ======================== DATAS ========================
+@pytest.mark.parametrize("formato", [FORMATO_DATA_ISO, FORMATO_DATA_BR])
+def test_ida_e_volta_das_datas(formato):
+    rng = np.random.default_rng(0)
+    datas = pd.Series(pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 4000, 5000), unit="D"))
+    assert (parse_datas(format_datas(datas, formato)) == datas).all()
+
+
+def test_parse_datas_invalidas_viram_nat():
+    datas = parse_datas(pd.Series(["2024-05-31", "31/05/2024", " 2024-01-02 ", "", None, "x", "31/02/2024", "2024-13-01"]))
+    assert datas.isna().tolist() == [False, False, False, True, True, True, True, True]
+    assert datas[:3].tolist() == [pd.Timestamp("2024-05-31"), pd.Timestamp("2024-05-31"), pd.Timestamp("2024-01-02")]
+
+
+def test_format_datas_nat_vira_vazio():
+    datas = pd.Series([pd.Timestamp("2024-05-31"), pd.NaT])
+    assert format_datas(datas).tolist() == ["31/05/2024", ""]
+    assert format_datas(datas, FORMATO_DATA_ISO).tolist() == ["2024-05-31", ""]
+    assert format_datas(datas, "%m/%Y").tolist() == ["05/2024", ""]
+
+
+# ======================== TEXTO ========================
+def test_texto_sem_nulos_em_categoricas():
+    serie = pd.Series(["a", None, "b"], dtype="category")
+    assert texto_sem_nulos(serie).tolist() == ["a", "", "b"]
+
+
+def test_normalizar_texto():
+    assert normalizar_texto(pd.Series(["  Padaria   São João ", None])).tolist() == ["padaria sao joao", ""]
@@ -0,0 +1,32 @@
+import io
+
+import pytest
+
+from importer import ler_extrato
+
+
+def _ler(conteudo, tamanho_bloco, nome="extrato.csv"):
+    return ler_extrato(io.BytesIO(conteudo.encode("utf-8")), nome, tamanho_bloco)
+
+
+@pytest.mark.parametrize("tamanho_bloco", [1, 2, 10])
+def test_formato_decidido_antes_dos_blocos(tamanho_bloco):
+    # "1.234" só se revela brasileiro pela vírgula de uma linha seguinte, em outro bloco
+    extrato = _ler("Data;Valor;Descricao\n01/10/2026;1.234;Aluguel\n02/10/2026;10,50;Padaria\n", tamanho_bloco)
+    assert extrato["Centavos"].tolist() == [123400, 1050]
+
+
+@pytest.mark.parametrize("tamanho_bloco", [1, 10])
+def test_ponto_decimal_sem_virgula(tamanho_bloco):
+    extrato = _ler("date,amount,description\n2026-10-01,1.5,Cafe\n2026-10-02,-12.50,Mercado\n", tamanho_bloco)
+    assert extrato["Centavos"].tolist() == [150, -1250]
+
+
+def test_valores_brasileiros_com_milhar_e_moeda():
+    extrato = _ler("Data;Valor;Descrição\n01/10/2026;R$ 1.234,56;A\n02/10/2026;-3,00;B\n03/10/2026;100;C\n", 1)
+    assert extrato["Centavos"].tolist() == [123456, -300, 10000]
+
+
+def test_colunas_faltando():
+    with pytest.raises(ValueError, match="Colunas não encontradas"):
+        _ler("Data;Descricao\n01/10/2026;A\n", 10)
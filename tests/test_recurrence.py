@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from recurrence import ID_OCORRENCIA, data_horizonte, expandir
+from storage import ID_INVALIDO, SEM_TERMINO, _frame_da_planilha
+from store import ExpenseStore
+
+
+def _regra(id_regra, inicio, ocorrencias, periodo=1):
+    return {
+        "id_regra": id_regra, "Inicio": pd.Timestamp(inicio), "Periodo": periodo, "Ocorrencias": ocorrencias,
+        "Categoria": "Casa", "Tag": "", "Valor": 10.0, "Descricao": f"regra {id_regra}", "Pagamento": "Pix", "Usuario": "Ana",
+    }
+
+
+def test_ocorrencias_nao_usam_o_id_das_linhas_invalidas():
+    lidas = _frame_da_planilha([["Data", "Valor", "id_original"], ["2026-01-01", "1,00", ""], ["2026-01-02", "2,00", "7"]])
+    assert lidas["id_original"].tolist() == [ID_INVALIDO, 7]
+    ocorrencias = expandir(pd.DataFrame([_regra(1, "2026-01-31", 3)]))
+    assert (ocorrencias["id_original"] == ID_OCORRENCIA).all()
+    assert ID_OCORRENCIA != ID_INVALIDO
+
+
+def test_regra_sem_termino_exige_limite():
+    with pytest.raises(ValueError):
+        expandir(pd.DataFrame([_regra(1, "2026-01-05", SEM_TERMINO)]))
+
+
+def test_extend_horizon_expande_ate_o_fim_da_janela():
+    store = ExpenseStore()
+    store.replace(pd.DataFrame(columns=["Data", "Valor", "id_original"]), regras=pd.DataFrame([_regra(1, "2026-01-05", SEM_TERMINO)]))
+    horizonte = data_horizonte()
+    assert store.horizon() == horizonte
+
+    fim = pd.Timestamp(horizonte.year + 3, 12, 31)
+    versao = store.extend_horizon(fim)
+    assert store.horizon() == fim
+    frame, _ = store.indexed()
+    assert frame["Data"].max() == pd.Timestamp(fim.year, 12, 5)
+    # Meses contínuos, sem repetir os que já estavam expandidos
+    assert frame["Data"].is_unique and len(frame) == (fim.year - 2026) * 12 + 12
+
+    # Janelas já expandidas não mudam nada; uma recarga mantém o horizonte estendido
+    assert store.extend_horizon(horizonte) == versao
+    store.replace(store.df, regras=store.rules)
+    assert store.horizon() == fim
+
+
+def test_horizon_sem_regras_sem_termino():
+    store = ExpenseStore()
+    store.replace(pd.DataFrame(columns=["Data", "Valor", "id_original"]), regras=pd.DataFrame([_regra(1, "2026-01-05", 3)]))
+    assert store.horizon() is None
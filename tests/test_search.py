@@ -0,0 +1,42 @@
+import pandas as pd
+
+from search import SearchIndex
+from store import ExpenseStore
+
+
+def _despesas(descricoes, primeiro_id=0):
+    return pd.DataFrame({
+        "Data": pd.Timestamp("2026-01-01"), "Categoria": "Casa", "Tag": "", "Valor": 1.0,
+        "Descricao": descricoes, "Pagamento": "Pix", "Usuario": "Ana",
+        "id_original": range(primeiro_id, primeiro_id + len(descricoes)),
+    })
+
+
+def test_busca_sem_acentos_e_por_trecho():
+    indice = SearchIndex.from_frame(_despesas(["Padaria São João", "Mercado", "Pão de queijo"]))
+    assert indice.search("sao").tolist() == [0]
+    assert indice.search("PÃO").tolist() == [2]
+    assert indice.search("erca").tolist() == [1]
+    assert indice.search("").tolist() == [0, 1, 2]
+
+
+def test_copia_nao_altera_o_original():
+    indice = SearchIndex.from_frame(_despesas(["mercado", "padaria"]))
+    copia = indice.copy()
+    copia.add(_despesas(["mercado central"], primeiro_id=2))
+    copia.remove([0])
+    assert indice.search("mercado").tolist() == [0]
+    assert copia.search("mercado").tolist() == [2]
+
+
+def test_apply_publica_um_indice_novo():
+    store = ExpenseStore()
+    store.replace(_despesas(["mercado", "padaria", "farmacia"]))
+    assert store.search("mercado").tolist() == [0]
+    publicado = store._busca
+
+    editada = store.df.iloc[[1]].assign(Descricao="mercado da esquina")
+    store.apply(novas=_despesas(["supermercado"], primeiro_id=3), alteradas=editada, excluidas=[0])
+    # Quem já tinha o índice anterior continua vendo o estado da versão anterior
+    assert publicado.search("mercado").tolist() == [0]
+    assert store.search("mercado").tolist() == [1, 3]
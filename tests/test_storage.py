@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sheets import SheetsConnection
+from storage import PARTICAO_SEM_DATA, SheetsStorage, SQLiteStorage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_sheets import FakeClient  # noqa: E402
+
+
+def _despesas(n=3000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Data": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 1300, n), unit="D"),
+        "Categoria": "Casa", "Tag": "", "Valor": rng.integers(1, 10_000, n) / 100, "Descricao": "d",
+        "Pagamento": "Pix", "Usuario": "Ana", "id_original": np.arange(n),
+    })
+    df.loc[5, "Data"] = pd.NaT
+    return df
+
+
+@pytest.fixture
+def cliente():
+    return FakeClient(latencia=0, segundos_por_mil_celulas=0)
+
+
+def _sheets(cliente):
+    planilha = cliente.criar_planilha("Planilha")
+    planilha.add_worksheet("Despesas", [])
+    return SheetsStorage(SheetsConnection(cliente, "Planilha", planilha.id), "Despesas")
+
+
+@pytest.fixture(params=["sheets", "sqlite"])
+def storage(request, cliente, tmp_path):
+    if request.param == "sheets":
+        return _sheets(cliente)
+    return SQLiteStorage(str(tmp_path / "despesas.db"))
+
+
+def test_load_with_catalog_igual_a_catalog_e_load(storage):
+    assert storage.load_with_catalog([2025])[0] == {"particoes": [], "maior_id": -1}
+    storage.replace_all(_despesas())
+    particoes = [2025, PARTICAO_SEM_DATA]
+    catalogo, df = storage.load_with_catalog(particoes + [2031])
+    assert catalogo == storage.catalog()
+    assert catalogo["maior_id"] == 2999
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), storage.load(particoes).reset_index(drop=True))
+
+
+def test_load_with_catalog_le_as_colunas_uma_vez(cliente):
+    storage = _sheets(cliente)
+    storage.replace_all(_despesas())
+    storage.catalog()
+    cliente.chamadas.clear()
+    storage.catalog()
+    storage.load([2025])
+    separados = dict(cliente.chamadas)
+    cliente.chamadas.clear()
+    storage.load_with_catalog([2025])
+    # Uma leitura das colunas Data e id_original a menos (o cabeçalho já está no cache)
+    assert cliente.chamadas["batch_get"] == separados["batch_get"] - 1
@@ -0,0 +1,53 @@
+# ======================== IMPORTS ========================
+import threading
+from datetime import datetime
+
+# ======================== CONSTANTES ========================
+INTERVALO_VERIFICACAO = 15.0  # segundos entre duas consultas à revisão do backend
+
+
+# ======================== VIGIA DE REVISÃO ========================
+class RevisionWatcher:
+    """
+    Thread de fundo que consulta a revisão do backend (`storage.revision()`: o modifiedTime
+    da planilha no Drive, ou o contador do SQLite) a cada `intervalo` segundos.
+
+    A consulta não baixa nenhuma despesa. Só quando a revisão muda `ao_mudar(revisao)`
+    é chamado para recarregar os dados; se ele devolver False (não foi possível agora,
+    por exemplo com escritas ainda na fila), a mesma revisão é tentada de novo na próxima
+    consulta. Revisão None (API indisponível) é ignorada. `verificar_agora` antecipa a
+    próxima consulta, que chama `ao_mudar` mesmo se a revisão for a já aplicada.
+    """
+
+    def __init__(self, storage, ao_mudar, intervalo=INTERVALO_VERIFICACAO):
+        self.storage = storage
+        self.ao_mudar = ao_mudar
+        self.intervalo = intervalo
+        self.revisao = None  # última revisão aplicada
+        self.ultima_verificacao = None
+        self.ultimo_erro = None
+        self._acordar = threading.Event()
+        self._thread = threading.Thread(target=self._trabalhar, name="revision-watcher", daemon=True)
+        self._thread.start()
+
+    def verificar_agora(self):
+        """Faz a próxima consulta imediatamente, sem esperar o intervalo."""
+        self._acordar.set()
+
+    def _verificar(self, forcar=False):
+        revisao = self.storage.revision()
+        self.ultima_verificacao = datetime.now()
+        if revisao is None or (revisao == self.revisao and not forcar):
+            return
+        if self.ao_mudar(revisao) is not False:
+            self.revisao = revisao
+
+    def _trabalhar(self):
+        while True:
+            forcar = self._acordar.wait(timeout=self.intervalo)
+            self._acordar.clear()
+            try:
+                self._verificar(forcar)
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = f"{type(e).__name__}: {e}"
@@ -0,0 +1,412 @@
+# ======================== IMPORTS ========================
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from sheets import erro_temporario, requisicao_recusada
+from storage import SEQUENCIA_DESPESAS, SEQUENCIA_REGRAS, resultado_da_escrita
+
+# ======================== CONSTANTES ========================
+MAX_TENTATIVAS = 5          # tentativas por lote antes de desistir até a próxima escrita
+ESPERA_BASE = 1.0           # segundos; dobra a cada tentativa (com jitter)
+JANELA_AGRUPAMENTO = 0.5    # segundos esperando mais escritas antes de enviar um lote
+INTERVALO_NOVA_TENTATIVA = 60.0  # segundos até tentar de novo um lote que falhou
+OPS_REGRAS = {"append_rules", "delete_rules"}  # mutações das regras de recorrência
+# Mutações que acrescentam linhas (não idempotentes) e a sequência dos ids delas
+OPS_ACRESCIMO = {"append": SEQUENCIA_DESPESAS, "append_rules": SEQUENCIA_REGRAS}
+COLUNAS_DATA = ["Data", "Inicio"]  # Data das despesas e Inicio das regras
+SUFIXO_FALHAS = "_falhas"  # journal_path + sufixo: entradas que o backend recusou
+
+
+# ======================== SERIALIZAÇÃO ========================
+def _df_para_registros(df):
+    """Converte o DataFrame (despesas ou regras) em dicionários serializáveis em JSON."""
+    df = df.copy()
+    for col in COLUNAS_DATA:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce").dt.strftime("%Y-%m-%d")
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient="records")
+
+
+def _registros_para_df(registros):
+    df = pd.DataFrame(registros)
+    if not df.empty:
+        for col in COLUNAS_DATA:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+        for col in ["id_original", "id_regra"]:
+            if col in df.columns:
+                df[col] = df[col].astype(int)
+    return df
+
+
+def _erro_temporario(erro):
+    """Erros que justificam tentar o lote de novo: os temporários do Sheets, banco SQLite ocupado e falhas de E/S."""
+    return isinstance(erro, (sqlite3.OperationalError, OSError)) or erro_temporario(erro)
+
+
+def _talvez_aplicado(erro):
+    """
+    Erro temporário depois do qual a escrita pode ter sido aplicada: tudo menos as recusas
+    do Sheets (ver sheets.requisicao_recusada) e os erros do SQLite, que desfaz a transação.
+    """
+    return not (isinstance(erro, sqlite3.Error) or requisicao_recusada(erro))
+
+
+# ======================== FILA ========================
+class WriteBehindQueue:
+    """
+    Fila de escrita assíncrona (write-behind) na frente de um ExpenseStorage.
+
+    Cada mutação é gravada primeiro num journal local (um JSON por linha, com fsync),
+    de modo que nada se perde se o processo reiniciar: as entradas pendentes são
+    reenviadas na próxima inicialização (as de acréscimo conferidas antes, ver abaixo). Uma thread de fundo agrupa as mutações
+    consecutivas do mesmo tipo e as aplica no backend com novas tentativas e
+    espera exponencial.
+
+    Cada entrada guarda a revisão do backend que a sessão tinha carregado. Antes de
+    cada lote a fila compara a revisão atual com a esperada (a da entrada, ou a que
+    resultou do último lote enviado): se outra pessoa gravou no meio, marca `divergiu`,
+    para o app recarregar em vez de dar o store por sincronizado. As edições levam as
+    linhas originais, e o backend grava só as células alteradas, mescladas por
+    id_original (ver storage.mesclar_alteracoes); as que outra pessoa também alterou
+    ficam com o valor dela e vão para `status()["conflitos"]`.
+
+    Quando o backend informa as revisões exatas de cada escrita (ver
+    storage.resultado_da_escrita), a fila encadeia os lotes por elas e expõe em
+    `revisao_sincronizada` a revisão que contém só as nossas escritas. Uma revisão lida
+    depois do lote pode já incluir a gravação de outra pessoa, então não serve para isso.
+    Se a fila esvazia sem essa revisão, `on_stale` é chamado: o store precisa ser
+    recarregado do backend.
+
+    Só erros temporários (ver _erro_temporario) mantêm um lote na fila para novas
+    tentativas. Acrescentar linhas não é idempotente: depois de um erro em que a escrita
+    pode ter sido aplicada (um 5xx ou uma falha de rede), as entradas ficam marcadas e o
+    próximo envio consulta o backend (`existing_ids`) e só acrescenta as linhas que faltam. Uma entrada que o backend recusa de vez sai da fila, para não bloquear as
+    seguintes, e vai para um segundo journal (`falhas_path`); ela aparece em
+    `status()["falhas"]` até `clear_failed` e a fila marca `divergiu`, para o app
+    recarregar o store sem a mudança recusada.
+    """
+
+    def __init__(self, storage, journal_path, on_flush=None, on_stale=None):
+        self.storage = storage
+        self.journal_path = journal_path
+        self.on_flush = on_flush
+        self.on_stale = on_stale
+        raiz, extensao = os.path.splitext(journal_path)
+        self.falhas_path = raiz + SUFIXO_FALHAS + extensao
+
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._pendentes = self._ler_journal(self.journal_path)
+        self._proximo_seq = max((e["seq"] for e in self._pendentes), default=0) + 1
+        self.ultimo_erro = None
+        self.ultima_sincronizacao = None
+        self.divergiu = False          # outra pessoa gravou no backend desde a revisão das entradas
+        self._revisao_esperada = None  # revisão deixada pelo último lote enviado
+        self._exata = True             # todos os lotes desde a última vez vazia vieram com revisões exatas
+        self._conflitos = []
+        self._falhas = self._ler_journal(self.falhas_path)
+        # seq das entradas de acréscimo que podem já estar no backend. As do journal de uma
+        # execução anterior também: o processo pode ter caído depois de gravar e antes de
+        # tirá-las do journal
+        self._a_conferir = {e["seq"] for e in self._pendentes if e["op"] in OPS_ACRESCIMO}
+
+        self._thread = threading.Thread(target=self._trabalhar, name="write-behind", daemon=True)
+        self._thread.start()
+        if self._pendentes:
+            self._evento.set()
+
+    # --- journal ---
+    @staticmethod
+    def _ler_journal(caminho):
+        if not os.path.exists(caminho):
+            return []
+        entradas = []
+        with open(caminho, encoding="utf-8") as f:
+            for linha in f:
+                linha = linha.strip()
+                if not linha:
+                    continue
+                try:
+                    entradas.append(json.loads(linha))
+                except json.JSONDecodeError:
+                    # Linha truncada por uma queda no meio da escrita: é a última, pode ser ignorada
+                    break
+        return entradas
+
+    def _reescrever_journal(self):
+        """Regrava o journal só com as entradas ainda pendentes (chamado com o lock adquirido)."""
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entrada in self._pendentes:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path)
+
+    @staticmethod
+    def _acrescentar_no_arquivo(caminho, entrada):
+        with open(caminho, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _registrar(self, op, **dados):
+        diretorio = os.path.dirname(self.journal_path)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        with self._lock:
+            entrada = {"seq": self._proximo_seq, "op": op, **dados}
+            self._proximo_seq += 1
+            if op == "replace":
+                # Uma regravação completa torna inúteis as mutações anteriores ainda não enviadas
+                # (menos as das regras de recorrência, que ela não regrava)
+                self._pendentes = [e for e in self._pendentes if e["op"] in OPS_REGRAS] + [entrada]
+                self._reescrever_journal()
+            else:
+                self._pendentes.append(entrada)
+                self._acrescentar_no_arquivo(self.journal_path, entrada)
+        self._evento.set()
+
+    # --- API pública ---
+    # `revisao` é a revisão do backend que a sessão tinha carregado ao fazer a mudança.
+    def append(self, df, revisao=None):
+        self._registrar("append", rows=_df_para_registros(df), revisao=revisao)
+
+    def update(self, df, originais=None, revisao=None):
+        """Edita linhas; `originais` são as mesmas linhas como a sessão as leu (para o merge)."""
+        dados = {} if originais is None else {"originais": _df_para_registros(originais)}
+        self._registrar("update", rows=_df_para_registros(df), revisao=revisao, **dados)
+
+    def delete(self, ids, revisao=None):
+        self._registrar("delete", ids=[int(id_) for id_ in ids], revisao=revisao)
+
+    def replace_all(self, df, revisao=None):
+        self._registrar("replace", rows=_df_para_registros(df), revisao=revisao)
+
+    def append_rules(self, df, revisao=None):
+        self._registrar("append_rules", rows=_df_para_registros(df), revisao=revisao)
+
+    def delete_rules(self, ids, revisao=None):
+        self._registrar("delete_rules", ids=[int(id_) for id_ in ids], revisao=revisao)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pendentes)
+
+    def status(self):
+        """
+        Resumo para a interface: quantidade pendente, último erro, hora da última sincronização,
+        id_original das edições em conflito com as de outra pessoa e as entradas recusadas
+        pelo backend (operação, quantidade de linhas ou ids, erro e hora).
+        """
+        with self._lock:
+            return {
+                "pendentes": len(self._pendentes),
+                "erro": self.ultimo_erro,
+                "ultima_sincronizacao": self.ultima_sincronizacao,
+                "conflitos": list(self._conflitos),
+                "falhas": [
+                    {"op": e["op"], "quantidade": len(e.get("rows", e.get("ids", []))), "erro": e["erro"], "quando": e["quando"]}
+                    for e in self._falhas
+                ],
+            }
+
+    @property
+    def revisao_sincronizada(self):
+        """
+        Revisão do backend produzida pelo último lote, quando é garantido que ela contém
+        exatamente as escritas desta fila sobre a revisão que as sessões tinham carregado, sem
+        gravações de mais ninguém no meio. None quando não há essa garantia.
+        """
+        if self.divergiu or not self._exata:
+            return None
+        return self._revisao_esperada
+
+    def clear_conflicts(self):
+        """Descarta os conflitos já mostrados ao usuário."""
+        with self._lock:
+            self._conflitos = []
+
+    def clear_failed(self):
+        """Esquece as entradas recusadas já mostradas ao usuário (e apaga o arquivo delas)."""
+        with self._lock:
+            self._falhas = []
+            if os.path.exists(self.falhas_path):
+                os.remove(self.falhas_path)
+
+    def wait_idle(self, timeout=None):
+        """Bloqueia até a fila esvaziar (útil em scripts e testes). Devolve True se esvaziou."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self.pending_count():
+            if limite is not None and time.monotonic() > limite:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # --- worker ---
+    def _proximo_lote(self, separar=False):
+        """Junta as entradas pendentes consecutivas do mesmo tipo num único lote (uma só, se `separar`)."""
+        with self._lock:
+            if not self._pendentes:
+                return None, []
+            op = self._pendentes[0]["op"]
+            entradas = []
+            for entrada in self._pendentes:
+                if entrada["op"] != op or ((op == "replace" or separar) and entradas):
+                    break
+                entradas.append(entrada)
+        return op, entradas
+
+    def _verificar_revisao(self, entradas):
+        """
+        Revisão que o backend deveria ter se ninguém mais gravou (None se desconhecida),
+        marcando `divergiu` quando a atual é outra.
+        """
+        base = self._revisao_esperada if self._revisao_esperada is not None else entradas[0].get("revisao")
+        if base is not None and not self.divergiu and self.storage.revision() != base:
+            self.divergiu = True
+        return base
+
+    def _acompanhar_revisao(self, base, resultado):
+        """
+        Atualiza a revisão esperada depois de um lote enviado a partir de `base`. Com as
+        revisões exatas da escrita, uma anterior diferente de `base` é a gravação de outra
+        pessoa. Sem elas, a revisão lida agora serve de base para o próximo lote, mas não
+        pode ser dada como só nossa.
+        """
+        if resultado["revisao"] is None or base is None:
+            self._exata = False
+        elif resultado["revisao_anterior"] != base:
+            self.divergiu = True
+        # Depois de uma divergência a revisão esperada fica velha de propósito: os
+        # próximos lotes (uma regravação completa, por exemplo) também não apagam nada
+        if not self.divergiu:
+            self._revisao_esperada = resultado["revisao"] or self.storage.revision()
+
+    def _aplicar(self, op, entradas, base=None):
+        """Envia o lote ao backend e devolve o resultado da escrita (ver storage.resultado_da_escrita)."""
+        if op in ("delete", "delete_rules"):
+            ids = sorted({id_ for e in entradas for id_ in e["ids"]})
+            if op == "delete":
+                return self.storage.delete(ids)
+            return self.storage.delete_rules(ids)
+        registros = [r for e in entradas for r in e["rows"]]
+        df = _registros_para_df(registros)
+        if op in OPS_ACRESCIMO and any(e["seq"] in self._a_conferir for e in entradas):
+            # Um envio anterior pode ter sido aplicado: acrescenta só as linhas que faltam
+            coluna = OPS_ACRESCIMO[op]
+            existentes = self.storage.existing_ids(df[coluna].tolist(), OPS_ACRESCIMO[op])
+            df = df[~df[coluna].isin(existentes)]
+            if df.empty:
+                return resultado_da_escrita()  # sem revisão exata: o app recarrega
+        if op == "append":
+            return self.storage.append(df)
+        if op == "update":
+            # Várias edições da mesma linha: vale a última, comparada com o original da primeira
+            originais = [r for e in entradas for r in e.get("originais", [])]
+            originais = _registros_para_df(originais).drop_duplicates("id_original") if originais else None
+            resultado = self.storage.update(df.drop_duplicates("id_original", keep="last"), originais=originais)
+            if resultado["conflitos"]:
+                with self._lock:
+                    self._conflitos = sorted(set(self._conflitos) | {int(id_) for id_ in resultado["conflitos"]})
+                self.divergiu = True
+            return resultado
+        if op == "replace":
+            # Se o backend mudou desde `base`, o storage grava por id_original sem apagar nada
+            return self.storage.replace_all(df, revisao=base)
+        return self.storage.append_rules(df)
+
+    def _trabalhar(self):
+        while True:
+            self._evento.wait(timeout=INTERVALO_NOVA_TENTATIVA if self.ultimo_erro else None)
+            self._evento.clear()
+            time.sleep(JANELA_AGRUPAMENTO)  # dá tempo para uma rajada de cliques se acumular
+
+            separar = False
+            while True:
+                op, entradas = self._proximo_lote(separar)
+                if not entradas:
+                    break
+                try:
+                    enviado = self._enviar_com_tentativas(op, entradas)
+                except Exception as e:
+                    if len(entradas) > 1:
+                        # O backend recusou o lote: as entradas vão uma a uma para achar a recusada
+                        separar = True
+                        continue
+                    vazia = self._mover_para_falhas(entradas[0], e)
+                    separar = False
+                else:
+                    if enviado is None:
+                        break
+                    self._acompanhar_revisao(*enviado)
+                    enviados = {e["seq"] for e in entradas}
+                    with self._lock:
+                        self._a_conferir -= enviados
+                        self._pendentes = [e for e in self._pendentes if e["seq"] not in enviados]
+                        self._reescrever_journal()
+                        self.ultimo_erro = None
+                        self.ultima_sincronizacao = datetime.now()
+                        vazia = not self._pendentes
+                if self.on_flush is not None:
+                    try:
+                        self.on_flush()
+                    except Exception:
+                        pass
+                if vazia and self.revisao_sincronizada is None and self.on_stale is not None:
+                    try:
+                        self.on_stale()
+                    except Exception:
+                        pass
+                if vazia:
+                    # O app já recarregou (ou vai recarregar) a partir do backend: as próximas
+                    # entradas trazem a revisão que tiverem lido
+                    self.divergiu = False
+                    self._revisao_esperada = None
+                    self._exata = True
+
+    def _enviar_com_tentativas(self, op, entradas):
+        """
+        Envia o lote; devolve (revisão base, resultado da escrita), ou None se todas as
+        tentativas falharam com erros temporários. Um erro permanente sobe na hora.
+        """
+        for tentativa in range(MAX_TENTATIVAS):
+            try:
+                base = self._verificar_revisao(entradas)
+                return base, self._aplicar(op, entradas, base)
+            except Exception as e:
+                if not _erro_temporario(e):
+                    raise
+                if op in OPS_ACRESCIMO and _talvez_aplicado(e):
+                    with self._lock:
+                        self._a_conferir |= {entrada["seq"] for entrada in entradas}
+                self.ultimo_erro = f"{type(e).__name__}: {e}"
+                if tentativa + 1 < MAX_TENTATIVAS:
+                    espera = ESPERA_BASE * 2 ** tentativa
+                    time.sleep(espera + random.uniform(0, espera))
+        return None
+
+    def _mover_para_falhas(self, entrada, erro):
+        """
+        Tira da fila uma entrada recusada pelo backend e a guarda no arquivo de falhas.
+        O store ainda tem a mudança: `divergiu` faz o app recarregá-lo. Devolve se a fila esvaziou.
+        """
+        falha = {**entrada, "erro": f"{type(erro).__name__}: {erro}", "quando": datetime.now().isoformat(timespec="seconds")}
+        self.divergiu = True
+        with self._lock:
+            self._acrescentar_no_arquivo(self.falhas_path, falha)
+            self._falhas.append(falha)
+            self._pendentes = [e for e in self._pendentes if e["seq"] != entrada["seq"]]
+            self._a_conferir.discard(entrada["seq"])
+            self._reescrever_journal()
+            self.ultimo_erro = None
+            return not self._pendentes